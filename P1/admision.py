@@ -0,0 +1,84 @@
+# Control de admisión -> Límite de conexiones y de peticiones por IP (token bucket)
+#
+# Los límites son por proceso: en modo pre-fork cada trabajador aplica los suyos.
+# Los límites por IP no se aplican a loopback salvo con LIMITAR_LOOPBACK: todas las conexiones
+# del benchmark llegan desde 127.0.0.1 y compartirían un solo cubo. Solo server.py tiene
+# control de admisión; server_async.py no limita, así que se comparan ambos sin él.
+
+import collections
+
+MAX_CONNECTIONS = 10000 # Conexiones simultáneas; las siguientes se rechazan al aceptarlas
+MAX_CONNECTIONS_PER_IP = 256
+RATE_LIMIT = 500.0 # Tokens por segundo que recupera cada IP (0 desactiva el límite de peticiones)
+RATE_BURST = 1000.0 # Capacidad del cubo: ráfaga que se admite sin esperar
+MAX_IPS = 65536 # Cubos que se conservan; se descartan los de las IPs menos recientes
+LIMITAR_LOOPBACK = False # Aplica también a 127.0.0.0/8 y ::1 los límites por IP
+
+# Costo en tokens de cada comando (1 por defecto): los que recorren o serializan
+# mucho catálogo cuestan más, así un cliente que los repite agota antes su cubo
+COSTO_COMANDOS = {
+    "VER_PRODUCTOS": 10,
+    "BUSCAR": 3,
+    "LISTAR": 3,
+    "LISTAR_RANGO": 3,
+    "BATCH": 5,
+    "FINALIZAR_COMPRA": 3,
+    "STATS": 5,
+}
+
+CUBOS = collections.OrderedDict() # ip -> CuboTokens, de la menos a la más reciente
+CONEXIONES_POR_IP = {} # ip -> conexiones abiertas
+
+class CuboTokens:
+    # Se recarga a RATE_LIMIT tokens/s hasta RATE_BURST; cada comando consume su costo
+
+    __slots__ = ('tokens', 'actualizado')
+
+    def __init__(self, ahora: float):
+        self.tokens = RATE_BURST
+        self.actualizado = ahora
+
+    def consumir(self, costo: float, ahora: float) -> float:
+        # Devuelve 0 si se consumió el costo, o los segundos que faltan para tenerlo
+        self.tokens = min(RATE_BURST, self.tokens + (ahora - self.actualizado) * RATE_LIMIT)
+        self.actualizado = ahora
+        if self.tokens >= costo:
+            self.tokens -= costo
+            return 0.0
+        return (costo - self.tokens) / RATE_LIMIT
+
+def exenta(ip) -> bool:
+    # Direcciones loopback: no tienen límites por IP salvo con LIMITAR_LOOPBACK
+    return not LIMITAR_LOOPBACK and (ip.startswith("127.") or ip == "::1" or ip.startswith("::ffff:127."))
+
+def motivo_rechazo(conexiones: int, ip) -> str:
+    # Mensaje de rechazo para una conexión nueva, o None si se admite
+    if conexiones >= MAX_CONNECTIONS:
+        return "Servidor ocupado. Intente mas tarde."
+    if not exenta(ip) and CONEXIONES_POR_IP.get(ip, 0) >= MAX_CONNECTIONS_PER_IP:
+        return "Demasiadas conexiones desde su direccion."
+    return None
+
+def conectar(ip):
+    CONEXIONES_POR_IP[ip] = CONEXIONES_POR_IP.get(ip, 0) + 1
+
+def desconectar(ip):
+    restantes = CONEXIONES_POR_IP.get(ip, 0) - 1
+    if restantes > 0:
+        CONEXIONES_POR_IP[ip] = restantes
+    else:
+        CONEXIONES_POR_IP.pop(ip, None)
+
+def espera_comando(ip, accion: str, ahora: float) -> float:
+    # Segundos que el comando debe esperar antes de ejecutarse (0 si puede ejecutarse ya)
+    if RATE_LIMIT <= 0 or exenta(ip):
+        return 0.0
+    cubo = CUBOS.get(ip)
+    if cubo is None:
+        cubo = CUBOS[ip] = CuboTokens(ahora)
+        if len(CUBOS) > MAX_IPS:
+            CUBOS.popitem(last=False)
+    else:
+        CUBOS.move_to_end(ip)
+    # Un costo mayor que la ráfaga nunca cabría en el cubo
+    return cubo.consumir(min(COSTO_COMANDOS.get(accion, 1), RATE_BURST), ahora)
@@ -0,0 +1,374 @@
+# Almacenamiento del inventario -> JSON completo en memoria o SQLite (WAL) con filas bajo demanda
+#
+# Los dos almacenes exponen lo mismo a tienda.py: cargar() devuelve el mapeo id -> producto
+# e indices() los objetos de consulta (misma interfaz que los de indices.py).
+# - AlmacenJSON: instantánea JSON + diario; todo el catálogo en un dict indexado en memoria.
+# - AlmacenSQLite: una fila por producto; las filas se leen al pedirlas (con una caché LRU),
+#   las consultas usan los índices de SQLite y cada compra es una transacción que
+#   actualiza solo las filas afectadas. El arranque y la memoria no dependen del catálogo.
+
+import collections
+import collections.abc
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+import diario
+import indices
+import recarga
+
+log = logging.getLogger(__name__)
+
+SQLITE_FILE = 'inventario.db'
+CACHE_FILAS = 4096 # Productos decodificados que se conservan por proceso
+BUSY_TIMEOUT_MS = 5000 # Espera máxima por el lock de escritura de otro proceso
+
+class AlmacenJSON:
+    # Comportamiento original: el archivo es la última instantánea y el diario las compras posteriores
+
+    EN_MEMORIA = True # El stock vive en el dict (o en la memoria compartida de tienda)
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.firma = None # Firma del archivo cargado (ver recarga.firma)
+        self.stock_archivo = {} # id -> stock tal como figura en el archivo, antes del diario
+
+    def leer(self) -> tuple:
+        # (inventario tal como está en el archivo, firma de la versión leída).
+        # Lanza FileNotFoundError, json.JSONDecodeError u OSError
+        with open(self.ruta, 'r') as f:
+            firma = recarga.firma(os.fstat(f.fileno()))
+            inventario = json.load(f)
+        return inventario, firma
+
+    def cargar(self) -> dict:
+        inventario, self.firma = self.leer()
+        self.stock_archivo = {id: producto.get('stock', 0) for id, producto in inventario.items()}
+        aplicadas = diario.reproducir(inventario)
+        log.info(f"Inventario cargado exitosamente ({aplicadas} entradas del diario aplicadas).")
+        return inventario
+
+    def indices(self, inventario) -> tuple:
+        # (texto, tipo, marca, precio, stock)
+        return (indices.IndiceTrigramas().construir(inventario),
+                indices.IndiceSecundario('tipo').construir(inventario),
+                indices.IndiceSecundario('marca').construir(inventario),
+                indices.IndiceRango('precio').construir(inventario),
+                indices.IndiceRango('stock').construir(inventario))
+
+    def guardar(self, inventario, stock: dict):
+        # Instantánea completa: se escribe en un temporal y se reemplaza el archivo
+        # para que una caída no lo corrompa. Devuelve la firma del archivo escrito.
+        instantanea = {id: dict(producto, stock=stock[id]) for id, producto in inventario.items() if id in stock}
+        temporal = f"{self.ruta}.tmp"
+        with open(temporal, 'w') as f:
+            json.dump(instantanea, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+            firma = recarga.firma(os.fstat(f.fileno()))
+        os.replace(temporal, self.ruta)
+        return firma
+
+    def transaccion(self, durable=False):
+        # Las operaciones del dict ya están serializadas por STOCK_LOCK
+        return contextlib.nullcontext()
+
+class AlmacenSQLite:
+    # Una conexión por proceso e hilo (SQLite no admite compartirlas tras un fork).
+    # Las reservas de carrito se guardan en la columna 'reservado', así los trabajadores
+    # pre-fork las ven sin memoria compartida; al arrancar se ponen a cero.
+
+    EN_MEMORIA = False
+
+    ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS productos (
+            id TEXT PRIMARY KEY,
+            nombre TEXT NOT NULL DEFAULT '',
+            marca TEXT NOT NULL DEFAULT '',
+            tipo TEXT NOT NULL DEFAULT '',
+            precio REAL NOT NULL DEFAULT 0,
+            stock INTEGER NOT NULL DEFAULT 0,
+            reservado INTEGER NOT NULL DEFAULT 0,
+            datos TEXT NOT NULL -- Producto completo en JSON (el stock se toma de su columna)
+        );
+        CREATE INDEX IF NOT EXISTS productos_tipo ON productos (tipo COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS productos_marca ON productos (marca COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS productos_precio ON productos (precio);
+        CREATE INDEX IF NOT EXISTS productos_stock ON productos (stock);
+        CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor INTEGER NOT NULL);
+        INSERT OR IGNORE INTO meta VALUES ('version_stock', 0);
+    """
+
+    # Búsqueda por subcadena con el tokenizador trigram de FTS5 (si SQLite lo incluye)
+    ESQUEMA_BUSQUEDA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS busqueda USING fts5(
+            nombre, marca, content='productos', content_rowid='rowid', tokenize='trigram');
+        CREATE TRIGGER IF NOT EXISTS busqueda_alta AFTER INSERT ON productos BEGIN
+            INSERT INTO busqueda (rowid, nombre, marca) VALUES (new.rowid, new.nombre, new.marca);
+        END;
+        CREATE TRIGGER IF NOT EXISTS busqueda_baja AFTER DELETE ON productos BEGIN
+            INSERT INTO busqueda (busqueda, rowid, nombre, marca) VALUES ('delete', old.rowid, old.nombre, old.marca);
+        END;
+        CREATE TRIGGER IF NOT EXISTS busqueda_cambio AFTER UPDATE OF nombre, marca ON productos BEGIN
+            INSERT INTO busqueda (busqueda, rowid, nombre, marca) VALUES ('delete', old.rowid, old.nombre, old.marca);
+            INSERT INTO busqueda (rowid, nombre, marca) VALUES (new.rowid, new.nombre, new.marca);
+        END;
+    """
+
+    def __init__(self, ruta, ruta_json=None):
+        self.ruta = ruta
+        self.ruta_json = ruta_json # Instantánea JSON que se importa si la base está vacía
+        self.local = threading.local()
+        self.fts = False
+        self.productos = ProductosSQLite(self)
+
+    def conexion(self) -> sqlite3.Connection:
+        local = self.local
+        if getattr(local, 'pid', None) != os.getpid():
+            # isolation_level=None: las transacciones se abren explícitamente en transaccion()
+            local.con = sqlite3.connect(self.ruta, isolation_level=None, check_same_thread=False)
+            local.con.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+            local.con.execute("PRAGMA journal_mode = WAL")
+            local.con.execute("PRAGMA synchronous = NORMAL") # Las compras se hacen durables con sincronizar()
+            local.pid = os.getpid()
+        return local.con
+
+    @contextlib.contextmanager
+    def transaccion(self, durable=False):
+        # BEGIN IMMEDIATE toma el lock de escritura al inicio: validar y descontar no se intercalan
+        # con otro proceso. Con durable=True el COMMIT espera el fsync del WAL.
+        con = self.conexion()
+        if durable:
+            con.execute("PRAGMA synchronous = FULL")
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            yield con
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        else:
+            con.execute("COMMIT")
+        finally:
+            if durable:
+                con.execute("PRAGMA synchronous = NORMAL")
+
+    def sincronizar(self):
+        # fsync del WAL: hace durables los COMMIT ya hechos con synchronous NORMAL, de cualquier
+        # conexión. Sin WAL no hay nada pendiente: un checkpoint completo sincroniza la base antes de vaciarlo.
+        try:
+            fd = os.open(f"{self.ruta}-wal", os.O_RDONLY)
+        except FileNotFoundError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def restablecer(self):
+        # Tras un fsync fallido del WAL: checkpoint completo (SQLite copia el WAL a la base y la
+        # sincroniza) y fsync de lo que quede. Lanza una excepción si no se pudo.
+        ocupada, _, _ = self.conexion().execute("PRAGMA wal_checkpoint(FULL)").fetchone()
+        if ocupada:
+            raise sqlite3.OperationalError("Checkpoint incompleto: la base está ocupada.")
+        self.sincronizar()
+
+    def cargar(self):
+        con = self.conexion()
+        con.executescript(self.ESQUEMA)
+        try:
+            con.executescript(self.ESQUEMA_BUSQUEDA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            log.warning("SQLite sin FTS5/trigram: BUSCAR recorrerá la tabla.")
+
+        with self.transaccion() as con:
+            vacia = con.execute("SELECT NOT EXISTS (SELECT 1 FROM productos)").fetchone()[0]
+            if vacia and self.ruta_json and os.path.exists(self.ruta_json):
+                importados = self.importar(con, AlmacenJSON(self.ruta_json).cargar())
+                log.info(f"Importados {importados} productos de '{self.ruta_json}' a '{self.ruta}'.")
+            # Las reservas de una ejecución anterior ya no tienen sesión
+            con.execute("UPDATE productos SET reservado = 0 WHERE reservado != 0")
+        log.info(f"Inventario en SQLite '{self.ruta}' ({len(self.productos)} productos, filas bajo demanda).")
+        return self.productos
+
+    def importar(self, con, inventario: dict) -> int:
+        con.executemany(
+            "INSERT OR IGNORE INTO productos (id, nombre, marca, tipo, precio, stock, datos) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (fila_producto(id, producto) for id, producto in inventario.items()))
+        return len(inventario)
+
+    def indices(self, inventario) -> tuple:
+        return (IndiceTextoSQL(self), IndiceSQL(self, 'tipo'), IndiceSQL(self, 'marca'),
+                IndiceSQL(self, 'precio'), IndiceSQL(self, 'stock'))
+
+    def guardar(self, inventario, stock: dict):
+        # Actualización por filas: solo las que cambiaron
+        with self.transaccion(durable=True) as con:
+            con.executemany("UPDATE productos SET stock = ? WHERE id = ? AND stock != ?",
+                            ((cant, id, cant) for id, cant in stock.items()))
+
+    # Stock y reservas: siempre se leen de la base (otro proceso pudo cambiarlos)
+
+    def stock(self, id) -> int:
+        fila = self.conexion().execute("SELECT stock FROM productos WHERE id = ?", (id,)).fetchone()
+        return fila[0] if fila else 0
+
+    def reservado(self, id) -> int:
+        fila = self.conexion().execute("SELECT reservado FROM productos WHERE id = ?", (id,)).fetchone()
+        return fila[0] if fila else 0
+
+    def sumar_reservado(self, id, delta: int):
+        self.conexion().execute("UPDATE productos SET reservado = reservado + ? WHERE id = ?", (delta, id))
+
+    def descontar(self, lineas: dict) -> dict:
+        # Se llama dentro de transaccion(); devuelve id -> stock resultante
+        con = self.conexion()
+        stocks = {}
+        for id, cant in lineas.items():
+            con.execute("UPDATE productos SET stock = stock - ? WHERE id = ?", (cant, id))
+            stocks[id] = con.execute("SELECT stock FROM productos WHERE id = ?", (id,)).fetchone()[0]
+        con.execute("UPDATE meta SET valor = valor + 1 WHERE clave = 'version_stock'")
+        return stocks
+
+    def version(self) -> int:
+        # Aumenta con cada compra confirmada en cualquier proceso
+        return self.conexion().execute("SELECT valor FROM meta WHERE clave = 'version_stock'").fetchone()[0]
+
+def fila_producto(id, producto) -> tuple:
+    return (id, producto.get('nombre', ''), producto.get('marca', ''), producto.get('tipo', ''),
+            producto.get('precio', 0), producto.get('stock', 0), json.dumps(producto))
+
+class ProductosSQLite(collections.abc.MutableMapping):
+    # Mapeo id -> producto sobre la tabla, en el orden de inserción (rowid).
+    # Los productos leídos se guardan en una LRU de CACHE_FILAS; olvidar() la vacía
+    # cuando otro proceso cambia el stock.
+
+    def __init__(self, almacen: AlmacenSQLite):
+        self.almacen = almacen
+        self.cache = collections.OrderedDict()
+
+    def olvidar(self):
+        self.cache.clear()
+
+    def __getitem__(self, id):
+        producto = self.cache.get(id)
+        if producto is not None:
+            self.cache.move_to_end(id)
+            return producto
+        fila = self.almacen.conexion().execute("SELECT datos, stock FROM productos WHERE id = ?", (id,)).fetchone()
+        if fila is None:
+            raise KeyError(id)
+        producto = json.loads(fila[0])
+        producto['stock'] = fila[1]
+        self.cache[id] = producto
+        if len(self.cache) > CACHE_FILAS:
+            self.cache.popitem(last=False)
+        return producto
+
+    def __contains__(self, id):
+        if id in self.cache:
+            return True
+        return self.almacen.conexion().execute("SELECT 1 FROM productos WHERE id = ?", (id,)).fetchone() is not None
+
+    def __iter__(self):
+        for (id,) in self.almacen.conexion().execute("SELECT id FROM productos ORDER BY rowid"):
+            yield id
+
+    def __len__(self):
+        return self.almacen.conexion().execute("SELECT count(*) FROM productos").fetchone()[0]
+
+    def items(self):
+        # Recorrido completo sin pasar por la caché (p. ej. para serializar el catálogo)
+        for id, datos, stock in self.almacen.conexion().execute("SELECT id, datos, stock FROM productos ORDER BY rowid"):
+            producto = json.loads(datos)
+            producto['stock'] = stock
+            yield id, producto
+
+    def __setitem__(self, id, producto):
+        # Alta o reemplazo conservando la posición y las reservas del producto
+        with self.almacen.transaccion() as con:
+            con.execute(
+                "INSERT INTO productos (id, nombre, marca, tipo, precio, stock, datos) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET nombre = excluded.nombre, marca = excluded.marca, "
+                "tipo = excluded.tipo, precio = excluded.precio, stock = excluded.stock, datos = excluded.datos",
+                fila_producto(id, producto))
+        self.cache.pop(id, None)
+
+    def __delitem__(self, id):
+        with self.almacen.transaccion() as con:
+            borrados = con.execute("DELETE FROM productos WHERE id = ?", (id,)).rowcount
+        self.cache.pop(id, None)
+        if not borrados:
+            raise KeyError(id)
+
+class IndiceSQL:
+    # Misma interfaz que IndiceSecundario / IndiceRango sobre los índices de la tabla.
+    # SQLite los mantiene al escribir, así que agregar/eliminar/actualizar no hacen nada.
+
+    def __init__(self, almacen: AlmacenSQLite, campo):
+        self.almacen = almacen
+        self.campo = campo
+
+    def agregar(self, id, producto):
+        pass
+
+    def eliminar(self, id):
+        pass
+
+    def actualizar(self, id, valor):
+        pass
+
+    def buscar(self, valor) -> list:
+        # Igualdad sin distinguir mayúsculas, en orden del inventario
+        consulta = f"SELECT id FROM productos WHERE {self.campo} = ? COLLATE NOCASE ORDER BY rowid"
+        return [id for (id,) in self.almacen.conexion().execute(consulta, (str(valor),))]
+
+    def rango(self, minimo, maximo) -> list:
+        # Ids con minimo <= valor <= maximo, ordenados por valor
+        consulta = f"SELECT id FROM productos WHERE {self.campo} BETWEEN ? AND ? ORDER BY {self.campo}, rowid"
+        return [id for (id,) in self.almacen.conexion().execute(consulta, (minimo, maximo))]
+
+class IndiceTextoSQL(IndiceSQL):
+    # Misma semántica que IndiceTrigramas.buscar: subcadena de nombre o marca sin
+    # distinguir mayúsculas; FTS5 reduce los candidatos y se verifica en Python
+
+    def __init__(self, almacen: AlmacenSQLite):
+        super().__init__(almacen, 'nombre')
+
+    def buscar(self, consulta: str, limite=None, ranking=False) -> list:
+        consulta = consulta.lower()
+        con = self.almacen.conexion()
+        if self.almacen.fts and len(consulta) >= 3:
+            filas = con.execute(
+                "SELECT p.id, p.nombre, p.marca FROM busqueda JOIN productos p ON p.rowid = busqueda.rowid "
+                "WHERE busqueda MATCH ? ORDER BY p.rowid", ('"' + consulta.replace('"', '""') + '"',))
+        else:
+            filas = con.execute("SELECT id, nombre, marca FROM productos ORDER BY rowid")
+
+        encontrados = []
+        textos = {}
+        for id, nombre, marca in filas:
+            nombre, marca = nombre.lower(), marca.lower()
+            if consulta in nombre or consulta in marca:
+                encontrados.append(id)
+                textos[id] = (nombre, marca)
+            if limite is not None and not ranking and len(encontrados) >= limite:
+                break
+
+        if ranking:
+            encontrados.sort(key=lambda id: puntaje(textos[id], consulta))
+        if limite is not None:
+            encontrados = encontrados[:limite]
+        return encontrados
+
+def puntaje(textos, consulta):
+    # Igual que IndiceTrigramas.puntaje: 0 prefijo del nombre, 1 prefijo de marca o inicio de palabra, 2 el resto
+    nombre, marca = textos
+    if nombre.startswith(consulta):
+        return 0
+    if marca.startswith(consulta) or f" {consulta}" in nombre or f" {consulta}" in marca:
+        return 1
+    return 2
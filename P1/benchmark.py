@@ -0,0 +1,309 @@
+# Benchmark -> Generador de carga sin interfaz para la tienda (protocolo de texto o binario)
+#
+# Abre N conexiones concurrentes (asyncio), repite una mezcla configurable de comandos
+# y reporta en JSON el throughput, los percentiles de latencia y los bytes enviados y
+# recibidos por petición, global y por comando. En texto usa el mismo delimitado y parseo
+# de respuestas que client.py; con --binario cada conexión negocia PROTOCOLO BINARIO y
+# envía los mismos comandos como tramas.
+#
+# Ejemplo: python benchmark.py --conexiones 100 --duracion 20 --mezcla buscar=5,agregar=3,finalizar=1
+#          python benchmark.py --binario --comparar texto.json
+#
+# Todas las conexiones salen de 127.0.0.1: server.py no aplica a loopback sus límites por IP
+# (salvo con --limitar-loopback) y server_async.py no tiene control de admisión, así que
+# ambos se miden sin límites.
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+import client
+import histograma
+import protocolo_binario
+
+# Configuración por defecto
+HOST = client.HOST
+PUERTO = client.PUERTO
+CONEXIONES = 50
+DURACION = 10.0 # Segundos de medición
+CALENTAMIENTO = 1.0 # Segundos iniciales que no se registran
+READ_SIZE = 65536
+MEZCLA_DEFECTO = "ver=1,buscar=4,listar=2,agregar=4,editar=2,carrito=1,finalizar=1"
+
+# Generadores de comandos: (rng, catalogo, estado de la conexión) -> línea a enviar
+
+def comando_ver(rng, catalogo, estado):
+    # Como el cliente interactivo: con la versión en caché (normalmente NOT_MODIFIED)
+    return f"VER_PRODUCTOS {estado['version']}"
+
+def comando_catalogo(rng, catalogo, estado):
+    return "VER_PRODUCTOS"
+
+def comando_pagina(rng, catalogo, estado):
+    return f"VER_PRODUCTOS_PAGINA {rng.randrange(max(len(catalogo['ids']), 1))} 50"
+
+def comando_buscar(rng, catalogo, estado):
+    return f"BUSCAR {rng.choice(catalogo['palabras'])}"
+
+def comando_listar(rng, catalogo, estado):
+    return f"LISTAR {rng.choice(catalogo['tipos'])}"
+
+def comando_agregar(rng, catalogo, estado):
+    return f"AGREGAR_CARRITO {rng.choice(catalogo['ids'])} 1"
+
+def comando_editar(rng, catalogo, estado):
+    return f"EDITAR_CARRITO {rng.choice(catalogo['ids'])} {rng.randint(0, 2)}"
+
+def comando_batch(rng, catalogo, estado):
+    return "BATCH " + "; ".join(f"AGREGAR {rng.choice(catalogo['ids'])} 1" for _ in range(10))
+
+def comando_carrito(rng, catalogo, estado):
+    return "VER_CARRITO"
+
+def comando_finalizar(rng, catalogo, estado):
+    return "FINALIZAR_COMPRA"
+
+GENERADORES = {
+    "ver": comando_ver,
+    "catalogo": comando_catalogo,
+    "pagina": comando_pagina,
+    "buscar": comando_buscar,
+    "listar": comando_listar,
+    "agregar": comando_agregar,
+    "editar": comando_editar,
+    "batch": comando_batch,
+    "carrito": comando_carrito,
+    "finalizar": comando_finalizar,
+}
+
+def parsear_mezcla(texto: str) -> dict:
+    # "buscar=4,agregar=2" -> {"buscar": 4.0, "agregar": 2.0}
+    mezcla = {}
+    for parte in texto.split(','):
+        nombre, _, peso = parte.strip().partition('=')
+        if nombre not in GENERADORES:
+            raise ValueError(f"Comando desconocido en la mezcla: {nombre}. Opciones: {', '.join(GENERADORES)}")
+        mezcla[nombre] = float(peso or 1)
+    if not mezcla or sum(mezcla.values()) <= 0:
+        raise ValueError("La mezcla debe tener al menos un comando con peso positivo.")
+    return mezcla
+
+class ConexionBenchmark:
+    # Una conexión con su propio buffer de recepción, igual que el del cliente interactivo.
+    # Cuenta los bytes enviados y recibidos (el benchmark no encadena peticiones, así que
+    # lo recibido entre el envío y la respuesta es la respuesta)
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.buffer = bytearray()
+        self.offset = 0 # Posición desde la que falta buscar el siguiente salto de línea
+        self.pendientes = []
+        self.binario = False
+        self.enviados = 0
+        self.recibidos = 0
+
+    async def peticion(self, comando: str):
+        # Envía un comando y espera su respuesta completa (una línea, o el payload de una trama)
+        if self.binario:
+            accion, *params = comando.replace(';', ' ; ').split()
+            datos = protocolo_binario.codificar_peticion(accion, params)
+        else:
+            datos = comando.encode('utf-8') + b'\n'
+        self.writer.write(datos)
+        self.enviados += len(datos)
+        return await self.recibir()
+
+    async def recibir(self):
+        while not self.pendientes:
+            data = await self.reader.read(READ_SIZE)
+            if not data:
+                raise ConnectionError("El servidor cerró la conexión.")
+            self.recibidos += len(data)
+            self.buffer += data
+            if self.binario:
+                self.separar_tramas()
+                continue
+            respuestas, inicio = client.separar_respuestas(self.buffer, self.offset)
+            del self.buffer[:inicio]
+            self.offset = len(self.buffer)
+            self.pendientes.extend(respuestas)
+        return self.pendientes.pop(0)
+
+    def separar_tramas(self):
+        # Tramas de respuesta completas; no se aplica MAX_FRAME_SIZE, que limita las peticiones
+        cabecera = protocolo_binario.CABECERA
+        inicio = 0
+        while len(self.buffer) - inicio >= cabecera.size:
+            fin = inicio + cabecera.size + cabecera.unpack_from(self.buffer, inicio)[0]
+            if len(self.buffer) < fin:
+                break
+            self.pendientes.append(bytes(self.buffer[inicio + cabecera.size:fin]))
+            inicio = fin
+        del self.buffer[:inicio]
+
+    def parsear(self, respuesta) -> tuple:
+        if self.binario:
+            return protocolo_binario.decodificar_respuesta(respuesta)
+        return client.parsear_respuesta(respuesta)
+
+    async def usar_binario(self):
+        # La confirmación de PROTOCOLO BINARIO todavía llega en texto
+        status, data = client.parsear_respuesta(await self.peticion("PROTOCOLO BINARIO"))
+        if status != "OK":
+            raise RuntimeError(f"El servidor no aceptó el protocolo binario: {data}")
+        self.binario = True
+
+    def cerrar(self):
+        self.writer.close()
+
+async def abrir_conexion(host, puerto, binario=False) -> ConexionBenchmark:
+    reader, writer = await asyncio.open_connection(host, puerto, limit=READ_SIZE)
+    conexion = ConexionBenchmark(reader, writer)
+    await conexion.recibir() # Saludo SESION con el token; el benchmark no reanuda sesiones
+    if binario:
+        await conexion.usar_binario()
+    return conexion
+
+async def cargar_catalogo(host, puerto) -> dict:
+    # Obtiene el catálogo una vez para generar ids, palabras de búsqueda y tipos válidos
+    conexion = await abrir_conexion(host, puerto)
+    try:
+        status, data = client.parsear_respuesta(await conexion.peticion("VER_PRODUCTOS 0"))
+    finally:
+        conexion.cerrar()
+    if status != "OK" or not data.get('productos'):
+        raise RuntimeError(f"No se pudo obtener el catálogo: {status} {data}")
+    productos = data['productos']
+    palabras = {palabra.lower() for p in productos.values()
+                for palabra in f"{p['nombre']} {p['marca']}".split() if len(palabra) >= 3}
+    return {
+        "ids": list(productos),
+        "palabras": sorted(palabras),
+        "tipos": sorted({p['tipo'] for p in productos.values()}),
+        "version": data['version'],
+    }
+
+async def trabajador(num, args, mezcla, catalogo, resultados, inicio_medicion, fin):
+    # Bucle cerrado: cada conexión envía un comando, espera su respuesta y envía el siguiente
+    rng = random.Random(args.semilla + num)
+    nombres, pesos = list(mezcla), list(mezcla.values())
+    estado = {"version": catalogo['version']}
+    try:
+        conexion = await abrir_conexion(args.host, args.puerto, args.binario)
+    except OSError:
+        resultados['conexiones_fallidas'] += 1
+        return
+    try:
+        while time.monotonic() < fin:
+            nombre = rng.choices(nombres, pesos)[0]
+            comando = GENERADORES[nombre](rng, catalogo, estado)
+            enviados, recibidos = conexion.enviados, conexion.recibidos
+            inicio = time.perf_counter()
+            respuesta = await conexion.peticion(comando)
+            latencia_us = (time.perf_counter() - inicio) * 1e6
+
+            status, data = conexion.parsear(respuesta)
+            if status == "OK" and isinstance(data, dict) and 'version' in data:
+                estado['version'] = data['version']
+            if time.monotonic() < inicio_medicion:
+                continue # Calentamiento
+            por_comando = resultados['comandos'].setdefault(
+                nombre, {"histograma": histograma.Histograma(), "errores": 0, "enviados": 0, "recibidos": 0})
+            por_comando['histograma'].registrar(latencia_us)
+            por_comando['enviados'] += conexion.enviados - enviados
+            por_comando['recibidos'] += conexion.recibidos - recibidos
+            if status == "ERROR":
+                por_comando['errores'] += 1
+    except (ConnectionError, OSError):
+        resultados['conexiones_cortadas'] += 1
+    finally:
+        conexion.cerrar()
+
+def comparar(reporte: dict, anterior: dict) -> dict:
+    # Diferencias relativas (%) de throughput y percentiles globales frente a otro reporte
+    def delta(actual, base):
+        return round((actual - base) / base * 100, 2) if base else None
+    comparacion = {"throughput_rps": delta(reporte['throughput_rps'], anterior['throughput_rps'])}
+    for clave in ("enviados", "recibidos"):
+        if 'bytes_por_peticion' in anterior:
+            comparacion[f"bytes_{clave}"] = delta(reporte['bytes_por_peticion'][clave],
+                                                  anterior['bytes_por_peticion'][clave])
+    for clave in ("p50", "p95", "p99", "p99.9"):
+        comparacion[f"latencia_{clave}"] = delta(reporte['latencia_ms'][clave], anterior['latencia_ms'][clave])
+    return comparacion
+
+async def main_benchmark(args):
+    mezcla = parsear_mezcla(args.mezcla)
+    catalogo = await cargar_catalogo(args.host, args.puerto)
+    resultados = {"comandos": {}, "conexiones_fallidas": 0, "conexiones_cortadas": 0}
+
+    ahora = time.monotonic()
+    inicio_medicion = ahora + args.calentamiento
+    fin = inicio_medicion + args.duracion
+    await asyncio.gather(*(trabajador(num, args, mezcla, catalogo, resultados, inicio_medicion, fin)
+                           for num in range(args.conexiones)))
+
+    def bytes_por_peticion(enviados, recibidos, peticiones):
+        return {"enviados": round(enviados / peticiones, 1) if peticiones else None,
+                "recibidos": round(recibidos / peticiones, 1) if peticiones else None}
+
+    total = histograma.Histograma()
+    comandos = {}
+    for nombre, datos in sorted(resultados['comandos'].items()):
+        total.fusionar(datos['histograma'])
+        comandos[nombre] = dict(datos['histograma'].resumen(escala=1000), errores=datos['errores'],
+                                bytes_por_peticion=bytes_por_peticion(datos['enviados'], datos['recibidos'],
+                                                                      datos['histograma'].total))
+
+    return {
+        "servidor": f"{args.host}:{args.puerto}",
+        "protocolo": "binario" if args.binario else "texto",
+        "conexiones": args.conexiones,
+        "duracion_s": args.duracion,
+        "mezcla": mezcla,
+        "peticiones": total.total,
+        "errores": sum(datos['errores'] for datos in comandos.values()),
+        "throughput_rps": round(total.total / args.duracion, 1),
+        "latencia_ms": total.resumen(escala=1000),
+        "bytes_por_peticion": bytes_por_peticion(sum(datos['enviados'] for datos in resultados['comandos'].values()),
+                                                 sum(datos['recibidos'] for datos in resultados['comandos'].values()),
+                                                 total.total),
+        "comandos": comandos,
+        "conexiones_fallidas": resultados['conexiones_fallidas'],
+        "conexiones_cortadas": resultados['conexiones_cortadas'],
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de carga para el servidor de la tienda")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--puerto', type=int, default=PUERTO)
+    parser.add_argument('--conexiones', type=int, default=CONEXIONES, help="Conexiones concurrentes")
+    parser.add_argument('--duracion', type=float, default=DURACION, help="Segundos de medición")
+    parser.add_argument('--calentamiento', type=float, default=CALENTAMIENTO, help="Segundos iniciales sin registrar")
+    parser.add_argument('--mezcla', default=MEZCLA_DEFECTO,
+                        help=f"Pesos por comando ({', '.join(GENERADORES)}). Por defecto: {MEZCLA_DEFECTO}")
+    parser.add_argument('--binario', action='store_true',
+                        help="Negocia PROTOCOLO BINARIO en cada conexión (tramas msgpack) en lugar de texto")
+    parser.add_argument('--semilla', type=int, default=1, help="Semilla para repetir la misma secuencia")
+    parser.add_argument('--salida', help="Archivo donde guardar el reporte JSON (además de imprimirlo)")
+    parser.add_argument('--comparar', help="Reporte JSON anterior para calcular la diferencia")
+    args = parser.parse_args()
+
+    try:
+        reporte = asyncio.run(main_benchmark(args))
+    except (OSError, RuntimeError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr); sys.exit(1)
+
+    if args.comparar:
+        with open(args.comparar) as f:
+            reporte['comparacion'] = comparar(reporte, json.load(f))
+
+    texto = json.dumps(reporte, indent=4, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w') as f:
+            f.write(texto + "\n")
+    print(texto)
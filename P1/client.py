@@ -17,7 +17,17 @@ BUFFER_SIZE = 4096
 accion = "" 
 
 # Buffer para reconstruir mensajes del servidor
-RECEIVE_BUFFER = b'' 
+RECEIVE_BUFFER = bytearray()
+RECEIVE_OFFSET = 0 # Posición desde la que falta buscar el siguiente salto de línea
+
+# Última versión del catálogo recibida; el servidor responde NOT_MODIFIED si no cambió
+CATALOGO_VERSION = "0"
+CATALOGO_CACHE = {}
+
+# Sesión en el servidor: el token se guarda para recuperar el carrito al reconectar
+SESION_ARCHIVO = '.sesion_tienda'
+SESION_NUEVA = None # Token del saludo, por si el servidor ya no tiene la sesión anterior
+RESUME_PENDIENTE = False # Se envió RESUME y falta su respuesta
 
 # Variables de control
 FLAG_EXIT = False # Variable para terminar el cliente
@@ -107,26 +117,90 @@ def mostrar_ticket(ticket):
     print("=" * 50)
     print("Vuelva pronto!\n")
 
-def manejo_respuesta(respuesta):
-    # Se procesa la respuesta recibida del servidor
-    global FLAG_EXIT
-    
-    # Separamos el estado de la respuesta del cuerpo JSON
+def separar_respuestas(buffer: bytearray, desde: int) -> tuple:
+    # Busca respuestas completas ("STATUS <json>\n") en el buffer.
+    # La búsqueda sigue desde 'desde', así una respuesta grande no se recorre varias veces.
+    # Devuelve ([respuestas], bytes consumidos); quien llama descarta esos bytes de una vez.
+    respuestas = []
+    inicio = 0
+    while True:
+        fin = buffer.find(b'\n', max(inicio, desde))
+        if fin == -1:
+            break
+        respuestas.append(buffer[inicio:fin].decode('utf-8').strip())
+        inicio = fin + 1
+    return respuestas, inicio
+
+def parsear_respuesta(respuesta: str) -> tuple:
+    # Separa el estado de la respuesta del cuerpo JSON y lo deserializa
     partes = respuesta.split(' ', 1)
     respuesta_status = partes[0]
     json_str = partes[1] if len(partes) > 1 else "{}"
 
-    # Deserializamos el JSON
     try:
         respuesta_data = json.loads(json_str)
     except json.JSONDecodeError:
         respuesta_data = f"Error: No se pudo deserializar el JSON de la respuesta"
+    return respuesta_status, respuesta_data
+
+def leer_token():
+    # Token de la sesión anterior, si existe
+    try:
+        with open(SESION_ARCHIVO) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def guardar_token(token):
+    try:
+        with open(SESION_ARCHIVO, 'w') as f:
+            f.write(token)
+    except OSError as e:
+        print(f"\nNo se pudo guardar el token de sesión: {e}")
+
+def manejo_respuesta(respuesta):
+    # Se procesa la respuesta recibida del servidor
+    global FLAG_EXIT, CATALOGO_VERSION, CATALOGO_CACHE, SESION_NUEVA, RESUME_PENDIENTE
+    
+    respuesta_status, respuesta_data = parsear_respuesta(respuesta)
+
+    if respuesta_status == "SESION":
+        # Saludo del servidor: si se está recuperando otra sesión, este token es el de respaldo
+        if RESUME_PENDIENTE:
+            SESION_NUEVA = respuesta_data['token']
+        else:
+            guardar_token(respuesta_data['token'])
+        return
+
+    if RESUME_PENDIENTE and respuesta_status == "ERROR":
+        # La sesión anterior expiró: se sigue con la nueva
+        RESUME_PENDIENTE = False
+        guardar_token(SESION_NUEVA)
+        print(f"\nNo se pudo recuperar la sesión anterior: {respuesta_data}")
+        mostrar_menu()
+        return
 
     # Acciones si el estado es OK
     if respuesta_status == "OK":
         # Diferenciamos el tipo de respuesta por su contenido
         if isinstance(respuesta_data, dict):
-            if respuesta_data.get('tipo') == "TICKET":
+            if "token" in respuesta_data:
+                # Sesión anterior recuperada (RESUME)
+                RESUME_PENDIENTE = False
+                guardar_token(respuesta_data['token'])
+                print(f"\n{respuesta_data['mensaje']}")
+            elif "version" in respuesta_data and "productos" in respuesta_data:
+                # Catálogo completo versionado: lo guardamos para la próxima consulta
+                CATALOGO_VERSION = respuesta_data['version']
+                CATALOGO_CACHE = respuesta_data['productos']
+                mostrar_productos(CATALOGO_CACHE, title="Inventario")
+            elif "productos" in respuesta_data and "siguiente" in respuesta_data:
+                # Página de resultados
+                title = f"RESULTADOS ({respuesta_data['total']} en total)"
+                mostrar_productos(respuesta_data['productos'], title=title)
+                if respuesta_data['siguiente'] is not None:
+                    print(f"Siguiente página desde el cursor {respuesta_data['siguiente']}")
+            elif respuesta_data.get('tipo') == "TICKET":
                 mostrar_ticket(respuesta_data)
             # Búsquedas o Listados
             elif any('stock' in p for p in respuesta_data.values()): 
@@ -147,6 +221,20 @@ def manejo_respuesta(respuesta):
             else:
                 print(f"\n{respuesta_data}")
 
+    elif respuesta_status == "PARTE":
+        # Bloque de un listado en streaming: se muestra sin esperar al resto
+        for product in respuesta_data.values():
+            pid = str(product.get('id', 'N/A'))
+            print(f"{pid:<5} {product['nombre']:<30} {product['marca']:<15} {product['tipo']:<10} ${product['precio']:<9.2f} {str(product.get('stock', 'N/A')):<8}")
+        return
+
+    elif respuesta_status == "FIN":
+        print(f"\n{respuesta_data['total']} articulos en total.")
+
+    elif respuesta_status == "NOT_MODIFIED":
+        # El catálogo no cambió desde la última consulta
+        mostrar_productos(CATALOGO_CACHE, title="Inventario")
+
     elif respuesta_status == "ERROR":
         print(f"\nError: {respuesta_data}")
     
@@ -158,7 +246,7 @@ def manejo_respuesta(respuesta):
 
 def recepcion_respuesta(cliente_socket):
     # Maneja la recepción de datos del servidor y reconstruye el buffer
-    global RECEIVE_BUFFER
+    global RECEIVE_BUFFER, RECEIVE_OFFSET
     try:
         
         data = cliente_socket.recv(BUFFER_SIZE)
@@ -169,19 +257,23 @@ def recepcion_respuesta(cliente_socket):
         
         RECEIVE_BUFFER += data
         
-        # Buscamos saltos de línea para delimitar mensajes completos y deserializar
-        while b'\n' in RECEIVE_BUFFER:
-            respuesta_bytes, RECEIVE_BUFFER = RECEIVE_BUFFER.split(b'\n', 1)
-            respuesta = respuesta_bytes.decode('utf-8').strip()
+        # Buscamos saltos de línea para delimitar mensajes completos y deserializar.
+        respuestas, inicio = separar_respuestas(RECEIVE_BUFFER, RECEIVE_OFFSET)
+        for respuesta in respuestas:
             manejo_respuesta(respuesta)
 
+        # Se descartan de una sola vez los mensajes ya procesados
+        del RECEIVE_BUFFER[:inicio]
+        RECEIVE_OFFSET = len(RECEIVE_BUFFER)
+
     except ConnectionResetError:
         print("\nConexión reseteada por el servidor.")
         return True
     except Exception as e:
         print(f"\nError en la recepcion: {e}")
         # Limpiamos el buffer
-        RECEIVE_BUFFER = b'' 
+        RECEIVE_BUFFER = bytearray()
+        RECEIVE_OFFSET = 0
         return True # Se cierra la conexión
         
     return False # Conexión sigue abierta
@@ -202,7 +294,7 @@ def envio_servidor(cliente_socket, message):
         opcion = comando_params[0]
         
         if opcion == "1":
-            comando_enviar = "VER_PRODUCTOS"
+            comando_enviar = f"VER_PRODUCTOS {CATALOGO_VERSION}"
         elif opcion == "2":
             print("-> ¿Que deseas buscar? (nombre o marca)")
             accion = "BUSCAR"
@@ -212,11 +304,11 @@ def envio_servidor(cliente_socket, message):
             accion = "LISTAR"
             return False
         elif opcion == "4":
-            print("-> Escribe el ID del producto y la cantidad que deseas agregar (ej: 101 2)")
+            print("-> Escribe el ID del producto y la cantidad que deseas agregar (ej: 101 2 || varios: 101 2, 105 1)")
             accion = "AGREGAR_CARRITO"
             return False
         elif opcion == "5":
-            print("-> Escribe el ID del producto y la nueva cantidad (ej: 101 3 || 0 para eliminar)")
+            print("-> Escribe el ID del producto y la nueva cantidad (ej: 101 3 || 0 para eliminar || varios: 101 3, 105 0)")
             accion = "EDITAR_CARRITO"
             return False
         elif opcion == "6":
@@ -236,7 +328,12 @@ def envio_servidor(cliente_socket, message):
             print("Debes proporcionar un parámetro para la acción. Intenta de nuevo.")
             return False
             
-        comando_enviar = f"{accion} {message.upper()}"
+        if accion in ("AGREGAR_CARRITO", "EDITAR_CARRITO") and "," in message:
+            # Varios productos: un solo BATCH en lugar de un comando (y una espera) por producto
+            operaciones = [f"{accion} {par.strip()}" for par in message.upper().split(",") if par.strip()]
+            comando_enviar = "BATCH " + "; ".join(operaciones)
+        else:
+            comando_enviar = f"{accion} {message.upper()}"
         accion = "" # Reiniciamos el estado
 
     else:
@@ -262,7 +359,7 @@ def envio_servidor(cliente_socket, message):
 
 def main_client():
     # Establece la conexión y lanza el bucle select
-    global FLAG_EXIT, FLAG_MENU
+    global FLAG_EXIT, FLAG_MENU, RESUME_PENDIENTE
     
     try:
         # Crear socket y conectar al servidor
@@ -275,6 +372,12 @@ def main_client():
     except Exception as e:
         print(f"\nError al conectar: {e}")
         sys.exit(1)
+
+    # Si hay una sesión anterior se pide recuperarla (su carrito sigue en el servidor)
+    token = leer_token()
+    if token:
+        RESUME_PENDIENTE = True
+        cliente_socket.sendall(f"RESUME {token}\n".encode('utf-8'))
         
     # Lista de monitoreo
     inputs = [cliente_socket]
@@ -0,0 +1,201 @@
+# Diario (write-ahead log) de cambios de stock -> Reemplaza reescribir el JSON en cada compra
+
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Configuración del diario
+JOURNAL_FILE = 'inventario.journal' # Prefijo de los segmentos: inventario.journal.<generacion>
+GROUP_COMMIT_INTERVAL = 0.005 # Segundos que se agrupan escrituras antes de un fsync
+SNAPSHOT_EVERY = 5000 # Entradas en el segmento activo que disparan una compactación
+
+# Cada línea del diario es {"d": {id: delta}, "s": {id: stock_resultante}}.
+# Al reproducir se aplica "s" (imagen posterior) en orden, así que reaplicar
+# entradas que ya están en la instantánea no cambia el resultado final.
+
+# Estado compartido entre procesos (modo pre-fork):
+# [generación activa, entradas en la generación activa, generación de la última instantánea]
+CONTADORES = [0, 0, 0]
+LOCK_INSTANTANEA = threading.Lock() # Evita que dos compactaciones escriban a la vez
+
+# Estado local de cada proceso
+_fd = None
+_fd_generacion = None
+_fds_anteriores = [] # Segmentos rotados que falta sincronizar y cerrar
+_pid = None
+_pendientes = [] # Callbacks a llamar cuando el siguiente fsync termine
+_lote_en_curso = False # El hilo de fsync tiene un lote cuyos callbacks todavía no terminaron
+_fallo = None # Error del último fsync fallido; hasta restablecer() ninguna entrada se confirma
+_condicion = threading.Condition()
+
+def preparar_compartido():
+    # Mueve los contadores a memoria compartida; debe llamarse antes de crear los procesos
+    global CONTADORES, LOCK_INSTANTANEA
+    if not isinstance(CONTADORES, list):
+        return
+    CONTADORES = multiprocessing.RawArray('Q', CONTADORES)
+    LOCK_INSTANTANEA = multiprocessing.Lock()
+
+def ruta_segmento(generacion):
+    return f"{JOURNAL_FILE}.{generacion}"
+
+def segmentos_existentes():
+    # Devuelve [(generacion, ruta)] ordenados de más antiguo a más reciente
+    segmentos = []
+    for ruta in glob.glob(f"{JOURNAL_FILE}.*"):
+        sufijo = ruta.rsplit('.', 1)[1]
+        if sufijo.isdigit():
+            segmentos.append((int(sufijo), ruta))
+    return sorted(segmentos)
+
+def reproducir(inventario: dict) -> int:
+    # Aplica sobre el inventario cargado de la instantánea todos los segmentos del diario
+    aplicadas = 0
+    generacion_activa = 0
+    for generacion, ruta in segmentos_existentes():
+        generacion_activa = generacion
+        with open(ruta, 'rb') as f:
+            for linea in f:
+                try:
+                    entrada = json.loads(linea)
+                except ValueError:
+                    # Línea incompleta por una caída a mitad de escritura
+                    continue
+                for id, stock in entrada.get('s', {}).items():
+                    if id in inventario:
+                        inventario[id]['stock'] = stock
+                aplicadas += 1
+    # Se sigue escribiendo en el último segmento; la próxima compactación limpia los anteriores
+    CONTADORES[0] = generacion_activa
+    CONTADORES[1] = aplicadas
+    CONTADORES[2] = 0
+    return aplicadas
+
+def _asegurar_proceso():
+    # Abre el segmento activo e inicia el hilo de fsync en este proceso (también tras un fork)
+    global _fd, _fd_generacion, _pid, _pendientes, _fds_anteriores, _fallo
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _fd = None
+        _pendientes = []
+        _fds_anteriores = []
+        _fallo = None
+        threading.Thread(target=_bucle_fsync, name="diario-fsync", daemon=True).start()
+    if _fd is None or _fd_generacion != CONTADORES[0]:
+        with _condicion:
+            if _fd is not None:
+                _fds_anteriores.append(_fd)
+            _fd_generacion = CONTADORES[0]
+            _fd = os.open(ruta_segmento(_fd_generacion), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+def registrar(deltas: dict, stocks: dict, al_confirmar=None) -> bool:
+    # Añade una entrada al diario; quien llama debe serializar las escrituras (STOCK_LOCK en tienda).
+    # al_confirmar(durable) se invoca desde el hilo de fsync: con True cuando la entrada ya es
+    # durable, con False si el fsync falló (o el diario ya estaba fallando) y no se puede asegurar.
+    # Devuelve True si el segmento activo alcanzó SNAPSHOT_EVERY entradas.
+    _asegurar_proceso()
+    linea = json.dumps({"d": deltas, "s": stocks}, separators=(',', ':')) + "\n"
+    os.write(_fd, linea.encode('utf-8'))
+    CONTADORES[1] += 1
+
+    with _condicion:
+        _pendientes.append(al_confirmar)
+        _condicion.notify()
+    return CONTADORES[1] >= SNAPSHOT_EVERY
+
+def _bucle_fsync():
+    # Group commit: un solo fsync confirma todas las entradas escritas durante el intervalo.
+    # Después de un fsync fallido no se confía en los siguientes (el sistema pudo descartar
+    # páginas sucias): los lotes se rechazan hasta que restablecer() reemplace los segmentos
+    global _pendientes, _fds_anteriores, _lote_en_curso, _fallo
+    while True:
+        with _condicion:
+            while not _pendientes:
+                _condicion.wait()
+        time.sleep(GROUP_COMMIT_INTERVAL)
+        with _condicion:
+            lote, _pendientes = _pendientes, []
+            _lote_en_curso = True
+            durable = _fallo is None
+            if durable:
+                anteriores, _fds_anteriores = _fds_anteriores, []
+                fd = _fd
+        if durable:
+            try:
+                for fd_anterior in anteriores:
+                    os.fsync(fd_anterior)
+                    os.close(fd_anterior)
+                os.fsync(fd)
+            except OSError as e:
+                log.error(f"No se pudo sincronizar el diario: {e}")
+                with _condicion:
+                    _fallo = e
+                durable = False
+        for al_confirmar in lote:
+            if al_confirmar is not None:
+                al_confirmar(durable)
+        with _condicion:
+            _lote_en_curso = False
+
+def fallo():
+    # Error del fsync que dejó el diario sin confirmar entradas, o None si funciona
+    return _fallo
+
+def restablecer(generacion, stock, escribir_instantanea) -> bool:
+    # Tras un fsync fallido: una instantánea nueva (con su propio fsync) reemplaza a los segmentos
+    # cuyo contenido ya no es confiable. 'generacion' y 'stock' se obtienen como en compactar()
+    # (rotar() y la captura con el mismo lock), cuando ya no quedan lotes por avisar.
+    # Devuelve True si el diario vuelve a aceptar entradas.
+    global _fd, _fds_anteriores, _fallo
+    with _condicion:
+        if _pendientes or _lote_en_curso:
+            return False
+    if not _escribir_instantanea(generacion, stock, escribir_instantanea):
+        return False
+    with _condicion:
+        for fd in _fds_anteriores + ([_fd] if _fd is not None else []):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        _fds_anteriores = []
+        _fd = None # registrar() abre el segmento de la generación nueva
+        _fallo = None
+    log.info("Diario restablecido con una instantánea nueva.")
+    return True
+
+def rotar() -> int:
+    # Abre una nueva generación; se llama con el mismo lock que registrar() junto con la captura del stock
+    CONTADORES[0] += 1
+    CONTADORES[1] = 0
+    return CONTADORES[0]
+
+def _escribir_instantanea(generacion, stock, escribir_instantanea) -> bool:
+    # Escribe la instantánea capturada al rotar a 'generacion' y borra los segmentos
+    # que ya quedaron incluidos en ella. Devuelve True si la instantánea está en disco.
+    try:
+        with LOCK_INSTANTANEA:
+            # Si otra compactación más reciente ya escribió, esta instantánea es vieja
+            if generacion <= CONTADORES[2]:
+                return True
+            if not escribir_instantanea(stock):
+                return False
+            CONTADORES[2] = generacion
+            for generacion_segmento, ruta in segmentos_existentes():
+                if generacion_segmento < generacion:
+                    os.remove(ruta)
+        return True
+    except Exception as e:
+        log.error(f"No se pudo compactar el diario: {e}")
+        return False
+
+def compactar(generacion, stock, escribir_instantanea):
+    # Escribe en segundo plano la instantánea capturada al rotar a 'generacion'
+    threading.Thread(target=_escribir_instantanea, args=(generacion, stock, escribir_instantanea),
+                     name="diario-compactacion", daemon=True).start()
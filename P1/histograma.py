@@ -0,0 +1,65 @@
+# Histograma de latencias estilo HDR -> Percentiles con error relativo acotado y memoria fija
+
+SUB_BUCKETS = 128 # Valores exactos por debajo de este umbral; por encima, 64 cubetas por potencia de 2 (~1.6 %)
+
+def indice_cubeta(valor: int) -> int:
+    if valor < SUB_BUCKETS:
+        return valor
+    desplazamiento = valor.bit_length() - 7
+    return SUB_BUCKETS + (desplazamiento - 1) * 64 + ((valor >> desplazamiento) - 64)
+
+def limite_cubeta(indice: int) -> int:
+    # Mayor valor que cae en la cubeta (se reporta el peor caso de la cubeta)
+    if indice < SUB_BUCKETS:
+        return indice
+    desplazamiento = (indice - SUB_BUCKETS) // 64 + 1
+    base = (indice - SUB_BUCKETS) % 64 + 64
+    return ((base + 1) << desplazamiento) - 1
+
+class Histograma:
+    # Cuenta valores enteros (p. ej. microsegundos) en cubetas logarítmico-lineales:
+    # registrar es O(1) y el tamaño no depende de cuántas muestras se registren
+
+    PERCENTILES = (50, 95, 99, 99.9)
+
+    def __init__(self):
+        self.cuentas = {} # índice de cubeta -> muestras
+        self.total = 0
+        self.suma = 0
+        self.maximo = 0
+
+    def registrar(self, valor: int):
+        valor = max(int(valor), 0)
+        indice = indice_cubeta(valor)
+        self.cuentas[indice] = self.cuentas.get(indice, 0) + 1
+        self.total += 1
+        self.suma += valor
+        if valor > self.maximo:
+            self.maximo = valor
+
+    def fusionar(self, otro):
+        # Suma las muestras de otro histograma (p. ej. de otra conexión o proceso)
+        for indice, cuenta in otro.cuentas.items():
+            self.cuentas[indice] = self.cuentas.get(indice, 0) + cuenta
+        self.total += otro.total
+        self.suma += otro.suma
+        self.maximo = max(self.maximo, otro.maximo)
+
+    def percentil(self, p) -> int:
+        if not self.total:
+            return 0
+        objetivo = max(1, -int(-self.total * p // 100)) # Posición de la muestra (redondeo hacia arriba)
+        acumulado = 0
+        for indice in sorted(self.cuentas):
+            acumulado += self.cuentas[indice]
+            if acumulado >= objetivo:
+                return min(limite_cubeta(indice), self.maximo)
+        return self.maximo
+
+    def resumen(self, escala=1.0) -> dict:
+        # {"n", "media", "p50", "p95", "p99", "p99.9", "max"} con los valores divididos por 'escala'
+        datos = {"n": self.total, "media": round(self.suma / self.total / escala, 3) if self.total else 0}
+        for p in self.PERCENTILES:
+            datos[f"p{p:g}"] = round(self.percentil(p) / escala, 3)
+        datos["max"] = round(self.maximo / escala, 3)
+        return datos
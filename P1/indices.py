@@ -0,0 +1,211 @@
+# Índices en memoria del inventario -> Evitan recorrer todo el catálogo en cada consulta
+
+import bisect
+import math
+from collections import defaultdict
+
+def trigramas(texto: str) -> set:
+    # Conjunto de subcadenas de 3 caracteres de un texto ya en minúsculas
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+class IndiceTrigramas:
+    # Índice invertido trigrama -> ids sobre 'nombre' y 'marca' en minúsculas.
+    # Una búsqueda intersecta las listas de los trigramas de la consulta y solo
+    # verifica la subcadena en esos candidatos, en lugar de en todo el catálogo.
+
+    CAMPOS = ('nombre', 'marca')
+
+    def __init__(self):
+        self.postings = defaultdict(set) # trigrama -> set(ids)
+        self.textos = {} # id -> (nombre, marca) en minúsculas, en orden de inserción
+        self.orden = {} # id -> posición de inserción (mismo orden que el inventario)
+        self.siguiente = 0
+
+    def construir(self, inventario: dict):
+        for id, producto in inventario.items():
+            self.agregar(id, producto)
+        return self
+
+    def agregar(self, id, producto):
+        # Indexa (o reindexa) un producto
+        textos = tuple(producto.get(campo, '').lower() for campo in self.CAMPOS)
+        if id in self.textos:
+            # Se conserva la posición original del producto
+            self.quitar_postings(id, self.textos[id])
+        else:
+            self.orden[id] = self.siguiente
+            self.siguiente += 1
+
+        self.textos[id] = textos
+        postings = self.postings
+        for trigrama in trigramas(textos[0]) | trigramas(textos[1]):
+            postings[trigrama].add(id)
+
+    def eliminar(self, id):
+        # Quita un producto del índice
+        textos = self.textos.pop(id, None)
+        if textos is None:
+            return
+        self.quitar_postings(id, textos)
+        del self.orden[id]
+
+    def quitar_postings(self, id, textos):
+        for trigrama in trigramas(textos[0]) | trigramas(textos[1]):
+            ids = self.postings.get(trigrama)
+            if ids is not None:
+                ids.discard(id)
+                if not ids:
+                    del self.postings[trigrama]
+
+    def candidatos(self, consulta: str):
+        # Ids que contienen todos los trigramas de la consulta
+        listas = []
+        for trigrama in trigramas(consulta):
+            ids = self.postings.get(trigrama)
+            if not ids:
+                return set()
+            listas.append(ids)
+        listas.sort(key=len)
+        resultado = set(listas[0])
+        for ids in listas[1:]:
+            resultado &= ids
+            if not resultado:
+                break
+        return resultado
+
+    def buscar(self, consulta: str, limite=None, ranking=False) -> list:
+        # Ids cuyo nombre o marca contiene la consulta (misma semántica que 'in').
+        # Sin ranking se respeta el orden del inventario; con ranking primero van
+        # las coincidencias al inicio del nombre, luego al inicio de palabra.
+        consulta = consulta.lower()
+        if len(consulta) < 3:
+            # Sin trigramas que consultar: recorrido de los textos ya en minúsculas (y en orden)
+            encontrados = [id for id, (nombre, marca) in self.textos.items()
+                           if consulta in nombre or consulta in marca]
+        else:
+            textos = self.textos
+            encontrados = [id for id in self.candidatos(consulta)
+                           if consulta in textos[id][0] or consulta in textos[id][1]]
+            encontrados.sort(key=self.orden.__getitem__)
+
+        if ranking:
+            # sort es estable: a igual puntaje se mantiene el orden del inventario
+            encontrados.sort(key=lambda id: self.puntaje(id, consulta))
+
+        if limite is not None:
+            encontrados = encontrados[:limite]
+        return encontrados
+
+    def puntaje(self, id, consulta):
+        # Menor es mejor: 0 prefijo del nombre, 1 prefijo de marca o inicio de palabra, 2 el resto
+        nombre, marca = self.textos[id]
+        if nombre.startswith(consulta):
+            return 0
+        if marca.startswith(consulta) or f" {consulta}" in nombre or f" {consulta}" in marca:
+            return 1
+        return 2
+
+class IndiceSecundario:
+    # Índice hash valor (en minúsculas) -> ids para un campo de pocos valores
+    # distintos ('tipo', 'marca'). Listar una categoría cuesta O(resultado).
+
+    def __init__(self, campo):
+        self.campo = campo
+        self.grupos = {} # valor -> {id: posición}, en orden del inventario
+        self.valores = {} # id -> valor indexado
+        self.orden = {} # id -> posición de inserción
+        self.siguiente = 0
+        self.desordenados = set() # grupos que hay que reordenar antes de consultarlos
+
+    def construir(self, inventario: dict):
+        for id, producto in inventario.items():
+            self.agregar(id, producto)
+        return self
+
+    def agregar(self, id, producto):
+        valor = str(producto.get(self.campo, '')).lower()
+        anterior = self.valores.get(id)
+        if anterior == valor:
+            return
+        if anterior is not None:
+            self.quitar_de_grupo(id, anterior)
+        else:
+            self.orden[id] = self.siguiente
+            self.siguiente += 1
+
+        grupo = self.grupos.setdefault(valor, {})
+        if grupo and self.orden[id] < self.orden[next(reversed(grupo))]:
+            # Un producto existente cambió de grupo: se reordena al consultar
+            self.desordenados.add(valor)
+        grupo[id] = self.orden[id]
+        self.valores[id] = valor
+
+    def eliminar(self, id):
+        valor = self.valores.pop(id, None)
+        if valor is None:
+            return
+        self.quitar_de_grupo(id, valor)
+        del self.orden[id]
+
+    def quitar_de_grupo(self, id, valor):
+        grupo = self.grupos[valor]
+        del grupo[id]
+        if not grupo:
+            del self.grupos[valor]
+            self.desordenados.discard(valor)
+
+    def buscar(self, valor) -> list:
+        valor = str(valor).lower()
+        grupo = self.grupos.get(valor)
+        if not grupo:
+            return []
+        if valor in self.desordenados:
+            self.grupos[valor] = grupo = dict(sorted(grupo.items(), key=lambda item: item[1]))
+            self.desordenados.discard(valor)
+        return list(grupo)
+
+class IndiceRango:
+    # Índice ordenado (valor, posición, id) de un campo numérico; las consultas
+    # por rango usan bisect y cuestan O(log n + resultado).
+
+    def __init__(self, campo):
+        self.campo = campo
+        self.claves = [] # [(valor, posición, id)] ordenada
+        self.por_id = {} # id -> clave actual
+        self.siguiente = 0
+
+    def construir(self, inventario: dict):
+        for id, producto in inventario.items():
+            self.por_id[id] = (producto.get(self.campo, 0), self.siguiente, id)
+            self.siguiente += 1
+        self.claves = sorted(self.por_id.values())
+        return self
+
+    def agregar(self, id, producto):
+        self.actualizar(id, producto.get(self.campo, 0))
+
+    def actualizar(self, id, valor):
+        # Cambia el valor indexado de un producto (inserción ordenada con bisect)
+        anterior = self.por_id.get(id)
+        if anterior is not None:
+            if anterior[0] == valor:
+                return
+            self.claves.pop(bisect.bisect_left(self.claves, anterior))
+            posicion = anterior[1]
+        else:
+            posicion = self.siguiente
+            self.siguiente += 1
+        clave = (valor, posicion, id)
+        bisect.insort(self.claves, clave)
+        self.por_id[id] = clave
+
+    def eliminar(self, id):
+        anterior = self.por_id.pop(id, None)
+        if anterior is not None:
+            self.claves.pop(bisect.bisect_left(self.claves, anterior))
+
+    def rango(self, minimo, maximo) -> list:
+        # Ids con minimo <= valor <= maximo, ordenados por valor
+        inicio = bisect.bisect_left(self.claves, (minimo,))
+        fin = bisect.bisect_right(self.claves, (maximo, math.inf))
+        return [id for _, _, id in self.claves[inicio:fin]]
@@ -0,0 +1,47 @@
+# Métricas del servidor -> Contadores e histogramas en memoria del proceso, consultables con STATS
+
+import os
+import time
+
+import histograma
+
+INICIO = time.monotonic()
+
+# accion -> {"n": peticiones, "errores": respuestas ERROR, "histograma": µs de proceso del comando}
+COMANDOS = {}
+LAG_BUCLE = histograma.Histograma() # µs que el bucle de eventos tarda en volver a esperar sockets
+GUARDADOS = histograma.Histograma() # µs de cada instantánea completa del inventario
+PROVEEDORES = [] # Funciones sin argumentos que devuelven métricas del transporte (dict)
+
+def registrar_comando(accion: str, status: str, duracion_us: float):
+    datos = COMANDOS.get(accion)
+    if datos is None:
+        datos = COMANDOS[accion] = {"n": 0, "errores": 0, "histograma": histograma.Histograma()}
+    datos['n'] += 1
+    if status == "ERROR":
+        datos['errores'] += 1
+    datos['histograma'].registrar(duracion_us)
+
+def registrar_lag(duracion_us: float):
+    LAG_BUCLE.registrar(duracion_us)
+
+def registrar_guardado(duracion_us: float):
+    GUARDADOS.registrar(duracion_us)
+
+def agregar_proveedor(funcion):
+    # El transporte registra una función que se evalúa solo cuando se piden las métricas
+    PROVEEDORES.append(funcion)
+
+def resumen() -> dict:
+    # Métricas del proceso actual (en modo pre-fork, las del trabajador que atiende la petición)
+    datos = {
+        "pid": os.getpid(),
+        "uptime_s": round(time.monotonic() - INICIO, 1),
+        "comandos": {accion: {"n": c['n'], "errores": c['errores'], "latencia_us": c['histograma'].resumen()}
+                     for accion, c in sorted(COMANDOS.items())},
+        "lag_bucle_us": LAG_BUCLE.resumen(),
+        "guardado_inventario_ms": GUARDADOS.resumen(escala=1000),
+    }
+    for proveedor in PROVEEDORES:
+        datos.update(proveedor())
+    return datos
@@ -0,0 +1,259 @@
+# Protocolo binario de la tienda -> Tramas con longitud, opcodes numéricos y cuerpo msgpack
+#
+# Se negocia desde el protocolo de texto con "PROTOCOLO BINARIO\n"; el servidor
+# responde en texto y a partir de ahí ambos lados usan tramas:
+#   petición:  [longitud u32][opcode u8][msgpack: lista de parámetros]
+#   respuesta: [longitud u32][status u8][msgpack: datos]
+# La longitud es big-endian y no incluye los 4 bytes de la cabecera.
+#
+# Los parámetros son los mismos que separa el protocolo de texto: cada palabra es un
+# elemento de la lista (BUSCAR ["audifonos", "sony"]) y en BATCH las operaciones se
+# separan con un elemento ";". La lista llega tal cual a los manejadores de la tienda,
+# sin pasar por una línea de texto; un parámetro con espacios o ";" se rechaza porque
+# no sería una palabra del mismo comando en texto.
+
+import struct
+
+try:
+    import msgpack # Implementación en C si está instalada
+except ImportError:
+    msgpack = None
+
+CABECERA = struct.Struct("!I")
+MAX_FRAME_SIZE = 64 * 1024 # Tamaño máximo de una trama de petición
+
+OPCODES = {
+    1: "VER_PRODUCTOS",
+    2: "BUSCAR",
+    3: "LISTAR",
+    4: "AGREGAR_CARRITO",
+    5: "EDITAR_CARRITO",
+    6: "VER_CARRITO",
+    7: "FINALIZAR_COMPRA",
+    8: "SALIR",
+    9: "LISTAR_RANGO",
+    10: "PROTOCOLO",
+    11: "BATCH",
+    12: "STATS",
+    13: "RESUME",
+    14: "VER_PRODUCTOS_PAGINA",
+    15: "VER_PRODUCTOS_STREAM",
+    16: "BUSCAR_PAGINA",
+    17: "BUSCAR_STREAM",
+    18: "LISTAR_PAGINA",
+    19: "LISTAR_STREAM",
+}
+OPCODE_POR_ACCION = {accion: opcode for opcode, accion in OPCODES.items()}
+
+STATUS = {"OK": 0, "ERROR": 1, "NOT_MODIFIED": 2, "PARTE": 3, "FIN": 4, "SESION": 5}
+STATUS_POR_CODIGO = {codigo: status for status, codigo in STATUS.items()}
+
+class TramaInvalida(Exception):
+    pass
+
+# Codificación msgpack (subconjunto: nil, bool, int, float, str, list, dict),
+# usada cuando el paquete msgpack no está instalado. El formato es compatible.
+
+def _empaquetar(obj, salida: bytearray):
+    if obj is None:
+        salida.append(0xc0)
+    elif obj is True:
+        salida.append(0xc3)
+    elif obj is False:
+        salida.append(0xc2)
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            salida.append(obj)
+        elif -32 <= obj < 0:
+            salida.append(obj & 0xff)
+        elif 0 <= obj <= 0xffffffff:
+            salida += struct.pack("!BI", 0xce, obj)
+        elif 0 <= obj <= 0xffffffffffffffff:
+            salida += struct.pack("!BQ", 0xcf, obj)
+        else:
+            salida += struct.pack("!Bq", 0xd3, obj)
+    elif isinstance(obj, float):
+        salida += struct.pack("!Bd", 0xcb, obj)
+    elif isinstance(obj, str):
+        datos = obj.encode('utf-8')
+        n = len(datos)
+        if n < 32:
+            salida.append(0xa0 | n)
+        elif n < 0x100:
+            salida += struct.pack("!BB", 0xd9, n)
+        elif n < 0x10000:
+            salida += struct.pack("!BH", 0xda, n)
+        else:
+            salida += struct.pack("!BI", 0xdb, n)
+        salida += datos
+    elif isinstance(obj, (list, tuple)):
+        n = len(obj)
+        if n < 16:
+            salida.append(0x90 | n)
+        elif n < 0x10000:
+            salida += struct.pack("!BH", 0xdc, n)
+        else:
+            salida += struct.pack("!BI", 0xdd, n)
+        for elemento in obj:
+            _empaquetar(elemento, salida)
+    elif isinstance(obj, dict):
+        n = len(obj)
+        if n < 16:
+            salida.append(0x80 | n)
+        elif n < 0x10000:
+            salida += struct.pack("!BH", 0xde, n)
+        else:
+            salida += struct.pack("!BI", 0xdf, n)
+        for clave, valor in obj.items():
+            _empaquetar(clave, salida)
+            _empaquetar(valor, salida)
+    else:
+        raise TypeError(f"Tipo no soportado en el protocolo binario: {type(obj).__name__}")
+
+def _desempaquetar(datos, pos):
+    # Devuelve (objeto, siguiente posición)
+    b = datos[pos]
+    pos += 1
+    if b < 0x80:
+        return b, pos
+    if b >= 0xe0:
+        return b - 0x100, pos
+    if 0xa0 <= b <= 0xbf:
+        n = b & 0x1f
+        return bytes(datos[pos:pos + n]).decode('utf-8'), pos + n
+    if 0x90 <= b <= 0x9f:
+        return _desempaquetar_lista(datos, pos, b & 0x0f)
+    if 0x80 <= b <= 0x8f:
+        return _desempaquetar_mapa(datos, pos, b & 0x0f)
+    if b == 0xc0:
+        return None, pos
+    if b == 0xc2:
+        return False, pos
+    if b == 0xc3:
+        return True, pos
+    formatos_numericos = {
+        0xcc: "!B", 0xcd: "!H", 0xce: "!I", 0xcf: "!Q",
+        0xd0: "!b", 0xd1: "!h", 0xd2: "!i", 0xd3: "!q",
+        0xca: "!f", 0xcb: "!d",
+    }
+    if b in formatos_numericos:
+        formato = formatos_numericos[b]
+        return struct.unpack_from(formato, datos, pos)[0], pos + struct.calcsize(formato)
+    if b in (0xd9, 0xda, 0xdb, 0xc4, 0xc5, 0xc6):
+        formato = {0xd9: "!B", 0xda: "!H", 0xdb: "!I", 0xc4: "!B", 0xc5: "!H", 0xc6: "!I"}[b]
+        n = struct.unpack_from(formato, datos, pos)[0]
+        pos += struct.calcsize(formato)
+        crudo = bytes(datos[pos:pos + n])
+        return (crudo.decode('utf-8') if b in (0xd9, 0xda, 0xdb) else crudo), pos + n
+    if b in (0xdc, 0xdd):
+        formato = "!H" if b == 0xdc else "!I"
+        n = struct.unpack_from(formato, datos, pos)[0]
+        return _desempaquetar_lista(datos, pos + struct.calcsize(formato), n)
+    if b in (0xde, 0xdf):
+        formato = "!H" if b == 0xde else "!I"
+        n = struct.unpack_from(formato, datos, pos)[0]
+        return _desempaquetar_mapa(datos, pos + struct.calcsize(formato), n)
+    raise TramaInvalida(f"Byte de tipo desconocido: 0x{b:02x}")
+
+def _desempaquetar_lista(datos, pos, n):
+    lista = []
+    for _ in range(n):
+        elemento, pos = _desempaquetar(datos, pos)
+        lista.append(elemento)
+    return lista, pos
+
+def _desempaquetar_mapa(datos, pos, n):
+    mapa = {}
+    for _ in range(n):
+        clave, pos = _desempaquetar(datos, pos)
+        valor, pos = _desempaquetar(datos, pos)
+        mapa[clave] = valor
+    return mapa, pos
+
+def empaquetar(obj) -> bytes:
+    if msgpack is not None:
+        return msgpack.packb(obj, use_bin_type=True)
+    salida = bytearray()
+    _empaquetar(obj, salida)
+    return bytes(salida)
+
+def desempaquetar(datos):
+    # Cualquier error del cuerpo (truncado, bytes de más, tipos o anidamiento inválidos)
+    # se informa como TramaInvalida, con o sin el paquete msgpack
+    if msgpack is not None:
+        try:
+            return msgpack.unpackb(datos, raw=False, strict_map_key=False)
+        except Exception as e:
+            raise TramaInvalida(f"Cuerpo msgpack inválido: {e}")
+    try:
+        obj, pos = _desempaquetar(datos, 0)
+    except (IndexError, struct.error, UnicodeDecodeError, RecursionError, TypeError, ValueError) as e:
+        raise TramaInvalida(f"Cuerpo msgpack inválido: {e}")
+    if pos > len(datos):
+        raise TramaInvalida("Cuerpo msgpack inválido: truncado")
+    if pos < len(datos):
+        raise TramaInvalida(f"Cuerpo msgpack inválido: {len(datos) - pos} bytes de más")
+    return obj
+
+# Tramas
+
+def limites_trama(buffer, inicio=0, fin=None):
+    # Busca una trama completa en buffer[inicio:fin] sin copiarla.
+    # Devuelve (inicio del payload, fin de la trama) o None si todavía no llegó completa.
+    if fin is None:
+        fin = len(buffer)
+    if fin - inicio < CABECERA.size:
+        return None
+    longitud = CABECERA.unpack_from(buffer, inicio)[0]
+    if longitud == 0 or longitud > MAX_FRAME_SIZE:
+        raise TramaInvalida(f"Longitud de trama inválida: {longitud}")
+    fin_trama = inicio + CABECERA.size + longitud
+    if fin < fin_trama:
+        return None
+    return inicio + CABECERA.size, fin_trama
+
+def extraer_trama(buffer, inicio=0):
+    # Como limites_trama, pero devuelve (payload copiado, siguiente inicio)
+    limites = limites_trama(buffer, inicio)
+    if limites is None:
+        return None
+    inicio_payload, fin_trama = limites
+    return bytes(buffer[inicio_payload:fin_trama]), fin_trama
+
+def codificar_peticion(accion, params=()) -> bytes:
+    cuerpo = bytes([OPCODE_POR_ACCION[accion]]) + empaquetar(list(params))
+    return CABECERA.pack(len(cuerpo)) + cuerpo
+
+def parametro_texto(param) -> str:
+    # Un parámetro escalar como palabra del protocolo de texto ("" si no se puede representar así)
+    if isinstance(param, bool) or not isinstance(param, (str, int, float)):
+        return ""
+    texto = str(param)
+    if texto == ";":
+        return texto
+    if ";" in texto or len(texto.split()) != 1:
+        return ""
+    return texto
+
+def decodificar_peticion(payload) -> tuple:
+    # Devuelve (accion, params) con la lista de palabras que reciben los manejadores de la tienda
+    accion = OPCODES.get(payload[0])
+    if accion is None:
+        raise TramaInvalida(f"Opcode desconocido: {payload[0]}")
+    params = desempaquetar(payload[1:]) if len(payload) > 1 else []
+    if not isinstance(params, list):
+        raise TramaInvalida("Los parámetros deben ser una lista.")
+    palabras = []
+    for num, param in enumerate(params, 1):
+        palabra = parametro_texto(param)
+        if not palabra:
+            raise TramaInvalida(f"Parámetro {num} inválido: debe ser un texto sin espacios ni ';' o un número.")
+        palabras.append(palabra)
+    return accion, palabras
+
+def codificar_respuesta(status, data) -> bytes:
+    cuerpo = empaquetar(data)
+    return CABECERA.pack(len(cuerpo) + 1) + bytes([STATUS[status]]) + cuerpo
+
+def decodificar_respuesta(payload) -> tuple:
+    return STATUS_POR_CODIGO[payload[0]], desempaquetar(payload[1:])
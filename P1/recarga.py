@@ -0,0 +1,61 @@
+# Recarga en caliente -> Vigila un archivo y lo prepara fuera del bucle de eventos
+
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+def firma(st) -> tuple:
+    # Identifica una versión del archivo: (mtime en ns, tamaño, inodo)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def firma_archivo(ruta):
+    try:
+        return firma(os.stat(ruta))
+    except FileNotFoundError:
+        return None
+
+class Vigilante:
+    # Hilo que revisa la firma del archivo cada 'intervalo' segundos (sondeo de mtime,
+    # no depende de inotify). Cuando cambia y se mantiene igual un sondeo completo
+    # (un editor pudo escribirlo en varios pasos), llama a preparar() en este mismo
+    # hilo y deja el resultado en 'listo' para que el bucle lo aplique con tomar().
+    # Si aparece otra versión antes de que se aplique, la nueva reemplaza a la anterior.
+
+    def __init__(self, ruta, preparar, omitir, intervalo: float, vista=None):
+        self.ruta = ruta
+        self.preparar = preparar # () -> (firma leída, datos); lanza si el archivo no es válido
+        self.omitir = omitir # firma -> True si esa versión ya está incorporada (p. ej. la escribió el servidor)
+        self.intervalo = intervalo
+        self.vista = vista # Última firma procesada
+        self.listo = None # (firma, datos) pendiente de aplicar
+        self.hilo = threading.Thread(target=self.bucle, name="recarga-inventario", daemon=True)
+
+    def iniciar(self):
+        self.hilo.start()
+        return self
+
+    def tomar(self):
+        listo, self.listo = self.listo, None
+        return listo
+
+    def bucle(self):
+        anterior = self.vista
+        while True:
+            time.sleep(self.intervalo)
+            actual = firma_archivo(self.ruta)
+            if actual is None or actual == self.vista or actual != anterior:
+                anterior = actual
+                continue
+            self.vista = actual
+            if self.omitir(actual):
+                continue
+            try:
+                leida, datos = self.preparar()
+            except Exception as e:
+                log.warning(f"No se pudo recargar '{self.ruta}': {e}")
+                continue
+            self.vista = leida
+            self.listo = (leida, datos)
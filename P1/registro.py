@@ -0,0 +1,60 @@
+# Registro (logging) no bloqueante -> El bucle de eventos solo encola; un hilo aparte escribe en stdout
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+FORMATO = "%(asctime)s [%(process)d] %(levelname)s %(name)s: %(message)s"
+NIVEL = 'INFO' # Los eventos por conexión se registran en DEBUG
+
+LISTENER = None # QueueListener del proceso actual
+LISTENER_PID = None
+
+def configurar(nivel=None):
+    # (Re)configura el registro del proceso actual. Tras un fork el hilo escritor del
+    # padre no existe en el hijo, así que cada trabajador debe llamarla de nuevo.
+    global LISTENER, LISTENER_PID
+    if LISTENER is not None and LISTENER_PID == os.getpid():
+        LISTENER.stop()
+
+    cola = queue.SimpleQueue()
+    salida = logging.StreamHandler(sys.stdout)
+    salida.setFormatter(logging.Formatter(FORMATO))
+
+    raiz = logging.getLogger()
+    for manejador in list(raiz.handlers):
+        raiz.removeHandler(manejador)
+    raiz.addHandler(logging.handlers.QueueHandler(cola))
+    raiz.setLevel(nivel or NIVEL)
+
+    LISTENER = logging.handlers.QueueListener(cola, salida)
+    LISTENER.start()
+    LISTENER_PID = os.getpid()
+
+def detener():
+    # Escribe lo que quede en la cola y detiene el hilo escritor; se llama cuando el
+    # proceso ya no atiende peticiones. Los registros posteriores de otros hilos
+    # (p. ej. el del diario) se escriben directamente, sin cola.
+    global LISTENER
+    if LISTENER is None or LISTENER_PID != os.getpid():
+        return
+    listener, LISTENER = LISTENER, None
+    listener.stop()
+
+    raiz = logging.getLogger()
+    for manejador in list(raiz.handlers):
+        if isinstance(manejador, logging.handlers.QueueHandler):
+            raiz.removeHandler(manejador)
+    for salida in listener.handlers:
+        raiz.addHandler(salida)
+    # Registros encolados después del centinela de stop()
+    while True:
+        try:
+            listener.handle(listener.queue.get_nowait())
+        except queue.Empty:
+            break
+
+atexit.register(detener)
@@ -1,349 +1,751 @@
-# Servidor -> Socket de flujo bloqueante
+# Servidor -> Socket de flujo no bloqueante
 
 import socket
 import select
-import json
-import os
+import collections
+import selectors
+import argparse
+import multiprocessing
+import signal
+import logging
 import sys
-import traceback
-import re
 import time
 
+import admision
+import metricas
+import registro
+import temporizadores
+import tienda
+
+log = logging.getLogger("server")
+
 # Configuración de la conexión
 HOST = '0.0.0.0'
 PORT = 9999
-BUFFER_SIZE = 4096
-INVENTORY_FILE = 'inventario.json'
-MAX_CONNECTIONS = 10
-
-# Variables globales auxiliares
-INVENTARIO = {}
-CLIENTE_CARRITOS = {}
-
-# Diccionario de buffers por cliente
-CLIENT_BUFFERS = {}
-
-# Lista de sockets que select monitorea para lectura
-SOCKET_LIST = [] 
+BUFFER_SIZE = 4096 # Tamaño inicial del buffer de recepción y mínimo libre para cada recv_into
+LISTEN_BACKLOG = socket.SOMAXCONN # Cola de conexiones pendientes del socket de escucha
+ACCEPT_BATCH = 64 # Conexiones aceptadas por vuelta del bucle; el resto espera a la siguiente vuelta
+READ_BUDGET = 64 * 1024 # Bytes leídos de una conexión por turno; el resto espera a la siguiente vuelta
+IDLE_TIMEOUT = 300.0 # Segundos sin recibir ni enviar datos antes de cerrar una conexión (0 desactiva)
+WORKERS = 1 # Procesos trabajadores; con más de uno se usa pre-fork con SO_REUSEPORT
+
+# Motor de eventos: 'auto' | 'epoll_et' | 'epoll' | 'poll' | 'select'
+# 'auto' usa epoll en modo edge-triggered cuando está disponible
+EVENT_BACKEND = 'auto'
+SELECT_TIMEOUT = 0.5
+MAX_EVENTOS = 1024 # Eventos máximos devueltos por cada llamada a epoll
+
+# Cola de salida por conexión (bytes pendientes de enviar)
+OUTPUT_HIGH_WATER = 256 * 1024 # Por encima se dejan de leer comandos del cliente
+OUTPUT_LOW_WATER = 64 * 1024 # Por debajo se reanuda la lectura
+OUTPUT_HARD_LIMIT = 8 * 1024 * 1024 # Por encima se desconecta al cliente
+
+# Estado de cada conexión indexado por su descriptor:
+# fd -> {'sock': socket, 'addr': (ip, puerto), 'buffer': tienda.BufferEntrada, 'sesion': {'carrito': {id: cantidad}},
+#        'salida': bytearray, 'stream': iterador de líneas pendientes o None, 'pausado': bool, 'cerrar': bool,
+#        'actividad': último envío o recepción (monotonic), 'limitado': bool, 'aplazado': comando en espera o None,
+#        'diferida': tienda.RespuestaDiferida que se completa en otro hilo o None}
+CONEXIONES = {}
+
+# Respuestas que completa otro hilo (p. ej. el ticket de FINALIZAR_COMPRA cuando la compra ya es durable)
+DIFERIDAS_LISTAS = collections.deque() # (fd, respuesta) completadas, pendientes de enviar desde el bucle
+DESPERTADOR = None # socketpair (lectura, escritura): el hilo que completa una respuesta despierta al selector
+
+# Control de admisión (límites en admision.py)
+ACEPTACION_PENDIENTE = False # Quedan conexiones por aceptar (con edge-triggered no llega otro aviso)
+LECTURA_PENDIENTE = set() # fds que agotaron READ_BUDGET con datos aún en el socket
+RUEDA_INACTIVIDAD = None # fd -> revisión de inactividad
+RUEDA_LIMITES = None # fd -> reanudación de una conexión que superó su límite de peticiones
+CONTADORES_ADMISION = {"conexiones_rechazadas": 0, "conexiones_inactivas_cerradas": 0, "comandos_aplazados": 0}
+
+# Selector del bucle principal y socket de escucha
+SELECTOR = None
 SERVER_SOCKET_FILENO = None
-
-def cargar_inventario():
-    # Carga los datos del inventario desde el archivo JSON
-    global INVENTARIO
-    
-    if not os.path.exists(INVENTORY_FILE):
-        print(f"ERROR: El archivo '{INVENTORY_FILE}' no existe.")
-        return
-    try:
-        with open(INVENTORY_FILE, 'r') as f:
-            INVENTARIO = json.load(f)
-        print(f"Inventario cargado exitosamente.")
-    except json.JSONDecodeError:
-        print(f"ERROR: No se pudo decodificar el archivo JSON.")
-        INVENTARIO = {}
-    except Exception as e:
-        print(f"No se pudo cargar el inventario: {e}")
-        INVENTARIO = {}
-
-def guardar_inventario():
-    # Guarda los datos del inventario actualizado
+DETENER = False # SIGTERM en un trabajador: el bucle sale al terminar la vuelta actual
+
+# Motor de eventos
+
+class SelectorEpollET:
+    # Selector mínimo sobre epoll en modo edge-triggered (EPOLLET).
+    # Expone la misma interfaz que selectors (register/modify/unregister/select),
+    # pero epoll solo avisa cuando cambia el estado del socket, así que quien
+    # atiende el evento debe leer/aceptar hasta recibir EAGAIN.
+
+    def __init__(self):
+        self._epoll = select.epoll()
+        self._claves = {}
+
+    def _mascara(self, events):
+        mascara = select.EPOLLET
+        if events & selectors.EVENT_READ:
+            mascara |= select.EPOLLIN | select.EPOLLRDHUP
+        if events & selectors.EVENT_WRITE:
+            mascara |= select.EPOLLOUT
+        return mascara
+
+    def register(self, fileobj, events, data=None):
+        fd = fileobj.fileno()
+        clave = selectors.SelectorKey(fileobj, fd, events, data)
+        self._epoll.register(fd, self._mascara(events))
+        self._claves[fd] = clave
+        return clave
+
+    def modify(self, fileobj, events, data=None):
+        fd = fileobj.fileno()
+        clave = selectors.SelectorKey(fileobj, fd, events, data)
+        self._epoll.modify(fd, self._mascara(events))
+        self._claves[fd] = clave
+        return clave
+
+    def unregister(self, fileobj):
+        fd = fileobj if isinstance(fileobj, int) else fileobj.fileno()
+        clave = self._claves.pop(fd)
+        try:
+            self._epoll.unregister(fd)
+        except OSError:
+            pass
+        return clave
+
+    def get_key(self, fileobj):
+        fd = fileobj if isinstance(fileobj, int) else fileobj.fileno()
+        return self._claves[fd]
+
+    def select(self, timeout=None):
+        listos = []
+        eventos_epoll = self._epoll.poll(-1 if timeout is None else timeout, MAX_EVENTOS)
+        for fd, ev in eventos_epoll:
+            clave = self._claves.get(fd)
+            if clave is None:
+                continue
+            eventos = 0
+            # Un error o cierre remoto se entrega como lectura/escritura para que recv/send lo reporten
+            if ev & (select.EPOLLIN | select.EPOLLRDHUP | select.EPOLLERR | select.EPOLLHUP):
+                eventos |= selectors.EVENT_READ
+            if ev & (select.EPOLLOUT | select.EPOLLERR | select.EPOLLHUP):
+                eventos |= selectors.EVENT_WRITE
+            eventos &= clave.events
+            if eventos:
+                listos.append((clave, eventos))
+        return listos
+
+    def close(self):
+        self._epoll.close()
+        self._claves.clear()
+
+def crear_selector(nombre: str):
+    # Crea el selector del motor de eventos según la configuración
+    backends = {
+        'epoll_et': SelectorEpollET if hasattr(select, 'epoll') else None,
+        'epoll': getattr(selectors, 'EpollSelector', None),
+        'poll': getattr(selectors, 'PollSelector', None),
+        'select': selectors.SelectSelector,
+    }
+    if nombre == 'auto':
+        return (backends['epoll_et'] or selectors.DefaultSelector)()
+    if nombre not in backends:
+        raise ValueError(f"Motor de eventos desconocido: {nombre}")
+    if backends[nombre] is None:
+        raise ValueError(f"El motor de eventos '{nombre}' no está disponible en este sistema.")
+    return backends[nombre]()
+
+def ajustar_limite_descriptores():
+    # Sube el límite blando de descriptores al máximo permitido para aceptar miles de clientes
     try:
-        with open(INVENTORY_FILE, 'w') as f:
-            json.dump(INVENTARIO, f, indent=4)
-        print(f"Inventario guardado en '{INVENTORY_FILE}'.")
-        return True
-    except Exception as e:
-        print(f"No se pudo guardar el inventario: {e}")
-        return False
-
-def buscar_inventario(param: str):
-    # Busca productos por nombre o marca
-    resultados = {}
-    param = param.lower()
-    for id, producto in INVENTARIO.items():
-        if param in producto.get('nombre', '').lower() or param in producto.get('marca', '').lower():
-            resultados[id] = producto
-    return resultados
-
-def listar_tipo(tipo: str):
-    # Lista productos filtrando por el campo 'tipo'
-    resultados = {}
-    tipo = tipo.lower()
-    for id, producto in INVENTARIO.items():
-        if producto.get('tipo', '').lower() == tipo:
-            resultados[id] = producto
-    return resultados
-
-def stock_producto(id: str) -> int:
-    # Obtiene el stock disponible de un producto
-    return INVENTARIO.get(id, {}).get('stock', 0)
-
-def parseo(msj: str) -> tuple:
-    # Parsear el mensaje del cliente para saber que accion realizar
-    partes = msj.strip().split()
-    accion = partes[0].upper() if partes else ""
-    params = partes[1:]
-    return accion, " ".join(params) 
+        import resource
+        blando, duro = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if duro == resource.RLIM_INFINITY or blando < duro:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (duro, duro))
+    except (ImportError, ValueError, OSError):
+        pass
 
 # Funciones para manejar la comunicación con el cliente
 
 def envio_respuesta(conn, status, data):
-    # Enviar respuesta serializada al cliente
+    # Encola la respuesta serializada en la cola de salida del cliente
+    estado = CONEXIONES.get(conn.fileno())
+    if estado is None:
+        return
     try:
-        cuerpo_respuesta = json.dumps(data)
-        respuesta_final = f"{status} {cuerpo_respuesta}\n"
-        
-        # EL USO DE conn.sendall() ES BLOQUEANTE
-        conn.sendall(respuesta_final.encode('utf-8'))
+        estado['salida'] += tienda.codificar_para(estado['sesion'], status, data)
     except Exception as e:
-        print(f"No se pudo enviar la respuesta: {e}")
-
-def procesar_comando(cliente_id, message):
-    # Lógica central para procesar un comando ya completo
-    global INVENTARIO, CLIENTE_CARRITOS
+        log.error(f"No se pudo enviar la respuesta: {e}")
+        return
 
-    # Parseamos el comando
-    accion, param_str = parseo(message)
-    params = param_str.split()
-    conn = next(sock for sock in SOCKET_LIST if sock.fileno() == cliente_id) # Obtener el socket del cliente
-    
-    # Inicializamos las variables de respuesta
-    respuesta_data = None
-    respuesta_status = "OK"
-    
-    # Obtenemos el carrito del cliente
-    carrito_actual = CLIENTE_CARRITOS.get(cliente_id, {})
-    
-    if accion == "VER_PRODUCTOS":
-        data_with_id = {}
-        for id, product in INVENTARIO.items():
-            product['id'] = id
-            data_with_id[id] = product
-        respuesta_data = data_with_id
-
-    elif accion == "BUSCAR" or accion == "LISTAR":
-        if not param_str:
-            respuesta_status = "ERROR"
-            respuesta_data = "Debe proporcionar un parametro para buscar o listar."
-        else:
-            respuesta_data = buscar_inventario(param_str) if accion == "BUSCAR" else listar_tipo(param_str)
-    
-    elif accion == "AGREGAR_CARRITO" or accion == "EDITAR_CARRITO":
-        # Validación de parámetros
-        if len(params) < 2:
-            respuesta_status = "ERROR"
-            respuesta_data = "Faltan parametros para poder realizar la accion (ID y CANTIDAD)."
-        else:
-            producto_id = params[0]
+    # Intentamos enviar en el momento; lo que no quepa en el socket queda en la cola
+    vaciar_salida(estado)
+
+    if len(estado['salida']) > OUTPUT_HARD_LIMIT:
+        log.warning(f"[{conn.fileno()}] cola de salida excedida ({len(estado['salida'])} bytes). Desconectando.")
+        estado['cerrar'] = True
+    elif len(estado['salida']) > OUTPUT_HIGH_WATER:
+        # Backpressure: no se leen más comandos hasta que el cliente consuma su cola
+        estado['pausado'] = True
+
+def alimentar_stream(estado):
+    # Genera las siguientes líneas de una respuesta en streaming solo cuando el
+    # cliente consumió las anteriores: la memoria queda acotada por OUTPUT_LOW_WATER
+    while estado['stream'] is not None:
+        while estado['stream'] is not None and len(estado['salida']) < OUTPUT_LOW_WATER:
             try:
-                # Validamos que la cantidad sea un entero
-                cantidad = int(params[1])
-            except ValueError:
-                respuesta_status = "ERROR"; respuesta_data = "La cantidad debe ser un numero entero."
-                
-            if respuesta_status == "OK":
-                # Validamos que el producto exista
-                if producto_id not in INVENTARIO:
-                    respuesta_status = "ERROR"; respuesta_data = f"No existe el producto con el ID {producto_id}."
-                else:
-                    nombre_producto = INVENTARIO[producto_id]['nombre']
-                    
-                    # Cálculo de nueva cantidad total
-                    cant_actual_carrito = carrito_actual.get(producto_id, 0)
-                    nueva_cant_total = cant_actual_carrito + cantidad if accion == "AGREGAR_CARRITO" else cantidad
-
-                    # Validación de Stock y rangos
-                    stock_disp = stock_producto(producto_id)
-                    
-                    if nueva_cant_total < 0:
-                        respuesta_status = "ERROR"; respuesta_data = "La cantidad no puede ser menor a cero."
-                    elif nueva_cant_total > stock_disp:
-                        respuesta_status = "ERROR"; respuesta_data = f"Stock insuficiente. Disponible: {stock_disp}. Solicitado: {nueva_cant_total}."
-                    
-                    # Si todo es OK, actualizar carrito
-                    elif respuesta_status == "OK":
-                        if nueva_cant_total == 0:
-                            if producto_id in carrito_actual: del CLIENTE_CARRITOS[cliente_id][producto_id]
-                            respuesta_data = {"mensaje": f"Se eliminó '{nombre_producto}' del carrito."}
-                        else:
-                            CLIENTE_CARRITOS[cliente_id][producto_id] = nueva_cant_total
-                            respuesta_data = {"mensaje": f"Carrito actualizado. '{nombre_producto}' total: {nueva_cant_total}."}
-    
-    elif accion == "VER_CARRITO":
-        productos_carrito = CLIENTE_CARRITOS.get(cliente_id, {})
-        carrito = {}
-        for id, cant in productos_carrito.items():
-            if id in INVENTARIO:
-                carrito[id] = {
-                    "nombre": INVENTARIO[id]['nombre'],
-                    "precio": INVENTARIO[id]['precio'],
-                    "cantidad": cant
-                }
-        respuesta_data = carrito
-
-    elif accion == "FINALIZAR_COMPRA":
-        productos_carrito = CLIENTE_CARRITOS.get(cliente_id, {})
-        if not productos_carrito:
-            respuesta_status = "ERROR"; respuesta_data = "El carrito está vacío."
+                estado['salida'] += next(estado['stream'])
+            except StopIteration:
+                estado['stream'] = None
+        vaciar_salida(estado)
+        if estado['salida']:
+            # El socket está lleno: se continúa cuando admita escritura
+            return
+
+def vaciar_salida(estado):
+    # Envía todo lo posible de la cola de salida sin bloquear
+    salida = estado['salida']
+    while salida:
+        try:
+            enviados = estado['sock'].send(salida)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            log.debug(f"No se pudo enviar la respuesta: {e}")
+            estado['cerrar'] = True
+            salida.clear()
+            return
+        del salida[:enviados]
+        estado['actividad'] = time.monotonic()
+
+def actualizar_interes(cliente_id):
+    # Ajusta los eventos del selector: escritura solo mientras haya datos pendientes
+    estado = CONEXIONES[cliente_id]
+    eventos = 0 if lectura_detenida(estado) else selectors.EVENT_READ
+    if estado['salida']:
+        eventos |= selectors.EVENT_WRITE
+    if eventos != estado['eventos']:
+        # Sin eventos (un comando aplazado o una respuesta diferida) el socket sale del selector
+        # para que los motores level-triggered no lo reporten en cada vuelta
+        if eventos == 0:
+            SELECTOR.unregister(estado['sock'])
+        elif estado['eventos'] == 0:
+            SELECTOR.register(estado['sock'], eventos)
         else:
-            total = 0.0
-            ticket = []
-            
-            # Proceso de compra y descuento de stock
-            for id, cant in productos_carrito.items():
-                # Validación de stock
-                if cant > INVENTARIO[id]['stock']:
-                    respuesta_status = "ERROR"; respuesta_data = f"Stock agotado para ID {id}. No se pudo completar la compra."
-                    CLIENTE_CARRITOS[cliente_id] = {} # Vaciamos el carrito
-                    break
-                
-                producto_data = INVENTARIO[id]
-                subtotal = producto_data['precio'] * cant
-                total += subtotal
-                
-                ticket.append({
-                    "nombre": producto_data['nombre'],
-                    "cantidad": cant,
-                    "subtotal": subtotal
-                })
-                
-                # Descontamos el stock y lo marcamos para guardar
-                INVENTARIO[id]['stock'] -= cant
-            
-            if respuesta_status == "OK":
-                guardar_inventario() # Guardamos los cambios al JSON
-                CLIENTE_CARRITOS[cliente_id] = {} # Vaciamos el carrito
-                respuesta_data = {
-                    "tipo": "TICKET", 
-                    "items": ticket,
-                    "total": total,
-                    "mensaje": "¡Gracias por su compra!"
-                }
-    
-    else:
-        respuesta_status = "ERROR"; respuesta_data = f"Opción no reconocida: {accion}"
+            SELECTOR.modify(estado['sock'], eventos)
+        estado['eventos'] = eventos
 
-    # Enviamos la respuesta
-    envio_respuesta(conn, respuesta_status, respuesta_data)
+def lectura_detenida(estado) -> bool:
+    # Mientras hay backpressure, un stream en curso, un comando aplazado por el límite de
+    # peticiones o una respuesta diferida no se procesan más comandos de la conexión
+    return (estado['pausado'] or estado['limitado'] or estado['stream'] is not None
+            or estado['diferida'] is not None)
 
-    if accion == "SALIR":
-        return True
-    return False
+def procesar_comando(cliente_id, accion, params):
+    # Ejecuta un comando completo con la lógica de la tienda y encola la respuesta
+    estado = CONEXIONES[cliente_id] # Estado de la conexión del cliente
+
+    respuesta_status, respuesta_data, cerrar = tienda.ejecutar_accion(estado['sesion'], accion, params)
+
+    # Enviamos la respuesta
+    if isinstance(respuesta_data, tienda.RespuestaStream):
+        # Los siguientes comandos esperan hasta que termine el stream
+        estado['stream'] = iter(respuesta_data)
+        alimentar_stream(estado)
+    elif isinstance(respuesta_data, tienda.RespuestaDiferida):
+        # Los siguientes comandos esperan a que otro hilo complete la respuesta
+        estado['diferida'] = respuesta_data
+        respuesta_data.al_completar(lambda: avisar_diferida(cliente_id, respuesta_data))
+    else:
+        envio_respuesta(estado['sock'], respuesta_status, respuesta_data)
+    return cerrar
 
 def control_cliente(conn):
     # Función de lectura de buffer y reconstrucción de comandos
     cliente_id = conn.fileno()
+    estado = CONEXIONES[cliente_id]
+    entrada = estado['buffer']
 
     try:
-        data = conn.recv(BUFFER_SIZE)
-
-        if not data:
-            # Si data es vacío, el cliente cerró el socket.
-            return True 
-        
-        # Añadir datos al buffer del cliente
-        CLIENT_BUFFERS[cliente_id] += data
-        
-        should_close = False # Bandera para cerrar conexión si es necesario
-
-        # Procesar mensajes mientras haya saltos de línea
-        while b'\n' in CLIENT_BUFFERS[cliente_id]:
-            message_bytes, CLIENT_BUFFERS[cliente_id] = CLIENT_BUFFERS[cliente_id].split(b'\n', 1)
-            message = message_bytes.decode('utf-8').strip()
-            
-            if not message:
-                # Si el mensaje es solo un salto de línea, lo ignoramos.
-                continue
+        # Con epoll edge-triggered hay que leer hasta vaciar el socket (EAGAIN).
+        # Los comandos se procesan entre lecturas para que el buffer no pase de su
+        # capacidad máxima; con backpressure o un stream en curso el resto se queda
+        # en el socket hasta que se reanude la lectura. Un cliente que nunca deja
+        # vacío su socket cede el turno al agotar READ_BUDGET.
+        leidos = 0
+        while True:
+            if procesar_buffer(cliente_id):
+                return True
+            if lectura_detenida(estado):
+                break
 
-            should_close = procesar_comando(cliente_id, message)
-            if should_close:
+            espacio = entrada.espacio_libre()
+            try:
+                recibidos = conn.recv_into(espacio)
+            except BlockingIOError:
+                break
+            finally:
+                espacio.release()
+
+            if not recibidos:
+                # Si no se recibe nada, el cliente cerró el socket.
+                return True
+
+            entrada.avanzar(recibidos)
+            estado['actividad'] = time.monotonic()
+            leidos += recibidos
+            if leidos >= READ_BUDGET:
+                if procesar_buffer(cliente_id):
+                    return True
+                LECTURA_PENDIENTE.add(cliente_id)
                 break
-        
-        return should_close
 
     except ConnectionResetError:
-        print(f"[{cliente_id}] conexion cerrada.")
+        log.debug(f"[{cliente_id}] conexion cerrada.")
+        return True
     except Exception as e:
-        print(f"Error de lógica o sintaxis en {cliente_id}: {e}")
+        log.error(f"Error de lógica o sintaxis en {cliente_id}: {e}")
         envio_respuesta(conn, "ERROR", f"Error al procesar el comando: {e}")
     
+    return estado['cerrar']
+
+def procesar_buffer(cliente_id):
+    # Procesa los comandos completos del buffer mientras no haya backpressure
+    estado = CONEXIONES[cliente_id]
+    should_close = False # Bandera para cerrar conexión si es necesario
+
+    # Procesar mensajes completos (líneas o tramas binarias, según la sesión)
+    while not lectura_detenida(estado):
+        if estado['aplazado'] is not None:
+            # Primero el comando que esperaba por el límite de peticiones
+            mensaje, estado['aplazado'] = estado['aplazado'], None
+        else:
+            try:
+                mensaje = tienda.siguiente_mensaje(estado['sesion'], estado['buffer'])
+            except tienda.MensajeInvalido as e:
+                # Sin un delimitador válido no se puede saber dónde empieza el siguiente comando
+                envio_respuesta(estado['sock'], "ERROR", f"Mensaje inválido: {e}")
+                should_close = True
+                break
+        if mensaje is None:
+            break
+        accion, params = mensaje
+
+        if accion is None:
+            # Si el mensaje es solo un salto de línea, lo ignoramos.
+            continue
+
+        espera = admision.espera_comando(estado['addr'][0], accion, time.monotonic())
+        if espera:
+            # La IP agotó su cubo: el comando espera sin leer más del socket, así un
+            # cliente abusivo se frena solo y no ocupa el bucle de los demás
+            estado['aplazado'] = mensaje
+            estado['limitado'] = True
+            RUEDA_LIMITES.programar(cliente_id, time.monotonic() + espera)
+            CONTADORES_ADMISION['comandos_aplazados'] += 1
+            break
+
+        should_close = procesar_comando(cliente_id, accion, params)
+        if should_close:
+            break
+
+    if should_close and estado['salida']:
+        # Se cierra cuando el cliente haya recibido la última respuesta
+        estado['cerrar_al_vaciar'] = True
+        estado['pausado'] = True
+        return estado['cerrar']
+    
+    return should_close or estado['cerrar']
+
+def avisar_diferida(cliente_id, respuesta):
+    # Desde el hilo que completó la respuesta: se encola y se despierta al bucle
+    DIFERIDAS_LISTAS.append((cliente_id, respuesta))
+    try:
+        DESPERTADOR[1].send(b'\0')
+    except (BlockingIOError, InterruptedError):
+        pass # El socket ya tiene avisos sin leer
+
+def entregar_diferidas():
+    # Envía las respuestas diferidas ya completadas y reanuda sus conexiones
+    while DIFERIDAS_LISTAS:
+        cliente_id, respuesta = DIFERIDAS_LISTAS.popleft()
+        respuesta_status, respuesta_data = tienda.resultado_diferido(respuesta)
+        estado = CONEXIONES.get(cliente_id)
+        if estado is None or estado['diferida'] is not respuesta:
+            # La conexión se cerró mientras tanto (el descriptor pudo reutilizarse)
+            continue
+        estado['diferida'] = None
+        envio_respuesta(estado['sock'], respuesta_status, respuesta_data)
+        # Se atienden los comandos que esperaban en el buffer y en el socket
+        if control_cliente(estado['sock']):
+            cerrar_conexion(cliente_id)
+        elif cliente_id in CONEXIONES:
+            actualizar_interes(cliente_id)
+
+def solicitar_detencion(*_):
+    # Manejador de SIGTERM de un trabajador: solo marca la salida y despierta al selector,
+    # el bucle termina y cierra sus conexiones antes de detener el registro
+    global DETENER
+    DETENER = True
+    try:
+        DESPERTADOR[1].send(b'\0')
+    except (TypeError, OSError):
+        pass # Todavía sin bucle, o ya hay avisos sin leer
+
+def vaciar_despertador():
+    # Descarta los avisos acumulados (hasta EAGAIN, por el modo edge-triggered)
+    try:
+        while DESPERTADOR[0].recv(4096):
+            pass
+    except (BlockingIOError, InterruptedError):
+        pass
+
+def control_escritura(conn):
+    # El socket del cliente admite escritura: vaciamos su cola de salida
+    cliente_id = conn.fileno()
+    estado = CONEXIONES[cliente_id]
+    vaciar_salida(estado)
+
+    if estado['stream'] is not None and not estado['cerrar']:
+        alimentar_stream(estado)
+        if estado['stream'] is None and not estado['pausado'] and control_cliente(conn):
+            # Terminó el stream: se atienden los comandos que esperaban en el buffer y en el socket
+            return True
+
+    if estado['cerrar']:
+        return True
+    if not estado['salida'] and estado['cerrar_al_vaciar']:
+        return True
+
+    if estado['pausado'] and not estado['cerrar_al_vaciar'] and len(estado['salida']) <= OUTPUT_LOW_WATER:
+        # Reanudamos la lectura; con edge-triggered no llegará un nuevo aviso por
+        # los datos que ya esperan en el socket, así que los leemos ahora
+        estado['pausado'] = False
+        return control_cliente(conn)
     return False
 
-# Función principal del servidor
+def aceptar_conexiones(server_socket):
+    # Acepta hasta ACCEPT_BATCH conexiones pendientes. Con epoll edge-triggered no llegará
+    # otro aviso por las que sigan en la cola, así que se marcan para la siguiente vuelta.
+    global ACEPTACION_PENDIENTE
+    ACEPTACION_PENDIENTE = False
+    for _ in range(ACCEPT_BATCH):
+        try:
+            client_conn, client_addr = server_socket.accept()
+        except BlockingIOError:
+            return
+        except Exception as e:
+            log.error(f"Error al aceptar conexión: {e}")
+            return
+
+        client_conn.setblocking(False)
+        motivo = admision.motivo_rechazo(len(CONEXIONES), client_addr[0])
+        if motivo:
+            rechazar_conexion(client_conn, motivo)
+            continue
+
+        log.debug(f"Cliente conectado desde: {client_addr}")
+        admision.conectar(client_addr[0])
+        # Inicializamos el buffer y la sesión (carrito) del nuevo cliente
+        sesion = tienda.nueva_sesion()
+        ahora = time.monotonic()
+        CONEXIONES[client_conn.fileno()] = {
+            'sock': client_conn,
+            'addr': client_addr,
+            'buffer': tienda.BufferEntrada(BUFFER_SIZE),
+            'sesion': sesion,
+            'salida': bytearray(),
+            'stream': None,
+            'pausado': False,
+            'cerrar': False,
+            'cerrar_al_vaciar': False,
+            'eventos': selectors.EVENT_READ,
+            'actividad': ahora,
+            'limitado': False,
+            'aplazado': None,
+            'diferida': None,
+        }
+        SELECTOR.register(client_conn, selectors.EVENT_READ)
+        if IDLE_TIMEOUT > 0:
+            RUEDA_INACTIVIDAD.programar(client_conn.fileno(), ahora + IDLE_TIMEOUT)
+        # Saludo con el token para reanudar la sesión tras una reconexión
+        envio_respuesta(client_conn, *tienda.saludo(sesion))
+    ACEPTACION_PENDIENTE = True
+
+def rechazar_conexion(client_conn, motivo):
+    # Rechazo rápido: una línea de error sin crear sesión ni registrar el socket
+    CONTADORES_ADMISION['conexiones_rechazadas'] += 1
+    try:
+        client_conn.send(tienda.codificar_respuesta("ERROR", motivo))
+    except OSError:
+        pass
+    client_conn.close()
+
+def atender_conexiones():
+    # Continúa las lecturas que cedieron el turno, reanuda las conexiones cuyo comando
+    # aplazado ya tiene tokens y cierra las inactivas.
+    # Las ruedas solo trabajan cuando avanza un tick.
+    for cliente_id in list(LECTURA_PENDIENTE):
+        # Siguen del turno anterior: no llegará otro aviso de epoll por esos datos
+        LECTURA_PENDIENTE.discard(cliente_id)
+        estado = CONEXIONES.get(cliente_id)
+        if estado is None:
+            continue
+        if control_cliente(estado['sock']):
+            cerrar_conexion(cliente_id)
+        elif cliente_id in CONEXIONES:
+            actualizar_interes(cliente_id)
+
+    ahora = time.monotonic()
+    for cliente_id, _ in RUEDA_LIMITES.avanzar(ahora):
+        estado = CONEXIONES.get(cliente_id)
+        if estado is None:
+            continue
+        estado['limitado'] = False
+        if control_cliente(estado['sock']):
+            cerrar_conexion(cliente_id)
+        elif cliente_id in CONEXIONES:
+            actualizar_interes(cliente_id)
+
+    for cliente_id, _ in RUEDA_INACTIVIDAD.avanzar(ahora):
+        estado = CONEXIONES.get(cliente_id)
+        if estado is None:
+            continue
+        vence = estado['actividad'] + IDLE_TIMEOUT
+        if vence > ahora:
+            # Hubo actividad desde que se programó: se revisa de nuevo al vencer
+            RUEDA_INACTIVIDAD.programar(cliente_id, vence)
+            continue
+        log.debug(f"[{cliente_id}] conexión inactiva por {IDLE_TIMEOUT:g} s. Cerrando.")
+        CONTADORES_ADMISION['conexiones_inactivas_cerradas'] += 1
+        envio_respuesta(estado['sock'], "ERROR", "Conexion cerrada por inactividad.")
+        cerrar_conexion(cliente_id)
+
+def metricas_transporte():
+    # Conexiones abiertas y bytes retenidos en sus buffers (se calcula solo al pedir STATS)
+    return {
+        "conexiones": len(CONEXIONES),
+        "bytes_entrada_pendientes": sum(estado['buffer'].pendientes() for estado in CONEXIONES.values()),
+        "bytes_entrada_reservados": sum(len(estado['buffer'].datos) for estado in CONEXIONES.values()),
+        "bytes_salida_pendientes": sum(len(estado['salida']) for estado in CONEXIONES.values()),
+        "streams_activos": sum(estado['stream'] is not None for estado in CONEXIONES.values()),
+        "conexiones_limitadas": len(RUEDA_LIMITES),
+        "respuestas_diferidas": sum(estado['diferida'] is not None for estado in CONEXIONES.values()),
+        **CONTADORES_ADMISION,
+    }
+
+def cerrar_conexion(cliente_id):
+    # Libera el socket y el estado asociado a un cliente
+    estado = CONEXIONES.pop(cliente_id, None)
+    if estado is None:
+        return
+    tienda.cerrar_sesion(estado['sesion'])
+    admision.desconectar(estado['addr'][0])
+    LECTURA_PENDIENTE.discard(cliente_id)
+    RUEDA_INACTIVIDAD.cancelar(cliente_id)
+    RUEDA_LIMITES.cancelar(cliente_id)
+    try:
+        SELECTOR.unregister(estado['sock'])
+    except (KeyError, ValueError):
+        pass
+    try:
+        estado['sock'].close()
+    except OSError:
+        pass
 
-def main_server():
-    # Inicializa el socket de escucha y el bucle principal de select
-    global SERVER_SOCKET_FILENO
-    cargar_inventario()
+# Función principal del servidor
 
-    # Creación del socket de escucha
+def crear_socket_escucha(reuse_port=False):
+    # Crea el socket de escucha no bloqueante; con reuse_port varios procesos comparten el puerto
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # El kernel reparte las conexiones entrantes entre los procesos
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     
     try:
         server_socket.bind((HOST, PORT))
-        server_socket.listen(MAX_CONNECTIONS)
-        print(f"Servidor iniciado en {HOST}:{PORT}... Esperando conexiones.")
+        server_socket.listen(LISTEN_BACKLOG)
+        server_socket.setblocking(False)
     except Exception as e:
-        print(f"Error al iniciar el socket: {e}"); sys.exit(1)
+        log.error(f"Error al iniciar el socket: {e}"); sys.exit(1)
+    return server_socket
 
-    # El socket de escucha se agrega a la lista de monitoreo
-    SOCKET_LIST.append(server_socket)
+def bucle_eventos(server_socket):
+    # Bucle principal del motor de eventos sobre un socket de escucha ya creado
+    global SERVER_SOCKET_FILENO, SELECTOR, RUEDA_INACTIVIDAD, RUEDA_LIMITES, ACEPTACION_PENDIENTE, DESPERTADOR
+
+    try:
+        SELECTOR = crear_selector(EVENT_BACKEND)
+    except ValueError as e:
+        log.error(f"Error al crear el motor de eventos: {e}"); sys.exit(1)
+    RUEDA_INACTIVIDAD = temporizadores.RuedaTemporizadores(1.0, 512, time.monotonic())
+    RUEDA_LIMITES = temporizadores.RuedaTemporizadores(0.005, 256, time.monotonic())
+
+    # El socket de escucha se registra en el selector
+    SELECTOR.register(server_socket, selectors.EVENT_READ)
+    DESPERTADOR = socket.socketpair()
+    for extremo in DESPERTADOR:
+        extremo.setblocking(False)
+    SELECTOR.register(DESPERTADOR[0], selectors.EVENT_READ)
+    despertador_fileno = DESPERTADOR[0].fileno()
 
     # Guardamos el identificador del socket de escucha
     SERVER_SOCKET_FILENO = server_socket.fileno()
+    metricas.agregar_proveedor(metricas_transporte)
+    log.info(f"Servidor iniciado en {HOST}:{PORT} ({type(SELECTOR).__name__})... Esperando conexiones.")
 
     # Bucle principal
-    while True:
+    while not DETENER:
         try:
-            readable, _, exceptional = select.select(SOCKET_LIST, [], SOCKET_LIST, 0.5)
-            
-            # Manejo de sockets con errores excepcionales
-            for sock in exceptional:
-                sock.close()
-                if sock in SOCKET_LIST: SOCKET_LIST.remove(sock)
-                if sock.fileno() in CLIENTE_CARRITOS: del CLIENTE_CARRITOS[sock.fileno()]
-                if sock.fileno() in CLIENT_BUFFERS: del CLIENT_BUFFERS[sock.fileno()]
-
-
-            for sock in readable:
-                if sock.fileno() == SERVER_SOCKET_FILENO:
-                    # El socket de escucha está listo -> Nueva conexión
-                    try:
-                        client_conn, client_addr = server_socket.accept()
-                        print(f"Cliente conectado desde: {client_addr}")
-                        SOCKET_LIST.append(client_conn)
-                        # Inicializamos el buffer y el carrito para el nuevo cliente
-                        CLIENT_BUFFERS[client_conn.fileno()] = b''
-                        CLIENTE_CARRITOS[client_conn.fileno()] = {}
-
-                    except Exception as e:
-                        print(f"Error al aceptar conexión: {e}")
-                else:
+            # Sin esperar si quedan conexiones por aceptar; poco si hay comandos aplazados
+            if ACEPTACION_PENDIENTE or LECTURA_PENDIENTE:
+                espera = 0
+            elif len(RUEDA_LIMITES):
+                espera = RUEDA_LIMITES.resolucion
+            else:
+                espera = SELECT_TIMEOUT
+            eventos = SELECTOR.select(espera)
+            inicio_vuelta = time.perf_counter()
+            # Liberamos las reservas vencidas (la rueda solo trabaja cuando avanza un tick)
+            tienda.atender_temporizadores()
+            atender_conexiones()
+
+            for clave, mascara in eventos:
+                if clave.fd == SERVER_SOCKET_FILENO:
+                    # El socket de escucha está listo -> Nuevas conexiones (se aceptan al final de la vuelta)
+                    ACEPTACION_PENDIENTE = True
+                    continue
+                if clave.fd == despertador_fileno:
+                    # Otro hilo completó respuestas diferidas (se entregan al final de la vuelta)
+                    vaciar_despertador()
+                    continue
+
+                should_close = False
+                if mascara & selectors.EVENT_WRITE and clave.fd in CONEXIONES:
+                    # El cliente puede recibir más datos de su cola de salida
+                    should_close = control_escritura(clave.fileobj)
+                if not should_close and mascara & selectors.EVENT_READ and clave.fd in CONEXIONES:
                     # Un socket de cliente existente está listo para enviar datos
-                    should_close = control_cliente(sock)
-                    
-                    if should_close:
-                        print(f"Cerrando conexión con cliente {sock.fileno()}.")
-                        sock.close()
-                        if sock in SOCKET_LIST: SOCKET_LIST.remove(sock)
-                        if sock.fileno() in CLIENTE_CARRITOS: del CLIENTE_CARRITOS[sock.fileno()]
-                        if sock.fileno() in CLIENT_BUFFERS: del CLIENT_BUFFERS[sock.fileno()]
+                    should_close = control_cliente(clave.fileobj)
 
+                if should_close:
+                    log.debug(f"Cerrando conexión con cliente {clave.fd}.")
+                    cerrar_conexion(clave.fd)
+                elif clave.fd in CONEXIONES:
+                    actualizar_interes(clave.fd)
+
+            if DIFERIDAS_LISTAS:
+                entregar_diferidas()
+            if ACEPTACION_PENDIENTE:
+                aceptar_conexiones(server_socket)
+
+            if eventos:
+                # Lag: tiempo que un socket listo puede esperar mientras se atiende esta vuelta
+                metricas.registrar_lag((time.perf_counter() - inicio_vuelta) * 1e6)
 
         except KeyboardInterrupt:
-            print("\nServidor detenido manualmente.")
+            log.info("Servidor detenido manualmente.")
             break
         except Exception as e:
-            print(f"Error fatal del servidor: {e}")
+            log.critical(f"Error fatal del servidor: {e}")
             break
+    if DETENER:
+        log.info("Trabajador detenido (SIGTERM).")
 
     # Cierre de recursos
-    for sock in SOCKET_LIST:
-        try:
-            sock.close()
-        except:
-            pass
+    for cliente_id in list(CONEXIONES):
+        cerrar_conexion(cliente_id)
+    try:
+        SELECTOR.close()
+        server_socket.close()
+        for extremo in DESPERTADOR:
+            extremo.close()
+    except:
+        pass
+
+def main_server():
+    # Inicializa el socket de escucha y el bucle principal del motor de eventos
+    tienda.cargar_inventario()
+    ajustar_limite_descriptores()
+    bucle_eventos(crear_socket_escucha())
+
+def proceso_trabajador(num_worker):
+    # Cada trabajador tiene su propio socket (SO_REUSEPORT), selector y conexiones;
+    # el stock lo comparte con el resto a través de la memoria compartida de tienda
+    signal.signal(signal.SIGTERM, solicitar_detencion)
+    registro.configurar() # El hilo de registro del padre no existe tras el fork
+    try:
+        bucle_eventos(crear_socket_escucha(reuse_port=True))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Tras salir del bucle: multiprocessing termina el hijo con os._exit, sin atexit
+        registro.detener()
+
+def main_prefork(num_workers):
+    # Modo pre-fork: el proceso padre carga el inventario y crea N trabajadores
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        log.error("SO_REUSEPORT no está disponible en este sistema."); sys.exit(1)
+
+    tienda.cargar_inventario()
+    tienda.activar_stock_compartido()
+    tienda.TRABAJADORES = num_workers
+    ajustar_limite_descriptores()
+
+    contexto = multiprocessing.get_context('fork')
+    procesos = []
+    for num in range(num_workers):
+        proceso = contexto.Process(target=proceso_trabajador, args=(num,), name=f"worker-{num}")
+        proceso.start()
+        procesos.append(proceso)
+    log.info(f"Modo pre-fork: {num_workers} trabajadores en {HOST}:{PORT}.")
+
+    # SIGTERM al padre también detiene a los trabajadores
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        for proceso in procesos:
+            proceso.join()
+    except KeyboardInterrupt:
+        log.info("Servidor detenido manualmente.")
+    finally:
+        for proceso in procesos:
+            if proceso.is_alive():
+                proceso.terminate()
+        for proceso in procesos:
+            proceso.join()
     
 if __name__ == "__main__":
-    main_server()
+    parser = argparse.ArgumentParser(description="Servidor de la tienda en línea")
+    parser.add_argument('--backend', default=EVENT_BACKEND,
+                        choices=['auto', 'epoll_et', 'epoll', 'poll', 'select'],
+                        help="Motor de eventos del bucle principal")
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help="Número de procesos trabajadores (pre-fork con SO_REUSEPORT; "
+                             "RESUME solo recupera sesiones del mismo trabajador)")
+    parser.add_argument('--backlog', type=int, default=LISTEN_BACKLOG, help="Cola de conexiones pendientes de listen()")
+    parser.add_argument('--accept-lote', type=int, default=ACCEPT_BATCH, help="Conexiones aceptadas por vuelta del bucle")
+    parser.add_argument('--max-conexiones', type=int, default=admision.MAX_CONNECTIONS,
+                        help="Conexiones simultáneas por proceso; las siguientes se rechazan")
+    parser.add_argument('--max-conexiones-ip', type=int, default=admision.MAX_CONNECTIONS_PER_IP)
+    parser.add_argument('--limite-peticiones', type=float, default=admision.RATE_LIMIT,
+                        help="Tokens por segundo por IP (0 desactiva el límite)")
+    parser.add_argument('--rafaga', type=float, default=admision.RATE_BURST, help="Tokens máximos acumulados por IP")
+    parser.add_argument('--limitar-loopback', action='store_true',
+                        help="Aplica los límites por IP también a 127.0.0.1 (por defecto exenta, p. ej. para el benchmark)")
+    parser.add_argument('--inactividad', type=float, default=IDLE_TIMEOUT,
+                        help="Segundos sin actividad antes de cerrar una conexión (0 desactiva)")
+    parser.add_argument('--almacen', default='json', choices=['json', 'sqlite'],
+                        help="Almacenamiento del inventario: JSON + diario en memoria o SQLite (WAL) con filas bajo demanda")
+    parser.add_argument('--log-nivel', default=registro.NIVEL, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="Nivel de registro (DEBUG incluye cada conexión)")
+    args = parser.parse_args()
+    EVENT_BACKEND = args.backend
+    LISTEN_BACKLOG = args.backlog
+    ACCEPT_BATCH = max(args.accept_lote, 1)
+    IDLE_TIMEOUT = args.inactividad
+    admision.MAX_CONNECTIONS = args.max_conexiones
+    admision.MAX_CONNECTIONS_PER_IP = args.max_conexiones_ip
+    admision.RATE_LIMIT = args.limite_peticiones
+    admision.RATE_BURST = args.rafaga
+    admision.LIMITAR_LOOPBACK = args.limitar_loopback
+    registro.NIVEL = args.log_nivel
+    registro.configurar()
+    tienda.configurar_almacen(args.almacen)
+    if args.workers > 1:
+        main_prefork(args.workers)
+    else:
+        main_server()
@@ -0,0 +1,199 @@
+# Servidor -> asyncio (Protocol), mismos protocolos (texto "STATUS <json>\n" o binario) que server.py
+#
+# No tiene control de admisión (admision.py): sin límite de conexiones ni de peticiones por IP.
+# Al compararlo con server.py en el benchmark (desde loopback) server.py tampoco limita.
+
+import asyncio
+import argparse
+import logging
+import sys
+
+import metricas
+import registro
+import tienda
+from server import HOST, PORT, BUFFER_SIZE, LISTEN_BACKLOG, OUTPUT_HIGH_WATER, OUTPUT_LOW_WATER, OUTPUT_HARD_LIMIT
+
+log = logging.getLogger("server_async")
+
+LAG_INTERVAL = 0.25 # Cada cuánto se mide el retraso del bucle de eventos
+CONEXIONES = set() # Protocolos de las conexiones abiertas (para STATS)
+
+class ProtocoloTienda(asyncio.BufferedProtocol):
+    # Una instancia por conexión: reconstruye comandos y delega en la lógica de la tienda.
+    # Como BufferedProtocol, el bucle recibe directamente en el buffer de la conexión (recv_into).
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.sesion = tienda.nueva_sesion()
+        self.buffer = tienda.BufferEntrada(BUFFER_SIZE)
+        self.stream = None # Iterador de una respuesta en streaming en curso
+        self.diferida = None # tienda.RespuestaDiferida que completa otro hilo
+        self.pausado = False
+        self.cerrando = False
+        # Backpressure: asyncio llama a pause_writing/resume_writing con estos límites
+        transport.set_write_buffer_limits(high=OUTPUT_HIGH_WATER, low=OUTPUT_LOW_WATER)
+        CONEXIONES.add(self)
+        # Saludo con el token para reanudar la sesión tras una reconexión
+        transport.write(tienda.codificar_para(self.sesion, *tienda.saludo(self.sesion)))
+        log.debug(f"Cliente conectado desde: {transport.get_extra_info('peername')}")
+
+    def get_buffer(self, sizehint):
+        return self.buffer.espacio_libre()
+
+    def buffer_updated(self, nbytes):
+        self.buffer.avanzar(nbytes)
+        self.procesar_buffer()
+
+    def procesar_buffer(self):
+        # Procesar mensajes completos (líneas o tramas) mientras el cliente consuma sus respuestas
+        while not self.pausado and not self.cerrando and self.stream is None and self.diferida is None:
+            try:
+                mensaje = tienda.siguiente_mensaje(self.sesion, self.buffer)
+                if mensaje is None:
+                    break
+                accion, params = mensaje
+                if accion is None:
+                    continue
+                respuesta_status, respuesta_data, cerrar = tienda.ejecutar_accion(self.sesion, accion, params)
+            except tienda.MensajeInvalido as e:
+                # No se puede saber dónde empieza el siguiente comando: se responde y se cierra
+                respuesta_status, respuesta_data, cerrar = "ERROR", f"Mensaje inválido: {e}", True
+            except Exception as e:
+                log.error(f"Error de lógica o sintaxis: {e}")
+                respuesta_status, respuesta_data, cerrar = "ERROR", f"Error al procesar el comando: {e}", False
+
+            if isinstance(respuesta_data, tienda.RespuestaStream):
+                # Las líneas se generan a medida que el cliente las consume; mientras
+                # tanto no se reciben más comandos (el buffer de entrada es acotado)
+                self.stream = iter(respuesta_data)
+                self.transport.pause_reading()
+                self.alimentar_stream()
+                continue
+
+            if isinstance(respuesta_data, tienda.RespuestaDiferida):
+                # Se responde cuando otro hilo la complete; call_soon_threadsafe la trae al bucle
+                self.diferida = respuesta_data
+                self.transport.pause_reading()
+                loop = asyncio.get_running_loop()
+                respuesta_data.al_completar(lambda: loop.call_soon_threadsafe(self.entregar_diferida, respuesta_data))
+                continue
+
+            self.enviar(respuesta_status, respuesta_data, cerrar)
+
+    def enviar(self, respuesta_status, respuesta_data, cerrar):
+        self.transport.write(tienda.codificar_para(self.sesion, respuesta_status, respuesta_data))
+
+        if self.transport.get_write_buffer_size() > OUTPUT_HARD_LIMIT:
+            log.warning(f"Cola de salida excedida. Desconectando.")
+            self.cerrando = True
+            self.transport.abort()
+        elif cerrar:
+            # close() espera a que se envíe lo pendiente
+            self.cerrando = True
+            self.transport.close()
+
+    def entregar_diferida(self, respuesta):
+        # En el bucle: envía la respuesta completada y atiende los comandos que esperaban
+        respuesta_status, respuesta_data = tienda.resultado_diferido(respuesta)
+        self.diferida = None
+        if self.cerrando or self.transport.is_closing():
+            return
+        self.enviar(respuesta_status, respuesta_data, False)
+        if not self.pausado and not self.cerrando:
+            self.transport.resume_reading()
+            self.procesar_buffer()
+
+    def alimentar_stream(self):
+        # Escribe líneas del stream hasta que asyncio pida pausar la escritura
+        while self.stream is not None and not self.pausado and not self.cerrando:
+            try:
+                self.transport.write(next(self.stream))
+            except StopIteration:
+                self.stream = None
+                if self.diferida is None:
+                    self.transport.resume_reading()
+
+    def pause_writing(self):
+        # La cola de salida superó OUTPUT_HIGH_WATER: dejamos de leer comandos
+        self.pausado = True
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.pausado = False
+        if not self.cerrando:
+            if self.stream is None and self.diferida is None:
+                self.transport.resume_reading()
+            self.alimentar_stream()
+            self.procesar_buffer()
+
+    def connection_lost(self, exc):
+        tienda.cerrar_sesion(self.sesion)
+        CONEXIONES.discard(self)
+        log.debug(f"Cerrando conexión con cliente {self.transport.get_extra_info('peername')}.")
+
+def atender_temporizadores(loop):
+    # Libera las reservas vencidas una vez por segundo
+    tienda.atender_temporizadores()
+    loop.call_later(1.0, atender_temporizadores, loop)
+
+def medir_lag(loop, programado):
+    # Lag: cuánto más tarde de lo previsto se ejecutó esta llamada
+    metricas.registrar_lag((loop.time() - programado) * 1e6)
+    siguiente = loop.time() + LAG_INTERVAL
+    loop.call_at(siguiente, medir_lag, loop, siguiente)
+
+def metricas_transporte():
+    # Conexiones abiertas y bytes retenidos en sus buffers (se calcula solo al pedir STATS)
+    return {
+        "conexiones": len(CONEXIONES),
+        "bytes_entrada_pendientes": sum(c.buffer.pendientes() for c in CONEXIONES),
+        "bytes_entrada_reservados": sum(len(c.buffer.datos) for c in CONEXIONES),
+        "bytes_salida_pendientes": sum(c.transport.get_write_buffer_size() for c in CONEXIONES),
+        "streams_activos": sum(c.stream is not None for c in CONEXIONES),
+        "respuestas_diferidas": sum(c.diferida is not None for c in CONEXIONES),
+    }
+
+async def main_async():
+    tienda.cargar_inventario()
+    loop = asyncio.get_running_loop()
+    atender_temporizadores(loop)
+    medir_lag(loop, loop.time())
+    metricas.agregar_proveedor(metricas_transporte)
+    try:
+        servidor = await loop.create_server(ProtocoloTienda, HOST, PORT,
+                                            reuse_address=True, backlog=LISTEN_BACKLOG)
+    except Exception as e:
+        log.error(f"Error al iniciar el socket: {e}"); sys.exit(1)
+
+    log.info(f"Servidor asyncio iniciado en {HOST}:{PORT} ({type(loop).__name__})... Esperando conexiones.")
+    async with servidor:
+        await servidor.serve_forever()
+
+def usar_uvloop():
+    # Instala uvloop como política de eventos si está disponible
+    try:
+        import uvloop
+    except ImportError:
+        log.warning("uvloop no está instalado; se usa el bucle estándar de asyncio.")
+        return False
+    uvloop.install()
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor asyncio de la tienda en línea")
+    parser.add_argument('--uvloop', action='store_true', help="Ejecutar sobre uvloop si está instalado")
+    parser.add_argument('--almacen', default='json', choices=['json', 'sqlite'],
+                        help="Almacenamiento del inventario: JSON + diario en memoria o SQLite (WAL) con filas bajo demanda")
+    parser.add_argument('--log-nivel', default=registro.NIVEL, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="Nivel de registro (DEBUG incluye cada conexión)")
+    args = parser.parse_args()
+    registro.NIVEL = args.log_nivel
+    registro.configurar()
+    tienda.configurar_almacen(args.almacen)
+
+    if args.uvloop:
+        usar_uvloop()
+    try:
+        asyncio.run(main_async())
+    except KeyboardInterrupt:
+        log.info("Servidor detenido manualmente.")
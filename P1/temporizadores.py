@@ -0,0 +1,59 @@
+# Rueda de temporizadores -> Vencimientos de muchas claves sin un hilo ni un heap por temporizador
+
+class RuedaTemporizadores:
+    # Rueda "hashed": cada temporizador vive en la ranura (tick de vencimiento % ranuras).
+    # Programar, reprogramar y cancelar cuestan O(1); cada avance de tick solo revisa
+    # su ranura. Si un vencimiento está a más de una vuelta, la entrada se conserva
+    # en su ranura hasta la vuelta que le corresponde.
+
+    def __init__(self, resolucion: float, ranuras: int, ahora: float):
+        self.resolucion = resolucion # Segundos por tick
+        self.ranuras = [{} for _ in range(ranuras)] # clave -> (tick de vencimiento, valor)
+        self.ubicacion = {} # clave -> índice de su ranura
+        self.tick = int(ahora / resolucion) # Último tick procesado
+
+    def __len__(self):
+        return len(self.ubicacion)
+
+    def __contains__(self, clave):
+        return clave in self.ubicacion
+
+    def programar(self, clave, vence: float, valor=None):
+        # (Re)programa 'clave' para el instante 'vence' (mismo reloj que 'ahora')
+        self.cancelar(clave)
+        tick = max(-int(-vence // self.resolucion), self.tick + 1) # Redondeo hacia arriba
+        indice = tick % len(self.ranuras)
+        self.ranuras[indice][clave] = (tick, valor)
+        self.ubicacion[clave] = indice
+
+    def vencimiento(self, clave):
+        # Instante (redondeado al tick) en que vence 'clave', o None si no está programada
+        indice = self.ubicacion.get(clave)
+        if indice is None:
+            return None
+        return self.ranuras[indice][clave][0] * self.resolucion
+
+    def cancelar(self, clave):
+        indice = self.ubicacion.pop(clave, None)
+        if indice is not None:
+            del self.ranuras[indice][clave]
+
+    def avanzar(self, ahora: float) -> list:
+        # Procesa los ticks transcurridos hasta 'ahora' y devuelve [(clave, valor)] vencidos
+        objetivo = int(ahora / self.resolucion)
+        if objetivo <= self.tick:
+            return []
+        vencidos = []
+        n = len(self.ranuras)
+        # Tras una pausa larga basta con recorrer cada ranura una vez
+        for paso in range(1, min(objetivo - self.tick, n) + 1):
+            ranura = self.ranuras[(self.tick + paso) % n]
+            if not ranura:
+                continue
+            for clave, (tick, valor) in list(ranura.items()):
+                if tick <= objetivo:
+                    del ranura[clave]
+                    del self.ubicacion[clave]
+                    vencidos.append((clave, valor))
+        self.tick = objetivo
+        return vencidos
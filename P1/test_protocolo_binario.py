@@ -0,0 +1,82 @@
+# Pruebas del protocolo binario -> Tramas inválidas, con y sin el paquete msgpack
+#
+# Ejecutar desde P1: python -m unittest test_protocolo_binario
+
+import types
+import unittest
+from unittest import mock
+
+import protocolo_binario
+import tienda
+
+# Cuerpos msgpack inválidos: tipo reservado, str truncado, lista truncada, bytes de más,
+# UTF-8 inválido y clave de mapa no hashable
+CUERPOS_INVALIDOS = [
+    b"\xc1",
+    b"\xa5ab",
+    b"\x93\x01",
+    b"\x90\x00",
+    b"\xa2\xff\xfe",
+    b"\x81\x90\x01",
+]
+
+def trama(opcode, cuerpo):
+    payload = bytes([opcode]) + cuerpo
+    return protocolo_binario.CABECERA.pack(len(payload)) + payload
+
+class PruebasCuerpoInvalido:
+    # Casos comunes; cada subclase fija la implementación de msgpack que se usa
+
+    def test_desempaquetar(self):
+        for cuerpo in CUERPOS_INVALIDOS:
+            with self.subTest(cuerpo=cuerpo):
+                with self.assertRaises(protocolo_binario.TramaInvalida):
+                    protocolo_binario.desempaquetar(cuerpo)
+
+    def test_buffer_entrada(self):
+        # La trama inválida llega a la tienda como MensajeInvalido (se responde ERROR y se cierra)
+        for cuerpo in CUERPOS_INVALIDOS:
+            with self.subTest(cuerpo=cuerpo):
+                entrada = tienda.BufferEntrada()
+                datos = trama(protocolo_binario.OPCODE_POR_ACCION["BUSCAR"], cuerpo)
+                entrada.espacio_libre()[:len(datos)] = datos
+                entrada.avanzar(len(datos))
+                with self.assertRaises(tienda.MensajeInvalido):
+                    entrada.siguiente_trama()
+
+    def test_parametros(self):
+        opcode = protocolo_binario.OPCODE_POR_ACCION["BATCH"]
+        params = ["AGREGAR", "1", 2, ";", "EDITAR", "3", 0]
+        payload = bytes([opcode]) + protocolo_binario.empaquetar(params)
+        self.assertEqual(protocolo_binario.decodificar_peticion(payload),
+                         ("BATCH", ["AGREGAR", "1", "2", ";", "EDITAR", "3", "0"]))
+        for param in ["1 2", "1;2", "", None, True, ["1"], {"a": 1}]:
+            with self.subTest(param=param):
+                payload = bytes([opcode]) + protocolo_binario.empaquetar(["AGREGAR", param, 1])
+                with self.assertRaises(protocolo_binario.TramaInvalida):
+                    protocolo_binario.decodificar_peticion(payload)
+
+class PruebasSinMsgpack(PruebasCuerpoInvalido, unittest.TestCase):
+    def setUp(self):
+        parche = mock.patch.object(protocolo_binario, "msgpack", None)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+@unittest.skipIf(protocolo_binario.msgpack is None, "msgpack no está instalado")
+class PruebasConMsgpack(PruebasCuerpoInvalido, unittest.TestCase):
+    pass
+
+class PruebasErroresMsgpack(unittest.TestCase):
+    # Cualquier excepción de msgpack.unpackb (ExtraData, FormatError, StackError...) se convierte en TramaInvalida
+
+    def test_excepcion_de_unpackb(self):
+        class ExtraData(ValueError):
+            pass
+        for error in [ExtraData("extra"), ValueError("valor"), TypeError("tipo"), Exception("otro")]:
+            falso = types.SimpleNamespace(unpackb=mock.Mock(side_effect=error))
+            with self.subTest(error=error), mock.patch.object(protocolo_binario, "msgpack", falso):
+                with self.assertRaises(protocolo_binario.TramaInvalida):
+                    protocolo_binario.desempaquetar(b"\x91\x01")
+
+if __name__ == "__main__":
+    unittest.main()
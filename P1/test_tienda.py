@@ -0,0 +1,128 @@
+# Pruebas de los manejadores de la tienda -> Inventario de prueba en un directorio temporal
+#
+# Ejecutar desde P1: python -m unittest test_tienda
+
+import errno
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import almacen
+import diario
+import protocolo_binario
+import tienda
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+class PruebaTienda(unittest.TestCase):
+    # Copia inventario.json a un directorio temporal y lo carga con el almacén JSON
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio)
+        ruta = os.path.join(self.directorio, 'inventario.json')
+        shutil.copy(os.path.join(DIRECTORIO, 'inventario.json'), ruta)
+        for modulo, nombre, valor in [(tienda, 'INVENTORY_FILE', ruta),
+                                      (diario, 'JOURNAL_FILE', os.path.join(self.directorio, 'inventario.journal'))]:
+            self.addCleanup(setattr, modulo, nombre, getattr(modulo, nombre))
+            setattr(modulo, nombre, valor)
+        tienda.configurar_almacen('json')
+        tienda.cargar_inventario()
+        self.sesion = tienda.nueva_sesion()
+
+    def comando(self, mensaje):
+        status, data, _ = tienda.ejecutar_comando(self.sesion, mensaje)
+        return status, data
+
+class PruebasPaginacion(PruebaTienda):
+    # Las palabras PAGINA y STREAM al final de BUSCAR o LISTAR se buscan tal cual
+
+    def setUp(self):
+        super().setUp()
+        producto = {"marca": "Prueba", "tipo": "Pagina 1 2", "precio": 1.0, "stock": 1}
+        tienda.actualizar_producto("900", dict(producto, nombre="Cafe Stream", id="900"))
+        tienda.actualizar_producto("901", dict(producto, nombre="Libro X Pagina 1 2", id="901"))
+
+    def test_busqueda_literal(self):
+        for mensaje, ids in [("BUSCAR CAFE STREAM", {"900"}), ("BUSCAR X PAGINA 1 2", {"901"}),
+                             ("LISTAR PAGINA 1 2", {"900", "901"})]:
+            with self.subTest(mensaje=mensaje):
+                status, data = self.comando(mensaje)
+                self.assertEqual(status, "OK")
+                self.assertEqual(set(data), ids)
+
+    def test_comandos_de_pagina(self):
+        status, data = self.comando("BUSCAR_PAGINA 0 1 CAFE STREAM")
+        self.assertEqual((status, list(data["productos"]), data["total"]), ("OK", ["900"], 1))
+        status, data = self.comando("LISTAR_PAGINA 1 1 PAGINA 1 2")
+        self.assertEqual((status, len(data["productos"]), data["siguiente"], data["total"]), ("OK", 1, None, 2))
+        status, data = self.comando("VER_PRODUCTOS_PAGINA 0 2")
+        self.assertEqual((status, len(data["productos"]), data["siguiente"]), ("OK", 2, 2))
+        status, data = self.comando("BUSCAR_STREAM CAFE STREAM")
+        lineas = list(data)
+        self.assertEqual(len(lineas), 2)
+        self.assertTrue(lineas[0].startswith(b"PARTE ") and b'"900"' in lineas[0])
+        self.assertEqual(lineas[1], b'FIN {"total": 1}\n')
+
+    def test_errores(self):
+        for mensaje in ["VER_PRODUCTOS A B", "BUSCAR_PAGINA 0 X CAFE", "BUSCAR_PAGINA 0 5",
+                        "LISTAR_PAGINA -1 5 ALIMENTOS", "VER_PRODUCTOS_STREAM CAFE"]:
+            with self.subTest(mensaje=mensaje):
+                self.assertEqual(self.comando(mensaje)[0], "ERROR")
+
+class PruebasParametros(PruebaTienda):
+    # Los manejadores reciben la lista de palabras tal cual, del texto o de la trama binaria
+
+    def test_batch(self):
+        for params in [["AGREGAR", "101", "2;", "EDITAR", "102", "1"], ["AGREGAR", "101", "2", ";", "EDITAR", "102", "1"],
+                       ["AGREGAR", "101", "2;EDITAR", "102", "1;"]]:
+            with self.subTest(params=params):
+                status, data, _ = tienda.ejecutar_accion(self.sesion, "BATCH", params)
+                self.assertEqual(status, "OK")
+                self.assertEqual(data["carrito"], {"101": 2, "102": 1})
+                self.assertEqual(tienda.ejecutar_accion(self.sesion, "EDITAR_CARRITO", ["101", "0"])[0], "OK")
+                self.assertEqual(tienda.ejecutar_accion(self.sesion, "EDITAR_CARRITO", ["102", "0"])[0], "OK")
+
+    def test_texto_y_binario(self):
+        # El mismo comando por los dos protocolos da la misma respuesta
+        trama = protocolo_binario.codificar_peticion("BUSCAR", ["CAFE", "TOSTADO"])
+        accion, params = protocolo_binario.decodificar_peticion(trama[protocolo_binario.CABECERA.size:])
+        self.assertEqual((accion, params), tienda.parseo("BUSCAR CAFE TOSTADO"))
+        self.assertEqual(tienda.ejecutar_accion(self.sesion, accion, params)[1], self.comando("BUSCAR CAFE TOSTADO")[1])
+
+class PruebasFsyncFallido(PruebaTienda):
+    # Una compra cuyo fsync falla se revierte también en el diario: reproducirlo tras una
+    # caída (antes de restablecer la persistencia) no debe volver a aplicar la venta
+
+    def restablecer(self):
+        # Hasta que el hilo del diario termine el lote y se escriba la instantánea nueva
+        limite = time.monotonic() + 2
+        while time.monotonic() < limite:
+            tienda.PROXIMO_REINTENTO = 0
+            if tienda.persistencia_disponible():
+                return
+            time.sleep(0.01)
+        self.fail("No se restableció la persistencia.")
+
+    def test_reproducir_tras_fsync_fallido(self):
+        stock_inicial = tienda.stock_producto("101")
+        self.assertEqual(self.comando("AGREGAR_CARRITO 101 2")[0], "OK")
+
+        with mock.patch.object(diario.os, 'fsync', side_effect=OSError(errno.EIO, "Error de E/S")):
+            status, respuesta = self.comando("FINALIZAR_COMPRA")
+            self.assertEqual(status, "OK")
+            self.assertEqual(respuesta.futuro.result(timeout=2)[0], "ERROR")
+            self.assertEqual(tienda.resultado_diferido(respuesta)[0], "ERROR")
+        self.addCleanup(self.restablecer)
+
+        self.assertEqual(tienda.stock_producto("101"), stock_inicial)
+        self.assertEqual(self.sesion['carrito'], {"101": 2})
+        # Caída: se carga de nuevo la última instantánea y se reproduce el diario
+        inventario = almacen.AlmacenJSON(tienda.INVENTORY_FILE).cargar()
+        self.assertEqual(inventario["101"]["stock"], stock_inicial)
+
+if __name__ == "__main__":
+    unittest.main()
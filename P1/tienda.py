@@ -0,0 +1,1301 @@
+# Lógica de la tienda -> Independiente del transporte (select/epoll o asyncio)
+
+import collections
+import concurrent.futures
+import ctypes
+import hashlib
+import itertools
+import json
+import logging
+import os
+import multiprocessing
+import secrets
+import threading
+import time
+
+import almacen
+import diario
+import indices
+import metricas
+import protocolo_binario
+import recarga
+import temporizadores
+
+log = logging.getLogger(__name__)
+
+# Configuración del inventario
+INVENTORY_FILE = 'inventario.json'
+ALMACEN = almacen.AlmacenJSON(INVENTORY_FILE) # Ver configurar_almacen
+
+# Variables globales auxiliares
+INVENTARIO = {} # id -> producto (dict, o ProductosSQLite con el almacén SQLite)
+INDICE_TEXTO = indices.IndiceTrigramas() # Búsqueda por subcadena en nombre/marca
+INDICE_TIPO = indices.IndiceSecundario('tipo') # tipo -> ids
+INDICE_MARCA = indices.IndiceSecundario('marca') # marca -> ids
+INDICE_PRECIO = indices.IndiceRango('precio') # Consultas por rango de precio
+INDICE_STOCK = indices.IndiceRango('stock') # Consultas por rango de stock
+
+# Stock compartido entre procesos (modo pre-fork). Si es None el stock vive en INVENTARIO
+STOCK_COMPARTIDO = None # RawArray con un entero por producto
+VERSION_STOCK = None # RawValue que aumenta con cada compra confirmada en cualquier proceso
+STOCK_LOCK = threading.Lock() # Serializa validación, descuento de stock y escritura al diario
+SLOTS = {} # id de producto -> posición en STOCK_COMPARTIDO
+VERSION_LOCAL = 0 # Última versión del stock compartido copiada a INVENTARIO (o de la base SQLite)
+
+# Recarga en caliente de INVENTORY_FILE (almacén JSON): un hilo vigila el archivo y prepara el
+# inventario nuevo con sus índices; el bucle lo aplica entre eventos (aplicar_recarga).
+# El stock del archivo se combina con el actual: stock + (archivo - base), donde base es lo que
+# el archivo decía cuando se cargó o se escribió por última vez, así no se pierden las ventas
+# hechas desde entonces.
+RELOAD_INTERVAL = 1.0 # Segundos entre revisiones del archivo (0 desactiva la recarga)
+RELOAD_SLOTS_EXTRA = 1024 # Slots libres en STOCK_COMPARTIDO para productos agregados en caliente
+MAX_ID_BYTES = 64 # Longitud máxima del id de un producto agregado en caliente (pre-fork)
+VIGILANTE = None # recarga.Vigilante de este proceso
+VIGILANTE_PID = None
+BASE_ARCHIVO = {} # id -> stock que figura en INVENTORY_FILE (un solo proceso)
+BASE_COMPARTIDA = None # RawArray paralelo a STOCK_COMPARTIDO con el stock que figura en el archivo
+FIRMA_ARCHIVO = [0, 0, 0] # Firma del archivo cuyo stock ya está incorporado; RawArray en pre-fork
+GENERACION_CATALOGO = [0] # Recargas aplicadas en cualquier proceso; RawArray en pre-fork
+GENERACION_LOCAL = 0 # GENERACION_CATALOGO del inventario cargado en este proceso
+SLOTS_INICIALES = 0 # Slots asignados al activar el stock compartido
+IDS_NUEVOS = None # RawArray con el id de cada slot agregado en caliente (SLOTS_INICIALES + i)
+NUM_NUEVOS = None # RawValue: entradas usadas de IDS_NUEVOS
+NUEVOS_CONOCIDOS = 0 # Entradas de IDS_NUEVOS ya copiadas a SLOTS en este proceso
+
+# Reservas de stock: las unidades en un carrito quedan retenidas hasta la compra o hasta que vencen.
+# Disponible para otros clientes = stock - reservado.
+RESERVATION_TTL = 300 # Segundos que duran las reservas de una sesión desde su último cambio de carrito
+RESERVATION_GRACE = 30 # Segundos que se conservan las reservas de una sesión desconectada (para un RESUME)
+RESERVADO = {} # id -> unidades reservadas (un solo proceso)
+RESERVADO_COMPARTIDO = None # RawArray paralelo a STOCK_COMPARTIDO con las unidades reservadas
+RUEDA_RESERVAS = temporizadores.RuedaTemporizadores(1.0, 512, time.monotonic()) # id de sesión -> vencimiento
+CONTADOR_SESIONES = itertools.count(1)
+
+# Compras: el bucle valida y confirma en memoria (o en el WAL de SQLite, sin fsync); la
+# durabilidad llega en otro hilo y recién entonces un hilo del pool numera y arma el
+# ticket. La respuesta viaja como RespuestaDiferida y el bucle no espera al disco.
+PERSIST_WORKERS = 4 # Hilos del pool de persistencia y tickets de cada proceso
+POOL_PERSISTENCIA = None
+POOL_PID = None
+PREFIJO_TICKETS = format(int(time.time()), 'x') # Arranque del servidor: distingue los tickets entre reinicios
+CONTADOR_TICKETS = [0] # Tickets emitidos; RawArray compartido en pre-fork
+LOCK_TICKETS = threading.Lock()
+# Si un fsync falla la compra se revierte y se responde ERROR; hasta restablecer la persistencia
+# (instantánea nueva del diario o checkpoint de SQLite) no se aceptan más compras en el proceso
+REINTENTO_PERSISTENCIA = 1.0 # Segundos entre intentos de restablecer la persistencia
+FALLO_BASE = None # Error del último fsync fallido del WAL de SQLite (el del diario lo guarda diario)
+PROXIMO_REINTENTO = 0.0
+COMPRAS_EN_CURSO = 0 # Compras de este proceso que esperan su confirmación en disco
+
+# Sesiones reanudables: el carrito se guarda por token y sobrevive a una reconexión (RESUME <token>).
+# Viven en la memoria del proceso: en modo pre-fork (TRABAJADORES > 1) la reconexión suele llegar a
+# otro trabajador (SO_REUSEPORT reparte por dirección y puerto de origen) y el RESUME falla;
+# para reanudar sesiones de forma fiable se usa un solo trabajador.
+TRABAJADORES = 1 # Procesos que atienden conexiones (lo fija server.main_prefork)
+SESSION_IDLE_TTL = 1800 # Segundos que se conserva una sesión sin conexión
+MAX_SESSIONS = 100000 # Al superarlo se descartan las sesiones sin conexión menos usadas
+SESIONES = collections.OrderedDict() # token -> sesión, de la menos a la más recientemente usada
+RUEDA_SESIONES = temporizadores.RuedaTemporizadores(10.0, 256, time.monotonic()) # token -> vencimiento sin conexión
+
+# Caché de la respuesta completa de VER_PRODUCTOS, ya serializada
+VERSION_CATALOGO = 0 # Aumenta con cada cambio de productos o de stock en este proceso
+CACHE_CATALOGO_VERSION = -1 # VERSION_CATALOGO con la que se generó la caché
+CACHE_CATALOGO = {} # (formato ('simple' | 'versionado'), protocolo) -> respuesta codificada
+CUERPO_CATALOGO = b'' # JSON del catálogo completo
+DATOS_CATALOGO = {} # Catálogo con ids, para codificarlo en el protocolo binario
+ETIQUETA_CATALOGO = '' # Versión que ven los clientes: huella del contenido (igual en todos los procesos)
+
+# Recepción de comandos
+MAX_LINE_LENGTH = 64 * 1024 # Longitud máxima de un comando de texto (bytes)
+
+# Operaciones de carrito en lote (BATCH)
+MAX_BATCH_OPERATIONS = 1000
+OPERACIONES_BATCH = { # operación -> acumular
+    "AGREGAR": True, "AGREGAR_CARRITO": True,
+    "EDITAR": False, "EDITAR_CARRITO": False,
+}
+
+# Paginación y streaming de listados: comandos propios (VER_PRODUCTOS_PAGINA, BUSCAR_STREAM...),
+# así el texto de BUSCAR y LISTAR nunca se interpreta como opción de paginación
+MAX_PAGE_SIZE = 1000 # Límite máximo de productos por página
+STREAM_CHUNK = 100 # Productos por cada línea "PARTE" en modo streaming
+CACHE_IDS_VERSION = -1
+CACHE_IDS = [] # ids del catálogo en orden, para paginar VER_PRODUCTOS por posición
+
+class RespuestaCodificada(bytes):
+    # Respuesta completa ya serializada en el protocolo de la sesión ("STATUS <json>\n"
+    # o una trama binaria); se envía sin volver a codificar
+    pass
+
+class RespuestaDiferida:
+    # Respuesta que se completa en otro hilo (p. ej. cuando la compra ya es durable).
+    # El transporte registra con al_completar() una función sin argumentos, que se llama
+    # desde ese hilo; la pasa a su bucle y ahí obtiene (status, data) con resultado_diferido().
+    # Mientras tanto no atiende más comandos de la conexión, así no se altera el orden de las respuestas.
+    def __init__(self, accion, compra=None):
+        self.accion = accion
+        self.inicio = time.perf_counter()
+        self.futuro = concurrent.futures.Future()
+        self.compra = compra # (sesion, {id: cantidad}) de un FINALIZAR_COMPRA, para revertirla
+        self.durable = None # El hilo de persistencia indica si la compra llegó al disco
+
+    def al_completar(self, funcion):
+        self.futuro.add_done_callback(lambda futuro: funcion())
+
+class RespuestaStream:
+    # Respuesta en varias líneas generadas bajo demanda: el transporte pide la
+    # siguiente solo cuando el cliente consumió las anteriores
+    def __init__(self, lineas):
+        self.lineas = lineas
+
+    def __iter__(self):
+        return iter(self.lineas)
+
+def configurar_almacen(tipo: str):
+    # 'json': instantánea + diario, todo en memoria (por defecto)
+    # 'sqlite': base SQLite en modo WAL; si está vacía se importa INVENTORY_FILE
+    global ALMACEN
+    if tipo == 'sqlite':
+        ALMACEN = almacen.AlmacenSQLite(almacen.SQLITE_FILE, INVENTORY_FILE)
+    else:
+        ALMACEN = almacen.AlmacenJSON(INVENTORY_FILE)
+
+def cargar_inventario():
+    # Carga el inventario desde el almacén configurado
+    global INVENTARIO, BASE_ARCHIVO
+
+    if ALMACEN.EN_MEMORIA and not os.path.exists(INVENTORY_FILE):
+        log.error(f"El archivo '{INVENTORY_FILE}' no existe.")
+        return
+    try:
+        INVENTARIO = ALMACEN.cargar()
+        if ALMACEN.EN_MEMORIA:
+            BASE_ARCHIVO = ALMACEN.stock_archivo
+            FIRMA_ARCHIVO[:] = ALMACEN.firma
+    except json.JSONDecodeError:
+        log.error(f"No se pudo decodificar el archivo JSON.")
+        INVENTARIO = {}
+    except Exception as e:
+        log.error(f"No se pudo cargar el inventario: {e}")
+        INVENTARIO = {}
+    construir_indices()
+    invalidar_catalogo()
+
+def construir_indices():
+    # Construye los índices de búsqueda sobre el inventario cargado
+    # (con SQLite son consultas sobre los índices de la base)
+    global INDICE_TEXTO, INDICE_TIPO, INDICE_MARCA, INDICE_PRECIO, INDICE_STOCK
+    INDICE_TEXTO, INDICE_TIPO, INDICE_MARCA, INDICE_PRECIO, INDICE_STOCK = ALMACEN.indices(INVENTARIO)
+
+def todos_los_indices():
+    return (INDICE_TEXTO, INDICE_TIPO, INDICE_MARCA, INDICE_PRECIO, INDICE_STOCK)
+
+def actualizar_producto(id, producto):
+    # Agrega o reemplaza un producto manteniendo los índices al día
+    INVENTARIO[id] = producto
+    for indice in todos_los_indices():
+        indice.agregar(id, producto)
+    invalidar_catalogo()
+
+def eliminar_producto(id):
+    # Quita un producto del inventario y de los índices
+    INVENTARIO.pop(id, None)
+    for indice in todos_los_indices():
+        indice.eliminar(id)
+    invalidar_catalogo()
+
+def guardar_inventario(stock=None):
+    # Guarda el stock (el capturado, si se indica): instantánea completa en JSON,
+    # solo las filas que cambiaron en SQLite
+    inicio = time.perf_counter()
+    try:
+        if stock is None:
+            stock = capturar_stock()
+        if ALMACEN.EN_MEMORIA and not instantanea_permitida():
+            log.warning(f"'{INVENTORY_FILE}' tiene cambios que aún no se aplican; se pospone la instantánea.")
+            return False
+        firma = ALMACEN.guardar(INVENTARIO, stock)
+        if ALMACEN.EN_MEMORIA:
+            registrar_base(firma, stock)
+        duracion = time.perf_counter() - inicio
+        metricas.registrar_guardado(duracion * 1e6)
+        log.info(f"Inventario guardado en '{ALMACEN.ruta}' ({duracion * 1000:.1f} ms).")
+        return True
+    except Exception as e:
+        log.error(f"No se pudo guardar el inventario: {e}")
+        return False
+
+def buscar_inventario(param: str, limite=None, ranking=False):
+    # Busca productos por nombre o marca usando el índice de trigramas
+    return {id: INVENTARIO[id] for id in INDICE_TEXTO.buscar(param, limite=limite, ranking=ranking)}
+
+def listar_tipo(tipo: str):
+    # Lista productos filtrando por el campo 'tipo'
+    return {id: INVENTARIO[id] for id in INDICE_TIPO.buscar(tipo)}
+
+def listar_marca(marca: str):
+    # Lista productos de una marca exacta (sin distinguir mayúsculas)
+    return {id: INVENTARIO[id] for id in INDICE_MARCA.buscar(marca)}
+
+def listar_rango(campo: str, minimo, maximo):
+    # Lista productos con 'precio' o 'stock' dentro de [minimo, maximo], ordenados por ese campo
+    indice = INDICE_PRECIO if campo == 'precio' else INDICE_STOCK
+    return {id: INVENTARIO[id] for id in indice.rango(minimo, maximo)}
+
+def stock_producto(id: str) -> int:
+    # Obtiene el stock disponible de un producto
+    if not ALMACEN.EN_MEMORIA:
+        return ALMACEN.stock(id)
+    if STOCK_COMPARTIDO is not None:
+        slot = SLOTS.get(id)
+        return STOCK_COMPARTIDO[slot] if slot is not None else 0
+    return INVENTARIO.get(id, {}).get('stock', 0)
+
+def activar_stock_compartido():
+    # Mueve el stock a memoria compartida; debe llamarse antes de crear los procesos trabajadores
+    global STOCK_COMPARTIDO, VERSION_STOCK, STOCK_LOCK, SLOTS, VERSION_LOCAL, RESERVADO_COMPARTIDO
+    global BASE_COMPARTIDA, FIRMA_ARCHIVO, GENERACION_CATALOGO, SLOTS_INICIALES, IDS_NUEVOS, NUM_NUEVOS
+    global CONTADOR_TICKETS, LOCK_TICKETS
+    CONTADOR_TICKETS = multiprocessing.RawArray('Q', CONTADOR_TICKETS)
+    LOCK_TICKETS = multiprocessing.Lock()
+    if not ALMACEN.EN_MEMORIA:
+        # La base ya es compartida: stock y reservas se leen de ella en cada trabajador
+        STOCK_LOCK = multiprocessing.Lock()
+        return
+    SLOTS = {id: slot for slot, id in enumerate(INVENTARIO)}
+    SLOTS_INICIALES = len(SLOTS)
+    libres = [0] * RELOAD_SLOTS_EXTRA # Para productos agregados con la recarga en caliente
+    STOCK_COMPARTIDO = multiprocessing.RawArray('q', [INVENTARIO[id].get('stock', 0) for id in SLOTS] + libres)
+    RESERVADO_COMPARTIDO = multiprocessing.RawArray('q', len(STOCK_COMPARTIDO))
+    BASE_COMPARTIDA = multiprocessing.RawArray('q', [BASE_ARCHIVO.get(id, 0) for id in SLOTS] + libres)
+    IDS_NUEVOS = multiprocessing.RawArray(ctypes.c_char * MAX_ID_BYTES, RELOAD_SLOTS_EXTRA)
+    NUM_NUEVOS = multiprocessing.RawValue('q', 0)
+    FIRMA_ARCHIVO = multiprocessing.RawArray('q', FIRMA_ARCHIVO)
+    GENERACION_CATALOGO = multiprocessing.RawArray('Q', GENERACION_CATALOGO)
+    VERSION_STOCK = multiprocessing.RawValue('Q', 0)
+    STOCK_LOCK = multiprocessing.Lock()
+    VERSION_LOCAL = 0
+    diario.preparar_compartido()
+
+def capturar_stock() -> dict:
+    # Copia del stock actual de todos los productos (id -> stock)
+    return {id: stock_producto(id) for id in INVENTARIO}
+
+def reservado_producto(id: str) -> int:
+    # Unidades de un producto retenidas en carritos de cualquier proceso
+    if not ALMACEN.EN_MEMORIA:
+        return ALMACEN.reservado(id)
+    if RESERVADO_COMPARTIDO is not None:
+        slot = SLOTS.get(id)
+        return RESERVADO_COMPARTIDO[slot] if slot is not None else 0
+    return RESERVADO.get(id, 0)
+
+def disponible_producto(id: str) -> int:
+    # Stock que todavía se puede reservar o comprar
+    return stock_producto(id) - reservado_producto(id)
+
+def sumar_reservado(id: str, delta: int):
+    # Se llama con STOCK_LOCK tomado (y dentro de ALMACEN.transaccion())
+    if not ALMACEN.EN_MEMORIA:
+        ALMACEN.sumar_reservado(id, delta)
+    elif RESERVADO_COMPARTIDO is not None:
+        RESERVADO_COMPARTIDO[SLOTS[id]] += delta
+    else:
+        RESERVADO[id] = RESERVADO.get(id, 0) + delta
+
+def ajustar_reservas(sesion, cambios: dict):
+    # Lleva las reservas de la sesión a las cantidades indicadas (id -> unidades) como
+    # una sola operación: si algún aumento no cabe en lo disponible no se cambia nada.
+    # Devuelve el id sin stock suficiente o None.
+    reservas = sesion['reservas']
+    nuevas = dict(reservas) # Se aplican a la sesión solo si la transacción se confirma
+    with STOCK_LOCK, ALMACEN.transaccion():
+        for id, cant in cambios.items():
+            if cant - reservas.get(id, 0) > disponible_producto(id):
+                return id
+        for id, cant in cambios.items():
+            delta = cant - reservas.get(id, 0)
+            if delta:
+                sumar_reservado(id, delta)
+            if cant:
+                nuevas[id] = cant
+            else:
+                nuevas.pop(id, None)
+    reservas.clear()
+    reservas.update(nuevas)
+    programar_vencimiento(sesion)
+    return None
+
+def programar_vencimiento(sesion):
+    # Cada cambio del carrito extiende la vigencia de todas las reservas de la sesión
+    if sesion['reservas']:
+        RUEDA_RESERVAS.programar(sesion['id'], time.monotonic() + RESERVATION_TTL, sesion)
+    else:
+        RUEDA_RESERVAS.cancelar(sesion['id'])
+
+def liberar_reservas(sesion):
+    # Devuelve al stock disponible lo reservado por la sesión (el carrito se conserva)
+    reservas = sesion['reservas']
+    if reservas:
+        with STOCK_LOCK, ALMACEN.transaccion():
+            for id, cant in reservas.items():
+                sumar_reservado(id, -cant)
+        reservas.clear()
+    RUEDA_RESERVAS.cancelar(sesion['id'])
+
+def atender_temporizadores():
+    # Libera las reservas vencidas, descarta las sesiones sin conexión que expiraron y
+    # aplica una recarga del inventario lista; los transportes la llaman periódicamente desde su bucle
+    ahora = time.monotonic()
+    for _, sesion in RUEDA_RESERVAS.avanzar(ahora):
+        liberar_reservas(sesion)
+    for _, sesion in RUEDA_SESIONES.avanzar(ahora):
+        descartar_sesion(sesion)
+    aplicar_recarga()
+
+def asegurar_vigilante():
+    # Inicia el hilo vigilante en este proceso (también en cada trabajador tras el fork)
+    global VIGILANTE, VIGILANTE_PID
+    if RELOAD_INTERVAL <= 0 or not ALMACEN.EN_MEMORIA:
+        return None
+    if VIGILANTE_PID != os.getpid():
+        VIGILANTE_PID = os.getpid()
+        VIGILANTE = recarga.Vigilante(INVENTORY_FILE, preparar_recarga, recarga_incorporada,
+                                      RELOAD_INTERVAL, vista=tuple(FIRMA_ARCHIVO)).iniciar()
+    return VIGILANTE
+
+def preparar_recarga():
+    # Corre en el hilo vigilante: parsear el archivo y construir los índices no detiene el bucle
+    inventario, firma = ALMACEN.leer()
+    return firma, (inventario, ALMACEN.indices(inventario))
+
+def recarga_incorporada(firma) -> bool:
+    # La versión ya está en el stock y este proceso tiene el último catálogo
+    # (p. ej. una instantánea que escribió el propio servidor)
+    return firma == tuple(FIRMA_ARCHIVO) and GENERACION_CATALOGO[0] == GENERACION_LOCAL
+
+def instantanea_permitida() -> bool:
+    # Una instantánea no debe pisar cambios externos del archivo que todavía no se combinaron,
+    # ni escribirse desde un proceso con un catálogo anterior a la última recarga
+    return (GENERACION_CATALOGO[0] == GENERACION_LOCAL
+            and recarga.firma_archivo(INVENTORY_FILE) in (None, tuple(FIRMA_ARCHIVO)))
+
+def registrar_base(firma, stock: dict):
+    # Tras escribir una instantánea, lo que dice el archivo es el stock capturado
+    global BASE_ARCHIVO
+    if BASE_COMPARTIDA is not None:
+        for id, cant in stock.items():
+            slot = SLOTS.get(id)
+            if slot is not None:
+                BASE_COMPARTIDA[slot] = cant
+    else:
+        BASE_ARCHIVO = dict(stock)
+    FIRMA_ARCHIVO[:] = firma
+
+def slot_producto(id, asignar: bool):
+    # Slot de un producto en STOCK_COMPARTIDO; se llama con STOCK_LOCK tomado.
+    # Los agregados en caliente se publican en IDS_NUEVOS para que el resto de los
+    # trabajadores use el mismo slot. Devuelve None si no hay slot (o no se pidió asignarlo).
+    global NUEVOS_CONOCIDOS
+    for num in range(NUEVOS_CONOCIDOS, NUM_NUEVOS.value):
+        SLOTS[IDS_NUEVOS[num].value.decode('utf-8')] = SLOTS_INICIALES + num
+    NUEVOS_CONOCIDOS = NUM_NUEVOS.value
+
+    slot = SLOTS.get(id)
+    if slot is not None or not asignar:
+        return slot
+    clave = id.encode('utf-8')
+    if NUM_NUEVOS.value >= len(IDS_NUEVOS) or len(clave) > MAX_ID_BYTES:
+        log.warning(f"Sin slot de stock compartido para el producto {id}; se mostrará sin stock.")
+        return None
+    num = NUM_NUEVOS.value
+    IDS_NUEVOS[num].value = clave
+    NUM_NUEVOS.value = NUEVOS_CONOCIDOS = num + 1
+    slot = SLOTS[id] = SLOTS_INICIALES + num
+    return slot
+
+def combinar_stock(nuevo: dict, combinar: bool) -> list:
+    # Ajusta el stock del inventario leído: stock actual + (archivo - base), sin bajar de cero.
+    # Con combinar=False (otro trabajador ya combinó esta versión) solo se toma el stock compartido.
+    # Se llama con STOCK_LOCK tomado. Devuelve [(id, stock)] de los productos que difieren del archivo.
+    global BASE_ARCHIVO
+    cambios = []
+    if STOCK_COMPARTIDO is None:
+        base = {}
+        for id, producto in nuevo.items():
+            archivo = base[id] = producto.get('stock', 0)
+            if id in INVENTARIO and id in BASE_ARCHIVO:
+                stock = max(stock_producto(id) + archivo - BASE_ARCHIVO[id], 0)
+                if stock != archivo:
+                    producto['stock'] = stock
+                    cambios.append((id, stock))
+        BASE_ARCHIVO = base
+        return cambios
+
+    for id, producto in nuevo.items():
+        archivo = producto.get('stock', 0)
+        slot = slot_producto(id, asignar=combinar)
+        if slot is None:
+            stock = 0
+        else:
+            if combinar:
+                # Un slot recién asignado tiene stock y base en cero
+                STOCK_COMPARTIDO[slot] = max(STOCK_COMPARTIDO[slot] + archivo - BASE_COMPARTIDA[slot], 0)
+                BASE_COMPARTIDA[slot] = archivo
+            stock = STOCK_COMPARTIDO[slot]
+        if stock != archivo:
+            producto['stock'] = stock
+            cambios.append((id, stock))
+    return cambios
+
+def aplicar_recarga():
+    # Reemplaza entre eventos el inventario y los índices por los que preparó el hilo vigilante
+    global INVENTARIO, INDICE_TEXTO, INDICE_TIPO, INDICE_MARCA, INDICE_PRECIO, INDICE_STOCK
+    global GENERACION_LOCAL, VERSION_LOCAL
+    vigilante = asegurar_vigilante()
+    if vigilante is None or vigilante.listo is None:
+        return
+    # Mientras se escribe una instantánea la base puede cambiar: se reintenta en la siguiente vuelta
+    if not diario.LOCK_INSTANTANEA.acquire(False):
+        return
+    generacion = None
+    try:
+        firma, (nuevo, nuevos_indices) = vigilante.tomar()
+        if recarga.firma_archivo(INVENTORY_FILE) != firma:
+            return # Cambió otra vez; el vigilante leerá la versión nueva
+        with STOCK_LOCK:
+            combinar = firma != tuple(FIRMA_ARCHIVO)
+            if not combinar and GENERACION_CATALOGO[0] == GENERACION_LOCAL:
+                return
+            cambios = combinar_stock(nuevo, combinar)
+            for id, stock in cambios:
+                nuevos_indices[4].actualizar(id, stock)
+
+            INVENTARIO = nuevo
+            INDICE_TEXTO, INDICE_TIPO, INDICE_MARCA, INDICE_PRECIO, INDICE_STOCK = nuevos_indices
+            if combinar:
+                FIRMA_ARCHIVO[:] = firma
+                GENERACION_CATALOGO[0] += 1
+                if STOCK_COMPARTIDO is not None:
+                    VERSION_STOCK.value += 1
+                # Nueva instantánea con el stock combinado (y los productos nuevos)
+                generacion = diario.rotar()
+                captura = capturar_stock()
+            GENERACION_LOCAL = GENERACION_CATALOGO[0]
+            if STOCK_COMPARTIDO is not None:
+                VERSION_LOCAL = VERSION_STOCK.value
+        invalidar_catalogo()
+        log.info(f"Inventario recargado: {len(nuevo)} productos ({len(cambios)} con stock combinado).")
+    finally:
+        diario.LOCK_INSTANTANEA.release()
+    if generacion is not None:
+        diario.compactar(generacion, captura, guardar_inventario)
+
+def sincronizar_stock():
+    # Copia a INVENTARIO el stock compartido si otro proceso lo modificó
+    global VERSION_LOCAL
+    if not ALMACEN.EN_MEMORIA:
+        # Las filas en caché pueden tener un stock viejo
+        version = ALMACEN.version()
+        if version != VERSION_LOCAL:
+            VERSION_LOCAL = version
+            INVENTARIO.olvidar()
+            invalidar_catalogo()
+        return
+    if STOCK_COMPARTIDO is None or VERSION_STOCK.value == VERSION_LOCAL:
+        return
+    VERSION_LOCAL = VERSION_STOCK.value
+    for id, slot in SLOTS.items():
+        stock = STOCK_COMPARTIDO[slot]
+        producto = INVENTARIO.get(id) # Un producto quitado en una recarga conserva su slot
+        if producto is not None and producto['stock'] != stock:
+            producto['stock'] = stock
+            INDICE_STOCK.actualizar(id, stock)
+            invalidar_catalogo()
+
+def pool_persistencia():
+    # Pool de hilos de este proceso; los hilos no sobreviven a un fork, así que cada trabajador crea el suyo
+    global POOL_PERSISTENCIA, POOL_PID
+    if POOL_PID != os.getpid():
+        POOL_PERSISTENCIA = concurrent.futures.ThreadPoolExecutor(PERSIST_WORKERS, thread_name_prefix="persistencia")
+        POOL_PID = os.getpid()
+    return POOL_PERSISTENCIA
+
+def sincronizar_base(al_confirmar):
+    # En un hilo del pool: fsync del WAL de SQLite y aviso de si la compra quedó durable.
+    # Después de un fallo no se confía en otro fsync hasta restablecer la base
+    global FALLO_BASE
+    durable = FALLO_BASE is None
+    if durable:
+        try:
+            ALMACEN.sincronizar()
+        except OSError as e:
+            log.error(f"No se pudo sincronizar la base: {e}")
+            FALLO_BASE = e
+            durable = False
+    al_confirmar(durable)
+
+def persistencia_disponible() -> bool:
+    # False mientras el último fsync falló y no se pudo restablecer: no se aceptan compras.
+    # Se reintenta cada REINTENTO_PERSISTENCIA segundos, cuando ya se resolvieron (y revirtieron)
+    # las compras en curso, así la instantánea o el checkpoint incluye el stock devuelto
+    global FALLO_BASE, PROXIMO_REINTENTO
+    fallo = diario.fallo() if ALMACEN.EN_MEMORIA else FALLO_BASE
+    if fallo is None:
+        return True
+    ahora = time.monotonic()
+    if COMPRAS_EN_CURSO or ahora < PROXIMO_REINTENTO:
+        return False
+    PROXIMO_REINTENTO = ahora + REINTENTO_PERSISTENCIA
+    try:
+        if ALMACEN.EN_MEMORIA:
+            with STOCK_LOCK:
+                generacion = diario.rotar()
+                captura = capturar_stock()
+            if not diario.restablecer(generacion, captura, guardar_inventario):
+                return False
+        else:
+            ALMACEN.restablecer()
+            FALLO_BASE = None
+    except Exception as e:
+        log.error(f"No se pudo restablecer la persistencia: {e}")
+        return False
+    log.info("Persistencia restablecida; se vuelven a aceptar compras.")
+    return True
+
+def revertir_compra(sesion, compra: dict):
+    # En el bucle: la compra no llegó al disco, así que se devuelven las unidades al stock y al
+    # carrito para reintentarla. En memoria la línea de la venta ya está en el diario con el stock
+    # posterior ("s"): se escribe una entrada compensatoria con el stock devuelto, así una caída
+    # antes de restablecer la persistencia no vuelve a aplicar la venta al reproducir el diario.
+    # Con SQLite la devolución es otra transacción sobre la base.
+    with STOCK_LOCK, ALMACEN.transaccion():
+        if not ALMACEN.EN_MEMORIA:
+            ALMACEN.descontar({id: -cant for id, cant in compra.items()})
+        else:
+            stocks = {id: stock_producto(id) + cant for id, cant in compra.items() if id in INVENTARIO}
+            try:
+                diario.registrar({id: cant for id, cant in compra.items() if id in stocks}, stocks)
+            except OSError as e:
+                log.error(f"No se pudo escribir en el diario la devolucion de una compra: {e}")
+            for id, stock in stocks.items():
+                if STOCK_COMPARTIDO is not None:
+                    if id in SLOTS:
+                        STOCK_COMPARTIDO[SLOTS[id]] = stock
+                else:
+                    INVENTARIO[id]['stock'] = stock
+                    INDICE_STOCK.actualizar(id, stock)
+            if STOCK_COMPARTIDO is not None:
+                VERSION_STOCK.value += 1
+            else:
+                invalidar_catalogo()
+    carrito = sesion['carrito']
+    for id, cant in compra.items():
+        carrito[id] = carrito.get(id, 0) + cant
+    sincronizar_stock()
+
+def descontar_stock(lineas: dict, reservas: dict, al_confirmar=None):
+    # Valida y descuenta el stock de todas las líneas como una sola operación (todo o nada),
+    # consumiendo las reservas de la sesión, y la registra en el diario (o en la base SQLite)
+    # sin esperar al disco. al_confirmar(durable) se invoca desde otro hilo cuando ya es
+    # durable (True) o si no se pudo sincronizar (False).
+    # Devuelve el id sin stock suficiente o None si se confirmó.
+    generacion = None
+
+    # Con varios procesos el lock garantiza que dos trabajadores no vendan las mismas unidades
+    with STOCK_LOCK, ALMACEN.transaccion():
+        # Lo ya reservado está garantizado; solo lo que exceda la reserva compite por lo disponible
+        for id, cant in lineas.items():
+            if cant - reservas.get(id, 0) > disponible_producto(id):
+                return id
+
+        if not ALMACEN.EN_MEMORIA:
+            # Las reservas se convierten en venta: solo las filas vendidas, en la misma
+            # transacción (un error la revierte completa); no hace falta el diario
+            for id, cant in reservas.items():
+                sumar_reservado(id, -cant)
+            ALMACEN.descontar(lineas)
+        else:
+            # En memoria no hay transacción: primero la escritura al diario (una sola y pequeña,
+            # en lugar de reescribir el JSON), que es lo único que puede fallar, y después los cambios
+            stocks = {id: stock_producto(id) - cant for id, cant in lineas.items()}
+            deltas = {id: -cant for id, cant in lineas.items()}
+            rotar = diario.registrar(deltas, stocks, al_confirmar)
+
+            # Las reservas se convierten en venta
+            for id, cant in reservas.items():
+                sumar_reservado(id, -cant)
+            for id, stock in stocks.items():
+                if STOCK_COMPARTIDO is not None:
+                    STOCK_COMPARTIDO[SLOTS[id]] = stock
+                else:
+                    INVENTARIO[id]['stock'] = stock
+                    INDICE_STOCK.actualizar(id, stock)
+            if STOCK_COMPARTIDO is not None:
+                VERSION_STOCK.value += 1
+            else:
+                invalidar_catalogo()
+
+            if rotar:
+                generacion = diario.rotar()
+                captura = capturar_stock()
+
+    # Confirmada la venta, la sesión ya no retiene nada
+    reservas.clear()
+
+    if not ALMACEN.EN_MEMORIA and al_confirmar is not None:
+        # El COMMIT quedó en el WAL sin fsync (synchronous NORMAL)
+        pool_persistencia().submit(sincronizar_base, al_confirmar)
+    if generacion is not None:
+        # La instantánea completa se escribe en segundo plano
+        diario.compactar(generacion, captura, guardar_inventario)
+    sincronizar_stock()
+    return None
+
+def parseo(msj: str) -> tuple:
+    # Parsear el mensaje del cliente para saber que accion realizar
+    # Devuelve (accion, params) con params la lista de palabras que reciben los manejadores
+    partes = msj.strip().split()
+    accion = partes[0].upper() if partes else ""
+    return accion, partes[1:]
+
+def codificar_respuesta(status, data) -> bytes:
+    # Serializa una respuesta en el formato del protocolo: "STATUS <json>\n"
+    if isinstance(data, RespuestaCodificada):
+        return data
+    cuerpo_respuesta = json.dumps(data)
+    return f"{status} {cuerpo_respuesta}\n".encode('utf-8')
+
+def codificar_para(sesion, status, data) -> bytes:
+    # Serializa una respuesta en el protocolo negociado por la sesión
+    if isinstance(data, RespuestaCodificada):
+        return data
+    if sesion['protocolo'] == 'binario':
+        return protocolo_binario.codificar_respuesta(status, data)
+    return codificar_respuesta(status, data)
+
+class MensajeInvalido(Exception):
+    # Comando que no se puede delimitar (línea demasiado larga o trama inválida):
+    # no hay forma de saber dónde empieza el siguiente, así que se cierra la conexión
+    pass
+
+class BufferEntrada:
+    # Buffer de recepción de una conexión. Los datos se escriben directamente con
+    # recv_into en el espacio libre y se consumen avanzando 'inicio', sin copiar el
+    # resto del buffer en cada comando. Crece por duplicación hasta CAPACIDAD_MAXIMA,
+    # así que la memoria por conexión queda acotada aunque el cliente encadene miles
+    # de comandos.
+
+    CAPACIDAD_MAXIMA = max(MAX_LINE_LENGTH + 1,
+                           protocolo_binario.MAX_FRAME_SIZE + protocolo_binario.CABECERA.size)
+
+    def __init__(self, capacidad_inicial=4096):
+        self.capacidad_inicial = capacidad_inicial
+        self.datos = bytearray(capacidad_inicial)
+        self.vista = memoryview(self.datos)
+        self.inicio = 0 # Primer byte sin consumir
+        self.fin = 0 # Fin de los datos recibidos
+        self.escaneado = 0 # Hasta dónde ya se buscó un salto de línea
+
+    def pendientes(self) -> int:
+        return self.fin - self.inicio
+
+    def espacio_libre(self, minimo=None) -> memoryview:
+        # Devuelve la zona libre para recv_into, compactando o creciendo si queda poca.
+        # Una vista vacía indica que el buffer está lleno (CAPACIDAD_MAXIMA).
+        minimo = minimo or self.capacidad_inicial
+        if self.inicio == self.fin:
+            self.inicio = self.fin = self.escaneado = 0
+            if len(self.datos) > self.capacidad_inicial:
+                # Después de una ráfaga se vuelve al tamaño inicial
+                self.redimensionar(self.capacidad_inicial)
+        if len(self.datos) - self.fin < minimo:
+            if self.inicio > 0:
+                # Compactar: se mueven solo los bytes pendientes, una vez por llenado
+                n = self.fin - self.inicio
+                self.datos[:n] = self.vista[self.inicio:self.fin]
+                self.escaneado -= self.inicio
+                self.inicio, self.fin = 0, n
+            if len(self.datos) - self.fin < minimo and len(self.datos) < self.CAPACIDAD_MAXIMA:
+                self.redimensionar(min(len(self.datos) * 2, self.CAPACIDAD_MAXIMA))
+        return self.vista[self.fin:]
+
+    def redimensionar(self, capacidad):
+        nuevos = bytearray(capacidad)
+        nuevos[:self.fin - self.inicio] = self.vista[self.inicio:self.fin]
+        self.vista.release()
+        self.datos, self.vista = nuevos, memoryview(nuevos)
+        self.escaneado -= self.inicio
+        self.fin -= self.inicio
+        self.inicio = 0
+
+    def avanzar(self, n):
+        # Marca como recibidos los n bytes que recv_into escribió en espacio_libre()
+        self.fin += n
+
+    def siguiente_linea(self):
+        # Devuelve la siguiente línea completa (str, sin el salto) o None.
+        # Solo se busca en los bytes que no se revisaron antes: el costo total es lineal.
+        fin_linea = self.datos.find(b'\n', self.escaneado, self.fin)
+        if fin_linea == -1:
+            self.escaneado = self.fin
+            if self.fin - self.inicio > MAX_LINE_LENGTH:
+                raise MensajeInvalido(f"Línea de más de {MAX_LINE_LENGTH} bytes.")
+            return None
+        # Bytes inválidos se reemplazan: el comando resultante se rechaza como cualquier otro
+        linea = str(self.vista[self.inicio:fin_linea], 'utf-8', 'replace')
+        self.inicio = self.escaneado = fin_linea + 1
+        return linea
+
+    def siguiente_trama(self):
+        # Devuelve (accion, params) de la siguiente trama binaria completa o None
+        try:
+            limites = protocolo_binario.limites_trama(self.datos, self.inicio, self.fin)
+            if limites is None:
+                return None
+            inicio_payload, fin_trama = limites
+            with self.vista[inicio_payload:fin_trama] as payload:
+                mensaje = protocolo_binario.decodificar_peticion(payload)
+        except protocolo_binario.TramaInvalida as e:
+            raise MensajeInvalido(str(e))
+        self.inicio = self.escaneado = fin_trama
+        return mensaje
+
+def siguiente_mensaje(sesion, entrada: BufferEntrada):
+    # Extrae el siguiente comando completo del buffer según el protocolo de la sesión.
+    # Devuelve (accion, params), con accion None para una línea vacía, o None si
+    # el comando todavía no llegó completo. Lanza MensajeInvalido si no se puede delimitar.
+    if sesion['protocolo'] == 'binario':
+        return entrada.siguiente_trama()
+
+    message = entrada.siguiente_linea()
+    if message is None:
+        return None
+    message = message.strip()
+    if not message:
+        return None, []
+    return parseo(message)
+
+# Sesión de compra de un cliente (independiente del socket que la transporta)
+
+def nueva_sesion():
+    # Sesión de una conexión nueva, registrada con un token que el cliente recibe en el saludo.
+    # 'reservas' son las unidades del carrito retenidas en el stock (id -> cantidad)
+    sesion = {'id': next(CONTADOR_SESIONES), 'token': secrets.token_urlsafe(16),
+              'carrito': {}, 'reservas': {}, 'protocolo': 'texto', 'conectada': True}
+    SESIONES[sesion['token']] = sesion
+    limitar_sesiones()
+    return sesion
+
+def saludo(sesion) -> tuple:
+    # Primera respuesta de cada conexión: el token con el que puede reanudar la sesión
+    return "SESION", {"token": sesion['token']}
+
+def limitar_sesiones():
+    # Descarta las sesiones sin conexión menos usadas mientras se supere MAX_SESSIONS
+    revisadas = 0
+    while len(SESIONES) > MAX_SESSIONS and revisadas < len(SESIONES):
+        token, sesion = next(iter(SESIONES.items()))
+        if sesion['conectada']:
+            # Una sesión en uso no se descarta: pasa al final como usada recientemente
+            SESIONES.move_to_end(token)
+            revisadas += 1
+            continue
+        descartar_sesion(sesion)
+
+def descartar_sesion(sesion):
+    # Olvida la sesión y libera sus reservas
+    liberar_reservas(sesion)
+    if SESIONES.get(sesion['token']) is sesion:
+        del SESIONES[sesion['token']]
+    RUEDA_SESIONES.cancelar(sesion['token'])
+
+def tocar_sesion(sesion):
+    # Marca la sesión como usada recientemente (orden LRU)
+    if SESIONES.get(sesion['token']) is sesion:
+        SESIONES.move_to_end(sesion['token'])
+
+def cerrar_sesion(sesion):
+    # El cliente se desconectó: la sesión (y su carrito) se conserva SESSION_IDLE_TTL segundos para
+    # un RESUME, pero sus reservas solo RESERVATION_GRACE: una conexión abandonada no retiene stock
+    if SESIONES.get(sesion['token']) is not sesion:
+        # Sesión que otra conexión ya reanudó
+        liberar_reservas(sesion)
+        return
+    sesion['conectada'] = False
+    RUEDA_SESIONES.programar(sesion['token'], time.monotonic() + SESSION_IDLE_TTL, sesion)
+    if sesion['reservas']:
+        vence = time.monotonic() + RESERVATION_GRACE
+        actual = RUEDA_RESERVAS.vencimiento(sesion['id'])
+        RUEDA_RESERVAS.programar(sesion['id'], vence if actual is None else min(vence, actual), sesion)
+
+def adoptar_sesion(sesion, guardada):
+    # Pasa el estado de 'guardada' al dict de la conexión actual, que es el que usa el transporte.
+    # Lo que ya estaba en el carrito de la conexión actual se suma al recuperado: ambas reservas
+    # ya están descontadas del disponible, así que se combinan sin tocar el stock
+    carrito, reservas = guardada['carrito'], guardada['reservas']
+    for id, cant in sesion['carrito'].items():
+        carrito[id] = carrito.get(id, 0) + cant
+    for id, cant in sesion['reservas'].items():
+        reservas[id] = reservas.get(id, 0) + cant
+    # La sesión creada al conectar ya no hace falta (sus reservas pasaron a la recuperada)
+    if SESIONES.get(sesion['token']) is sesion:
+        del SESIONES[sesion['token']]
+    RUEDA_SESIONES.cancelar(sesion['token'])
+    RUEDA_RESERVAS.cancelar(sesion['id'])
+    for clave in ('id', 'token', 'carrito', 'reservas'):
+        sesion[clave] = guardada[clave]
+    sesion['conectada'] = True
+    if guardada['conectada']:
+        # Otra conexión (p. ej. un socket móvil que aún no se detecta caído) la estaba usando:
+        # se queda con una sesión vacía sin token
+        guardada.update(id=next(CONTADOR_SESIONES), token=None, carrito={}, reservas={})
+    SESIONES[sesion['token']] = sesion
+    SESIONES.move_to_end(sesion['token'])
+    RUEDA_SESIONES.cancelar(sesion['token'])
+    # La reconexión cuenta como actividad: las reservas se extienden
+    programar_vencimiento(sesion)
+
+# Manejadores de comandos: reciben la sesión y los parámetros y devuelven (status, data)
+
+def invalidar_catalogo():
+    # Marca la caché de VER_PRODUCTOS como desactualizada; se regenera en la siguiente consulta
+    global VERSION_CATALOGO
+    VERSION_CATALOGO += 1
+
+def actualizar_cache_catalogo():
+    # Serializa el catálogo completo una sola vez por versión
+    global CACHE_CATALOGO_VERSION, CACHE_CATALOGO, CUERPO_CATALOGO, DATOS_CATALOGO, ETIQUETA_CATALOGO
+    if CACHE_CATALOGO_VERSION == VERSION_CATALOGO:
+        return
+    data_with_id = {}
+    for id, product in INVENTARIO.items():
+        data_with_id[id] = product if product.get('id') == id else dict(product, id=id)
+    DATOS_CATALOGO = data_with_id
+    CUERPO_CATALOGO = json.dumps(data_with_id).encode('utf-8')
+    ETIQUETA_CATALOGO = hashlib.blake2b(CUERPO_CATALOGO, digest_size=8).hexdigest()
+    CACHE_CATALOGO = {}
+    CACHE_CATALOGO_VERSION = VERSION_CATALOGO
+
+def respuesta_catalogo(formato, protocolo='texto'):
+    # Respuesta codificada de VER_PRODUCTOS compartida por todos los clientes
+    actualizar_cache_catalogo()
+    respuesta = CACHE_CATALOGO.get((formato, protocolo))
+    if respuesta is None:
+        if protocolo == 'binario':
+            data = DATOS_CATALOGO
+            if formato == 'versionado':
+                data = {"version": ETIQUETA_CATALOGO, "productos": DATOS_CATALOGO}
+            respuesta = RespuestaCodificada(protocolo_binario.codificar_respuesta("OK", data))
+        elif formato == 'versionado':
+            cabecera = f'OK {{"version": "{ETIQUETA_CATALOGO}", "productos": '.encode('utf-8')
+            respuesta = RespuestaCodificada(cabecera + CUERPO_CATALOGO + b'}\n')
+        else:
+            respuesta = RespuestaCodificada(b'OK ' + CUERPO_CATALOGO + b'\n')
+        CACHE_CATALOGO[(formato, protocolo)] = respuesta
+    return respuesta
+
+def producto_con_id(id):
+    producto = INVENTARIO[id]
+    return producto if producto.get('id') == id else dict(producto, id=id)
+
+def ids_catalogo() -> list:
+    # ids del catálogo en orden; se recalcula solo cuando cambia el catálogo
+    global CACHE_IDS_VERSION, CACHE_IDS
+    if CACHE_IDS_VERSION != VERSION_CATALOGO:
+        CACHE_IDS = list(INVENTARIO)
+        CACHE_IDS_VERSION = VERSION_CATALOGO
+    return CACHE_IDS
+
+def extraer_pagina(params: list):
+    # Separa del inicio de los parámetros "<cursor> <limite>" (comandos *_PAGINA).
+    # Devuelve (cursor, limite, params_restantes). Lanza ValueError si no son válidos.
+    if len(params) < 2:
+        raise ValueError
+    cursor, limite = int(params[0]), int(params[1])
+    if cursor < 0 or limite <= 0:
+        raise ValueError
+    return cursor, min(limite, MAX_PAGE_SIZE), params[2:]
+
+def respuesta_paginada(sesion, ids: list, modo, cursor, limite):
+    # Página: {"productos": {...}, "siguiente": cursor o null, "total": n}
+    # Stream: líneas "PARTE {...}" de STREAM_CHUNK productos y un "FIN {"total": n}" final
+    if modo == 'stream':
+        def lineas():
+            for inicio in range(0, len(ids), STREAM_CHUNK):
+                parte = {id: producto_con_id(id) for id in ids[inicio:inicio + STREAM_CHUNK] if id in INVENTARIO}
+                yield codificar_para(sesion, "PARTE", parte)
+            yield codificar_para(sesion, "FIN", {"total": len(ids)})
+        return "OK", RespuestaStream(lineas())
+
+    fin = cursor + limite
+    pagina = {id: producto_con_id(id) for id in ids[cursor:fin] if id in INVENTARIO}
+    return "OK", {
+        "productos": pagina,
+        "siguiente": fin if fin < len(ids) else None,
+        "total": len(ids),
+    }
+
+def manejar_ver_productos(sesion, params):
+    # VER_PRODUCTOS -> catálogo completo
+    # VER_PRODUCTOS <version> -> NOT_MODIFIED si el cliente ya tiene esa versión,
+    #                            si no {"version": ..., "productos": {...}}
+    if not params:
+        return "OK", respuesta_catalogo('simple', sesion['protocolo'])
+    if len(params) > 1:
+        return "ERROR", "VER_PRODUCTOS solo acepta la version del catalogo (para paginar: VER_PRODUCTOS_PAGINA)."
+
+    actualizar_cache_catalogo()
+    if params[0].lower() == ETIQUETA_CATALOGO:
+        return "NOT_MODIFIED", {"version": ETIQUETA_CATALOGO}
+    return "OK", respuesta_catalogo('versionado', sesion['protocolo'])
+
+def listado_paginado(sesion, params, modo, buscar=None):
+    # Lógica común de los comandos *_PAGINA (modo 'pagina', empiezan con <cursor> <limite>)
+    # y *_STREAM (modo 'stream'). Sin buscar se recorre el catálogo completo; con buscar
+    # el resto de los parámetros es el texto, tal cual (puede contener PAGINA o STREAM)
+    cursor, limite = 0, None
+    if modo == 'pagina':
+        try:
+            cursor, limite, params = extraer_pagina(params)
+        except ValueError:
+            return "ERROR", "El cursor y el limite deben ser enteros positivos."
+    if buscar is None:
+        if params:
+            return "ERROR", "El catalogo completo no admite parametros de busqueda."
+        return respuesta_paginada(sesion, ids_catalogo(), modo, cursor, limite)
+    if not params:
+        return "ERROR", "Debe proporcionar un parametro para buscar o listar."
+    return respuesta_paginada(sesion, buscar(" ".join(params)), modo, cursor, limite)
+
+def manejar_ver_productos_pagina(sesion, params):
+    # VER_PRODUCTOS_PAGINA <cursor> <limite> -> ver respuesta_paginada
+    return listado_paginado(sesion, params, 'pagina')
+
+def manejar_ver_productos_stream(sesion, params):
+    # VER_PRODUCTOS_STREAM -> ver respuesta_paginada
+    return listado_paginado(sesion, params, 'stream')
+
+def manejar_buscar(sesion, params):
+    # BUSCAR <texto>
+    if not params:
+        return "ERROR", "Debe proporcionar un parametro para buscar o listar."
+    return "OK", buscar_inventario(" ".join(params))
+
+def manejar_buscar_pagina(sesion, params):
+    # BUSCAR_PAGINA <cursor> <limite> <texto>
+    return listado_paginado(sesion, params, 'pagina', INDICE_TEXTO.buscar)
+
+def manejar_buscar_stream(sesion, params):
+    # BUSCAR_STREAM <texto>
+    return listado_paginado(sesion, params, 'stream', INDICE_TEXTO.buscar)
+
+def manejar_listar(sesion, params):
+    # LISTAR <tipo>
+    if not params:
+        return "ERROR", "Debe proporcionar un parametro para buscar o listar."
+    return "OK", listar_tipo(" ".join(params))
+
+def manejar_listar_pagina(sesion, params):
+    # LISTAR_PAGINA <cursor> <limite> <tipo>
+    return listado_paginado(sesion, params, 'pagina', INDICE_TIPO.buscar)
+
+def manejar_listar_stream(sesion, params):
+    # LISTAR_STREAM <tipo>
+    return listado_paginado(sesion, params, 'stream', INDICE_TIPO.buscar)
+
+def manejar_listar_rango(sesion, params):
+    # LISTAR_RANGO [PRECIO|STOCK] <min> <max>  (por defecto PRECIO)
+    params = list(params)
+    campo = 'precio'
+    if params and params[0].upper() in ("PRECIO", "STOCK"):
+        campo = params.pop(0).lower()
+    if len(params) < 2:
+        return "ERROR", "Faltan parametros para listar por rango (MIN y MAX)."
+    try:
+        minimo, maximo = float(params[0]), float(params[1])
+    except ValueError:
+        return "ERROR", "Los limites del rango deben ser numericos."
+    if minimo > maximo:
+        return "ERROR", "El minimo no puede ser mayor que el maximo."
+    return "OK", listar_rango(campo, minimo, maximo)
+
+def calcular_cambio(carrito, reservas, producto_id, cantidad_txt, acumular):
+    # Valida un cambio del carrito contra el stock disponible (más lo que la sesión ya reservó) sin aplicarlo.
+    # Devuelve (error, None) o (None, nueva cantidad total del producto)
+    try:
+        # Validamos que la cantidad sea un entero
+        cantidad = int(cantidad_txt)
+    except ValueError:
+        return "La cantidad debe ser un numero entero.", None
+
+    # Validamos que el producto exista
+    if producto_id not in INVENTARIO:
+        return f"No existe el producto con el ID {producto_id}.", None
+
+    # Cálculo de nueva cantidad total
+    cant_actual_carrito = carrito.get(producto_id, 0)
+    nueva_cant_total = cant_actual_carrito + cantidad if acumular else cantidad
+
+    # Validación de Stock y rangos
+    stock_disp = disponible_producto(producto_id) + reservas.get(producto_id, 0)
+
+    if nueva_cant_total < 0:
+        return "La cantidad no puede ser menor a cero.", None
+    if nueva_cant_total > stock_disp:
+        return f"Stock insuficiente. Disponible: {stock_disp}. Solicitado: {nueva_cant_total}.", None
+    return None, nueva_cant_total
+
+def modificar_carrito(sesion, params, acumular):
+    # Lógica común de AGREGAR_CARRITO (acumular=True) y EDITAR_CARRITO (acumular=False)
+    carrito_actual = sesion['carrito']
+
+    # Validación de parámetros
+    if len(params) < 2:
+        return "ERROR", "Faltan parametros para poder realizar la accion (ID y CANTIDAD)."
+
+    producto_id = params[0]
+    error, nueva_cant_total = calcular_cambio(carrito_actual, sesion['reservas'], producto_id, params[1], acumular)
+    if error:
+        return "ERROR", error
+
+    # Se reserva el stock; otro cliente pudo llevarse unidades desde la validación
+    if ajustar_reservas(sesion, {producto_id: nueva_cant_total}) is not None:
+        stock_disp = disponible_producto(producto_id) + sesion['reservas'].get(producto_id, 0)
+        return "ERROR", f"Stock insuficiente. Disponible: {stock_disp}. Solicitado: {nueva_cant_total}."
+
+    nombre_producto = INVENTARIO[producto_id]['nombre']
+
+    # Si todo es OK, actualizar carrito
+    if nueva_cant_total == 0:
+        if producto_id in carrito_actual: del carrito_actual[producto_id]
+        return "OK", {"mensaje": f"Se eliminó '{nombre_producto}' del carrito."}
+
+    carrito_actual[producto_id] = nueva_cant_total
+    return "OK", {"mensaje": f"Carrito actualizado. '{nombre_producto}' total: {nueva_cant_total}."}
+
+def manejar_agregar_carrito(sesion, params):
+    return modificar_carrito(sesion, params, acumular=True)
+
+def manejar_editar_carrito(sesion, params):
+    return modificar_carrito(sesion, params, acumular=False)
+
+def separar_operaciones(params: list) -> list:
+    # Divide las palabras de BATCH en operaciones por ';' (palabra propia en el protocolo
+    # binario; en el de texto también pegada a otra: "2;", "2;EDITAR")
+    operaciones = [[]]
+    for palabra in params:
+        for num, trozo in enumerate(palabra.split(';')):
+            if num:
+                operaciones.append([])
+            if trozo:
+                operaciones[-1].append(trozo)
+    return [operacion for operacion in operaciones if operacion]
+
+def manejar_batch(sesion, params):
+    # BATCH <AGREGAR|EDITAR> <id> <cantidad>; <AGREGAR|EDITAR> <id> <cantidad>; ...
+    # Aplica varios cambios del carrito en una sola petición. Se validan todos en
+    # una pasada (en orden, sobre una copia del carrito) y se aplican todos o ninguno.
+    operaciones = separar_operaciones(params)
+    if not operaciones:
+        return "ERROR", "Debe proporcionar al menos una operacion (AGREGAR|EDITAR ID CANTIDAD)."
+    if len(operaciones) > MAX_BATCH_OPERATIONS:
+        return "ERROR", f"Demasiadas operaciones en un BATCH (maximo {MAX_BATCH_OPERATIONS})."
+
+    carrito = dict(sesion['carrito'])
+    errores = []
+    for num, operacion in enumerate(operaciones, 1):
+        if len(operacion) != 3 or operacion[0].upper() not in OPERACIONES_BATCH:
+            errores.append(f"Operacion {num}: formato invalido (AGREGAR|EDITAR ID CANTIDAD).")
+            continue
+        producto_id = operacion[1]
+        error, nueva_cant_total = calcular_cambio(carrito, sesion['reservas'], producto_id, operacion[2],
+                                                  OPERACIONES_BATCH[operacion[0].upper()])
+        if error:
+            errores.append(f"Operacion {num}: {error}")
+        elif nueva_cant_total == 0:
+            carrito.pop(producto_id, None)
+        else:
+            carrito[producto_id] = nueva_cant_total
+
+    if errores:
+        return "ERROR", "No se aplico ningun cambio. " + " ".join(errores)
+
+    # Reserva de todos los productos tocados en una sola operación
+    tocados = {operacion[1] for operacion in operaciones}
+    id_agotado = ajustar_reservas(sesion, {id: carrito.get(id, 0) for id in tocados})
+    if id_agotado is not None:
+        return "ERROR", f"No se aplico ningun cambio. Stock insuficiente para ID {id_agotado}."
+
+    sesion['carrito'].clear()
+    sesion['carrito'].update(carrito)
+    return "OK", {
+        "mensaje": f"Carrito actualizado ({len(operaciones)} operaciones).",
+        "carrito": carrito,
+    }
+
+def manejar_ver_carrito(sesion, params):
+    carrito = {}
+    for id, cant in sesion['carrito'].items():
+        if id in INVENTARIO:
+            carrito[id] = {
+                "nombre": INVENTARIO[id]['nombre'],
+                "precio": INVENTARIO[id]['precio'],
+                "cantidad": cant
+            }
+    return "OK", carrito
+
+def manejar_finalizar_compra(sesion, params):
+    global COMPRAS_EN_CURSO
+    productos_carrito = sesion['carrito']
+    if not productos_carrito:
+        return "ERROR", "El carrito está vacío."
+    if not persistencia_disponible():
+        return "ERROR", "No se pueden registrar compras por un error de disco. Intente mas tarde."
+
+    # Productos quitados del catálogo por una recarga: se sacan del carrito y se avisa
+    retirados = [id for id in productos_carrito if id not in INVENTARIO]
+    if retirados:
+        ajustar_reservas(sesion, {id: 0 for id in retirados})
+        for id in retirados:
+            del productos_carrito[id]
+        return "ERROR", f"Ya no estan disponibles los productos {', '.join(retirados)}; se quitaron del carrito."
+
+    # Nombre y precio al momento de la compra; el ticket se arma después en otro hilo
+    lineas = [(INVENTARIO[id]['nombre'], INVENTARIO[id]['precio'], cant) for id, cant in productos_carrito.items()]
+    respuesta = RespuestaDiferida("FINALIZAR_COMPRA", (sesion, dict(productos_carrito)))
+    pool = pool_persistencia()
+
+    def al_confirmar(durable):
+        # Solo se numera un ticket si la compra ya es durable; si no, el bucle la revierte
+        respuesta.durable = durable
+        if durable:
+            pool.submit(emitir_ticket, sesion, respuesta, lineas)
+        else:
+            respuesta.futuro.set_result(("ERROR", "No se pudo guardar la compra en disco; no se realizo "
+                                                  "y el carrito se conserva. Intente mas tarde."))
+
+    # Validación y descuento de stock de todo el carrito a la vez, consumiendo las reservas
+    id_agotado = descontar_stock(productos_carrito, sesion['reservas'], al_confirmar)
+    if id_agotado is not None:
+        # Solo ocurre si las reservas vencieron; el carrito se conserva para ajustarlo
+        return "ERROR", f"Stock agotado para ID {id_agotado}. No se pudo completar la compra."
+
+    COMPRAS_EN_CURSO += 1
+    RUEDA_RESERVAS.cancelar(sesion['id'])
+    productos_carrito.clear() # Vaciamos el carrito
+    return "OK", respuesta
+
+def emitir_ticket(sesion, respuesta, lineas):
+    # En un hilo del pool, con la compra ya durable: numera el ticket, lo arma y lo deja
+    # codificado (la sesión no cambia de protocolo mientras espera la respuesta)
+    try:
+        with LOCK_TICKETS:
+            CONTADOR_TICKETS[0] += 1
+            numero = CONTADOR_TICKETS[0]
+        items = [{"nombre": nombre, "cantidad": cant, "subtotal": precio * cant} for nombre, precio, cant in lineas]
+        ticket = {
+            "tipo": "TICKET",
+            "ticket_id": f"{PREFIJO_TICKETS}-{numero:06d}",
+            "items": items,
+            "total": sum(item['subtotal'] for item in items),
+            "mensaje": "¡Gracias por su compra!"
+        }
+        respuesta.futuro.set_result(("OK", RespuestaCodificada(codificar_para(sesion, "OK", ticket))))
+    except Exception as e:
+        respuesta.futuro.set_exception(e)
+
+def resultado_diferido(respuesta) -> tuple:
+    # Se llama desde el bucle cuando la respuesta se completó (aunque la conexión ya se haya
+    # cerrado): revierte la compra que no llegó al disco, registra la latencia total del
+    # comando (incluida la espera al disco) y devuelve (status, data)
+    global COMPRAS_EN_CURSO
+    if respuesta.compra is not None:
+        COMPRAS_EN_CURSO -= 1
+        if not respuesta.durable:
+            revertir_compra(*respuesta.compra)
+    try:
+        status, data = respuesta.futuro.result()
+    except Exception as e:
+        log.error(f"No se pudo completar {respuesta.accion}: {e}")
+        status, data = "ERROR", f"La compra se registro pero no se pudo generar el ticket: {e}"
+    metricas.registrar_comando(respuesta.accion, status, (time.perf_counter() - respuesta.inicio) * 1e6)
+    return status, data
+
+def manejar_protocolo(sesion, params):
+    # PROTOCOLO BINARIO | TEXTO -> cambia el formato de los siguientes comandos.
+    # La confirmación viaja todavía en el protocolo con el que llegó la petición.
+    protocolo = " ".join(params).lower()
+    if protocolo not in ('texto', 'binario'):
+        return "ERROR", "Protocolo no soportado. Opciones: TEXTO, BINARIO."
+    confirmacion = codificar_para(sesion, "OK", {"protocolo": protocolo})
+    sesion['protocolo'] = protocolo
+    return "OK", RespuestaCodificada(confirmacion)
+
+def manejar_resume(sesion, params):
+    # RESUME <token> -> recupera el carrito (y sus reservas) de una conexión anterior
+    token = " ".join(params)
+    guardada = SESIONES.get(token)
+    if guardada is None:
+        if TRABAJADORES > 1:
+            return "ERROR", (f"Sesion desconocida o expirada. Con {TRABAJADORES} trabajadores solo se recupera "
+                             f"si la reconexion llega al mismo proceso.")
+        return "ERROR", "Sesion desconocida o expirada."
+    if guardada is not sesion:
+        adoptar_sesion(sesion, guardada)
+    return "OK", {
+        "mensaje": f"Sesion recuperada ({len(sesion['carrito'])} productos en el carrito).",
+        "token": sesion['token'],
+    }
+
+def manejar_stats(sesion, params):
+    # STATS -> contadores y percentiles de latencia por comando, lag del bucle,
+    # conexiones y bytes en buffers del proceso que atiende la conexión
+    return "OK", metricas.resumen()
+
+MANEJADORES = {
+    "VER_PRODUCTOS": manejar_ver_productos,
+    "VER_PRODUCTOS_PAGINA": manejar_ver_productos_pagina,
+    "VER_PRODUCTOS_STREAM": manejar_ver_productos_stream,
+    "BUSCAR": manejar_buscar,
+    "BUSCAR_PAGINA": manejar_buscar_pagina,
+    "BUSCAR_STREAM": manejar_buscar_stream,
+    "LISTAR": manejar_listar,
+    "LISTAR_PAGINA": manejar_listar_pagina,
+    "LISTAR_STREAM": manejar_listar_stream,
+    "LISTAR_RANGO": manejar_listar_rango,
+    "AGREGAR_CARRITO": manejar_agregar_carrito,
+    "EDITAR_CARRITO": manejar_editar_carrito,
+    "BATCH": manejar_batch,
+    "VER_CARRITO": manejar_ver_carrito,
+    "FINALIZAR_COMPRA": manejar_finalizar_compra,
+    "PROTOCOLO": manejar_protocolo,
+    "STATS": manejar_stats,
+    "RESUME": manejar_resume,
+}
+
+def ejecutar_comando(sesion, message) -> tuple:
+    # Lógica central para procesar un comando de texto ya completo
+    # Devuelve (status, data, cerrar) sin tocar el socket
+    accion, params = parseo(message)
+    return ejecutar_accion(sesion, accion, params)
+
+def ejecutar_accion(sesion, accion, params) -> tuple:
+    # Igual que ejecutar_comando con la acción ya separada (texto o trama binaria).
+    # params es la lista de palabras del comando o la lista decodificada de la trama, sin volver a unirla
+    inicio = time.perf_counter()
+    sincronizar_stock()
+    tocar_sesion(sesion)
+
+    manejador = MANEJADORES.get(accion)
+    if manejador is None:
+        respuesta_status, respuesta_data = "ERROR", f"Opción no reconocida: {accion}"
+    else:
+        respuesta_status, respuesta_data = manejador(sesion, params)
+
+    # Las acciones desconocidas se agrupan para que un cliente no pueda crear métricas sin límite.
+    # Las diferidas se registran al completarse (resultado_diferido).
+    nombre = accion if manejador is not None or accion == "SALIR" else "DESCONOCIDO"
+    if not isinstance(respuesta_data, RespuestaDiferida):
+        metricas.registrar_comando(nombre, respuesta_status, (time.perf_counter() - inicio) * 1e6)
+    return respuesta_status, respuesta_data, accion == "SALIR"
@@ -17,17 +17,23 @@ except pygame.error as e:
 SERVER_IP = "127.0.0.1"
 SERVER_PORT = 12000
 CLIENT_IP = "127.0.0.1"
-CLIENT_PORT = 12001
+CLIENT_PORT = 0 # 0: puerto libre elegido por el sistema (varios clientes pueden descargar a la vez)
 BUFFER_SIZE = 1024
+MODO = "SR" # "SR": repetición selectiva con SACK (se negocia en START); "GBN": Go-Back-N
+VENTANA_RECEPCION = 256 # Paquetes por delante del esperado que se guardan en modo SR (se anuncia al servidor)
+MAX_SACK_BLOCKS = 32 # Bloques SACK por ACK (caben en BUFFER_SIZE del servidor)
 
 HEADER_FORMAT = "!IH"
 HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+ACK_FORMAT = "!I" # Siguiente número de secuencia esperado
+SACK_FORMAT = "!II" # Bloque (inicio, fin exclusivo) recibido fuera de orden
 
 # Nombre del archivo temporal donde se guardará el MP3
 OUTPUT_FILE = "cancion_recibida.mp3" 
 
 expected_seq_num = 0 
 file_buffer = io.BytesIO() 
+fuera_de_orden = {} # seq -> payload recibido antes que los anteriores (modo SR)
 
 # Función auxiliar para validar el checksum
 def es_incorrecto(data):
@@ -39,6 +45,25 @@ def es_incorrecto(data):
     except struct.error:
         return True
 
+# Función para armar el ACK: número acumulado y, en modo SR, los bloques fuera de orden
+def construir_ack():
+    paquete_ack = struct.pack(ACK_FORMAT, expected_seq_num)
+    bloques = 0
+    inicio = anterior = None
+    for seq in sorted(fuera_de_orden):
+        if inicio is not None and seq == anterior + 1:
+            anterior = seq
+            continue
+        if inicio is not None:
+            paquete_ack += struct.pack(SACK_FORMAT, inicio, anterior + 1)
+            bloques += 1
+            if bloques == MAX_SACK_BLOCKS:
+                return paquete_ack
+        inicio = anterior = seq
+    if inicio is not None:
+        paquete_ack += struct.pack(SACK_FORMAT, inicio, anterior + 1)
+    return paquete_ack
+
 # Función para reproducir el archivo MP3 usando Pygame
 def play_mp3_file(filepath):
     if not pygame.mixer.get_init():
@@ -74,7 +99,13 @@ def client_main():
     
     # 1. Enviar solicitud de inicio al servidor
     print(f"Enviando solicitud al servidor")
-    sock.sendto(b"START", server_addr)
+    # El id distingue esta transferencia de una anterior desde la misma dirección
+    id_sesion = os.urandom(4).hex()
+    if MODO == "SR":
+        # Un servidor que no conoce SR lo ignora y usa Go-Back-N: los ACK empiezan igual
+        sock.sendto(f"START SR {VENTANA_RECEPCION} ID {id_sesion}".encode(), server_addr)
+    else:
+        sock.sendto(f"START ID {id_sesion}".encode(), server_addr)
 
     # Bucle principal de recepción y almacenamiento
     print("Iniciando recepcion de paquetes...")
@@ -93,6 +124,8 @@ def client_main():
             # 3. Finalización de la Transferencia
             if payload == b'EOF':
                 print("Transferencia completa.")
+                # Se confirma el EOF para que el servidor deje de reenviarlo
+                sock.sendto(struct.pack(ACK_FORMAT, seq_num + 1), server_addr)
                 
                 # Guarda el buffer completo en el archivo MP3
                 with open(OUTPUT_FILE, 'wb') as f:
@@ -111,19 +144,28 @@ def client_main():
                 # Almacenar los datos en el buffer
                 file_buffer.write(payload)
                 
-                # Enviar ACK para el siguiente paquete esperado
+                # Los que llegaron antes y ahora quedan en orden
                 expected_seq_num += 1
-                paquete_ack = struct.pack("!I", expected_seq_num)
-                sock.sendto(paquete_ack, server_addr)
+                while expected_seq_num in fuera_de_orden:
+                    file_buffer.write(fuera_de_orden.pop(expected_seq_num))
+                    expected_seq_num += 1
+
+                # Enviar ACK para el siguiente paquete esperado
+                sock.sendto(construir_ack(), server_addr)
                 print(f"ACK enviado")
 
+            elif MODO == "SR" and not es_incorrecto(paquete) and expected_seq_num < seq_num < expected_seq_num + VENTANA_RECEPCION:
+                # Fuera de orden: se guarda y se informa con SACK
+                print(f"Paquete fuera de orden guardado {seq_num}. Esperando {expected_seq_num}")
+                fuera_de_orden[seq_num] = payload
+                sock.sendto(construir_ack(), server_addr)
+
             else:
-                # Paquete Corrupto o Fuera de Orden
+                # Paquete Corrupto, Fuera de Orden (Go-Back-N) o duplicado
                 print(f"Paquete descartado {seq_num}. Esperando {expected_seq_num}")
                 
                 # Reenvía el ACK para el último paquete correcto
-                paquete_ack = struct.pack("!I", expected_seq_num)
-                sock.sendto(paquete_ack, server_addr)
+                sock.sendto(construir_ack(), server_addr)
                 print(f"ACK reenviado")
 
         except socket.timeout:
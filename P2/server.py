@@ -1,8 +1,13 @@
 import socket
+import selectors
 import time
 import struct
 import os
-from threading import Timer
+import random
+import bisect
+import heapq
+import itertools
+import mmap
 
 # Variables globales de configuración
 SERVER_IP = "127.0.0.1"
@@ -10,128 +15,555 @@ SERVER_PORT = 12000
 CLIENT_PORT = 12001
 BUFFER_SIZE = 1024 # Tamaño del buffer para recibir datos
 PAYLOAD_SIZE = 1000 # Controla el tamaño de los bloques de datos
-WINDOW_SIZE = 10 # Controla el número máximo de paquetes que se pueden enviar sin recibir un ACK
-TIMEOUT = 0.5 # Tiempo de espera para el timeout en segundos
+WINDOW_SIZE = 256 # Controla el número máximo de paquetes que se pueden enviar sin recibir un ACK
+TIMEOUT = 0.5 # Tiempo de espera para el timeout en segundos (RTO inicial, antes de medir el RTT)
+SACK_HABILITADO = True # Acepta la repetición selectiva (SR con SACK) si el cliente la pide en START
+PROB_PERDIDA = 0.0 # Probabilidad de descartar un paquete al enviarlo (simula un enlace con pérdidas)
+EOF_INTENTOS = 5 # Envíos del paquete EOF mientras se espera su ACK
+SACK_UMBRAL = 3 # Paquetes confirmados por encima de uno sin confirmar para darlo por perdido (modo SR)
+MAX_SESIONES = 64 # Transferencias simultáneas; las solicitudes que excedan se ignoran
+
+# Control de congestión (arranque lento, AIMD y retransmisión rápida) y RTO adaptativo
+# (Jacobson/Karels con el algoritmo de Karn): la ventana efectiva es cwnd, limitada por WINDOW_SIZE
+VENTANA_INICIAL = 4 # cwnd al empezar la transferencia (paquetes)
+DUP_ACK_UMBRAL = 3 # ACK duplicados que disparan la retransmisión rápida (Go-Back-N)
+RTO_MIN = 0.02 # Límites del RTO en segundos
+RTO_MAX = 5.0
+ALFA = 1 / 8 # Peso de cada muestra en SRTT
+BETA = 1 / 4 # Peso de cada muestra en RTTVAR
 
 MP3_FILE = "cancion.mp3" # Archivo MP3 a enviar
+LIBERAR_CADA = 1024 * 1024 # Bytes ya confirmados que se devuelven al sistema de una vez (madvise)
+
+paquetes = None # PaquetesMapeados: el archivo a enviar, dividido en paquetes bajo demanda (compartido por todas las sesiones)
 
-base = 0 # Primer número de secuencia no reconocido
-sig_num_sec = 0 # Siguiente número de secuencia a enviar
-paquetes = [] # Lista de paquetes a enviar
+# Sesiones de transferencia indexadas por la dirección del cliente. Cada una se identifica por
+# (dirección, id de sesión que el cliente manda en START) y tiene su propia ventana y temporizadores:
+# addr -> {'addr': (ip, puerto), 'id': str o None, 'etiqueta': str para los mensajes,
+#          'estado': 'datos' | 'eof', 'inicio': instante de START, 'fin': instante en que se confirmó el último paquete,
+#          'base': primer número de secuencia no reconocido, 'sig_num_sec': siguiente a enviar,
+#          'modo_sr': repetición selectiva negociada en START (si no, Go-Back-N),
+#          'ventana': WINDOW_SIZE limitada por el buffer que anuncia el cliente,
+#          'confirmados': paquetes por encima de base ya confirmados con SACK (modo SR),
+#          'confirmados_orden': los mismos en una lista ordenada, mantenida al procesar cada SACK,
+#          'sack_nuevo': llegaron confirmaciones SACK desde la última búsqueda de perdidos,
+#          'vencimientos': paquete enviado sin confirmar -> instante en que se retransmite (modo SR),
+#          'recuperados': paquetes ya reenviados (por el SACK o su temporizador) que no vuelve a reenviar el SACK (modo SR),
+#          'retransmisiones': paquetes reenviados,
+#          'cwnd': ventana de congestión (en paquetes; crece en fracciones al evitar la congestión),
+#          'ssthresh': umbral entre arranque lento y crecimiento lineal,
+#          'srtt', 'rttvar': RTT suavizado y su variación (None hasta la primera muestra), 'rto': tiempo de retransmisión,
+#          'envio_unico': paquete enviado una sola vez -> instante del envío; solo estos dan muestras de RTT (Karn),
+#          'mayor_enviado': siguiente número de secuencia que nunca se envió (los anteriores se reenvían),
+#          'acks_duplicados': ACK seguidos que no avanzaron base (Go-Back-N),
+#          'recuperacion_hasta': una pérdida antes de que base llegue aquí no vuelve a reducir cwnd,
+#          'timer': instante en que vence el temporizador de Go-Back-N (None si está detenido),
+#          'timer_en_cola': vencimiento con el que está en TEMPORIZADORES (se reprograma al sacarlo si el timer se movió),
+#          'eof_intentos', 'eof_vence': reenvíos del EOF}
+SESIONES = {}
+
+# Temporizadores de todas las sesiones en un heap que revisa el bucle principal (sin hilos):
+# (vence, orden, sesion, clave) con clave 'gbn', 'eof' o el número de secuencia de un paquete SR.
+# No se borran al cancelarlos: al salir del heap se descartan si ya no coinciden con la sesión
+TEMPORIZADORES = []
+orden_temporizadores = itertools.count() # Desempate entre vencimientos iguales (las sesiones no se comparan)
 
 HEADER_FORMAT = "!IH" # Formato del encabezado: Número de secuencia (4 bytes), Checksum (2 bytes)
 HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
 
-# Función para crear un paquete
+# ACK: siguiente número de secuencia esperado (4 bytes). En modo SR le siguen bloques SACK
+# (inicio, fin exclusivo) de paquetes recibidos fuera de orden; un servidor Go-Back-N solo lee los 4 primeros bytes
+ACK_FORMAT = "!I"
+SACK_FORMAT = "!II"
+ACK_SIZE = struct.calcsize(ACK_FORMAT)
+SACK_SIZE = struct.calcsize(SACK_FORMAT)
+
+# Buffer de envío preasignado (solo el bucle principal envía)
+BUFFER_ENVIO = memoryview(bytearray(HEADER_SIZE + PAYLOAD_SIZE))
+
+# Función para crear un paquete: encabezado y datos se escriben en el buffer de envío.
+# Devuelve una vista de la parte usada, válida hasta que se arme el siguiente paquete
 def construir_paquete(seq_num, data):
-    checksum = sum(data) % 65535 
-    header = struct.pack(HEADER_FORMAT, seq_num, checksum)
-    return header + data
+    vista = BUFFER_ENVIO
+    checksum = sum(data) % 65535
+    struct.pack_into(HEADER_FORMAT, vista, 0, seq_num, checksum)
+    fin = HEADER_SIZE + len(data)
+    vista[HEADER_SIZE:fin] = data
+    return vista[:fin]
+
+class PaquetesMapeados:
+    # El archivo mapeado en memoria (mmap): paquetes[i] es una vista de los bytes del paquete i,
+    # sin copiarlos ni leer el archivo completo antes de empezar. El sistema carga las páginas al
+    # tocarlas y liberar_hasta() devuelve las ya confirmadas, así lo residente queda del orden de la ventana
+
+    def __init__(self, ruta):
+        self.archivo = open(ruta, 'rb')
+        self.tamano = os.fstat(self.archivo.fileno()).st_size
+        self.mapeo = None
+        self.vista = memoryview(b'')
+        if self.tamano:
+            # mmap no admite archivos vacíos
+            self.mapeo = mmap.mmap(self.archivo.fileno(), 0, access=mmap.ACCESS_READ)
+            self.vista = memoryview(self.mapeo)
+        self.total = -(-self.tamano // PAYLOAD_SIZE)
+        self.liberado = 0 # Hasta aquí (bytes) ya se devolvió al sistema lo que confirmó la transferencia más atrasada
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, i):
+        return self.vista[i * PAYLOAD_SIZE:(i + 1) * PAYLOAD_SIZE]
+
+    def liberar_hasta(self, i):
+        # Los paquetes anteriores a i ya se confirmaron: sus páginas pueden salir de la memoria
+        # (si se vuelven a tocar, el sistema las lee de nuevo del archivo)
+        fin = i * PAYLOAD_SIZE // mmap.PAGESIZE * mmap.PAGESIZE
+        if fin < self.liberado:
+            # Una transferencia nueva empezó más abajo y vuelve a cargar esas páginas:
+            # se liberan otra vez a medida que avance desde la página de i
+            self.liberado = fin
+            return
+        if self.mapeo is None or not hasattr(mmap, 'MADV_DONTNEED') or fin - self.liberado < LIBERAR_CADA:
+            return
+        self.mapeo.madvise(mmap.MADV_DONTNEED, self.liberado, fin - self.liberado)
+        self.liberado = fin
+
+    def cerrar(self):
+        self.vista.release()
+        if self.mapeo is not None:
+            self.mapeo.close()
+        self.archivo.close()
 
 # Función auxiliar para inicializar los paquetes a partir del archivo
 def inicializar_paquetes():
     global paquetes
     try:
-        with open(MP3_FILE, 'rb') as f:
-            data = f.read(PAYLOAD_SIZE)
-            while data:
-                paquetes.append(data) 
-                data = f.read(PAYLOAD_SIZE)
-        print(f"Archivo MP3 cargado. Total de paquetes: {len(paquetes)}")
+        paquetes = PaquetesMapeados(MP3_FILE)
+        print(f"Archivo MP3 mapeado. Total de paquetes: {len(paquetes)}")
     except FileNotFoundError:
         print(f"ERROR: Archivo '{MP3_FILE}' no encontrado.")
         exit()
 
-timer = None
-# Función para iniciar o reiniciar el temporizador
-def inicio_tiempo(sock, client_addr):
-    global timer
-    if timer:
-        timer.cancel()
-    
-    timer = Timer(TIMEOUT, retransmitir, [sock, client_addr])
-    timer.start()
+# Función para crear la sesión de un cliente con su propia ventana y temporizadores
+def nueva_sesion(client_addr, id_sesion):
+    return {
+        'addr': client_addr, 'id': id_sesion, 'etiqueta': f"{client_addr[0]}:{client_addr[1]}",
+        'estado': 'datos', 'inicio': time.monotonic(), 'fin': None,
+        'base': 0, 'sig_num_sec': 0, 'modo_sr': False, 'ventana': WINDOW_SIZE,
+        'confirmados': set(), 'confirmados_orden': [], 'sack_nuevo': False,
+        'vencimientos': {}, 'recuperados': set(), 'retransmisiones': 0,
+        'cwnd': VENTANA_INICIAL, 'ssthresh': WINDOW_SIZE, 'srtt': None, 'rttvar': None, 'rto': TIMEOUT,
+        'envio_unico': {}, 'mayor_enviado': 0, 'acks_duplicados': 0, 'recuperacion_hasta': 0,
+        'timer': None, 'timer_en_cola': None, 'eof_intentos': 0, 'eof_vence': None,
+    }
+
+# Función para interpretar la solicitud: "START [SR <ventana de recepción>] [ID <sesión>]"
+# ("START" solo: Go-Back-N, sin id)
+def negociar_modo(sesion, partes):
+    sesion['modo_sr'] = SACK_HABILITADO and len(partes) > 1 and partes[1].upper() == "SR"
+    if sesion['modo_sr'] and len(partes) > 2 and partes[2].isdigit():
+        # El cliente solo guarda esa cantidad de paquetes por delante del que espera
+        sesion['ventana'] = max(1, min(WINDOW_SIZE, int(partes[2])))
+    print(f"[{sesion['etiqueta']}] Modo de transferencia: "
+          f"{'Repeticion selectiva (SACK)' if sesion['modo_sr'] else 'Go-Back-N'}, ventana {sesion['ventana']}")
+
+# Función para atender un START: crea la sesión del cliente (o reemplaza la anterior de esa dirección)
+def iniciar_sesion(start_msg, client_addr):
+    partes = start_msg.decode(errors='replace').split()
+    id_sesion = None
+    if "ID" in partes[:-1]:
+        id_sesion = partes[partes.index("ID") + 1]
+    existente = SESIONES.get(client_addr)
+    if existente is not None:
+        if id_sesion is not None and existente['id'] == id_sesion:
+            # START repetido de una sesión en curso
+            return
+        print(f"[{existente['etiqueta']}] Sesion reemplazada por una nueva solicitud.")
+        cerrar_sesion(existente)
+    elif len(SESIONES) >= MAX_SESIONES:
+        print(f"Solicitud de {client_addr} ignorada: hay {MAX_SESIONES} transferencias en curso.")
+        return
+    sesion = nueva_sesion(client_addr, id_sesion)
+    SESIONES[client_addr] = sesion
+    print(f"Cliente conectado desde {client_addr}. Iniciando transferencia...")
+    negociar_modo(sesion, partes)
+
+# Función para terminar una sesión y detener su temporizador
+def cerrar_sesion(sesion):
+    detener_tiempo(sesion)
+    if SESIONES.get(sesion['addr']) is sesion:
+        del SESIONES[sesion['addr']]
+
+# Función para enviar un paquete (con la pérdida simulada de PROB_PERDIDA)
+def enviar(sock, packet, client_addr):
+    if PROB_PERDIDA and random.random() < PROB_PERDIDA:
+        return
+    try:
+        sock.sendto(packet, client_addr)
+    except BlockingIOError:
+        # Buffer de envío lleno: se pierde como cualquier datagrama y se retransmite
+        pass
+
+# Función para leer un ACK: (número acumulado, [(inicio, fin)] de los bloques SACK)
+def leer_ack(paquete_ack):
+    num_sec_ack = struct.unpack(ACK_FORMAT, paquete_ack[:ACK_SIZE])[0]
+    bloques = []
+    for i in range(ACK_SIZE, len(paquete_ack) - SACK_SIZE + 1, SACK_SIZE):
+        bloques.append(struct.unpack(SACK_FORMAT, paquete_ack[i:i + SACK_SIZE]))
+    return num_sec_ack, bloques
+
+# Función que devuelve cuántos paquetes pueden estar sin confirmar
+def ventana_actual(sesion):
+    return max(1, min(int(sesion['cwnd']), sesion['ventana']))
+
+# Función para actualizar el RTO con una muestra de RTT (Jacobson/Karels, RFC 6298)
+def muestra_rtt(sesion, muestra):
+    if sesion['srtt'] is None:
+        sesion['srtt'] = muestra
+        sesion['rttvar'] = muestra / 2
+    else:
+        sesion['rttvar'] = (1 - BETA) * sesion['rttvar'] + BETA * abs(sesion['srtt'] - muestra)
+        sesion['srtt'] = (1 - ALFA) * sesion['srtt'] + ALFA * muestra
+    sesion['rto'] = min(RTO_MAX, max(RTO_MIN, sesion['srtt'] + 4 * sesion['rttvar']))
+
+# Función para registrar paquetes recién confirmados: toma una muestra de RTT y abre cwnd
+# (uno por paquete en arranque lento, 1/cwnd por paquete en evitación de congestión)
+def paquetes_confirmados(sesion, seqs):
+    ahora = time.monotonic()
+    nuevos = 0
+    ultimo_envio = None
+    for i in seqs:
+        nuevos += 1
+        enviado = sesion['envio_unico'].pop(i, None)
+        if enviado is not None and (ultimo_envio is None or enviado > ultimo_envio):
+            ultimo_envio = enviado
+    if ultimo_envio is not None:
+        # El ACK lo generó el más reciente de los paquetes confirmados
+        muestra_rtt(sesion, ahora - ultimo_envio)
+    if not nuevos:
+        return
+    if sesion['cwnd'] < sesion['ssthresh']:
+        sesion['cwnd'] += nuevos
+    else:
+        sesion['cwnd'] += nuevos / sesion['cwnd']
+    sesion['cwnd'] = min(sesion['cwnd'], sesion['ventana'])
+
+# Función que reduce la ventana ante una pérdida: a la mitad si la detectaron ACK duplicados
+# o el SACK (una vez por ventana), a un paquete y con el RTO duplicado si venció un temporizador.
+# El RTO duplicado se conserva hasta la siguiente muestra válida (Karn)
+def reducir_ventana(sesion, por_tiempo):
+    if not por_tiempo and sesion['base'] < sesion['recuperacion_hasta']:
+        return
+    sesion['ssthresh'] = max(2, ventana_actual(sesion) // 2)
+    if por_tiempo:
+        sesion['cwnd'] = 1
+        sesion['rto'] = min(RTO_MAX, sesion['rto'] * 2)
+    else:
+        sesion['cwnd'] = sesion['ssthresh']
+    sesion['recuperacion_hasta'] = sesion['sig_num_sec']
+    print(f"[{sesion['etiqueta']}] Perdida detectada ({'timeout' if por_tiempo else 'rapida'}). "
+          f"cwnd {sesion['cwnd']:.1f}, ssthresh {sesion['ssthresh']}, RTO {sesion['rto'] * 1000:.0f} ms")
+
+# Función para agregar un vencimiento al heap de temporizadores
+def programar(sesion, clave, vence):
+    heapq.heappush(TEMPORIZADORES, (vence, next(orden_temporizadores), sesion, clave))
+
+# Función para iniciar o reiniciar el temporizador de Go-Back-N. Si vence después que la
+# entrada que ya está en el heap solo se mueve sesion['timer'] (la entrada se reprograma al salir);
+# si vence antes (el RTO bajó) se agrega una nueva y la anterior queda descartada
+def inicio_tiempo(sesion):
+    sesion['timer'] = time.monotonic() + sesion['rto']
+    if sesion['timer_en_cola'] is None or sesion['timer'] < sesion['timer_en_cola']:
+        sesion['timer_en_cola'] = sesion['timer']
+        programar(sesion, 'gbn', sesion['timer'])
 
 # Función para detener el temporizador
-def detener_tiempo():
-    global timer
-    if timer:
-        timer.cancel()
-        timer = None
+def detener_tiempo(sesion):
+    sesion['timer'] = None
+
+# Función para programar el temporizador de un paquete en modo SR
+def inicio_tiempo_paquete(sesion, seq_num):
+    vence = time.monotonic() + sesion['rto']
+    sesion['vencimientos'][seq_num] = vence
+    programar(sesion, seq_num, vence)
 
 # Función de retransmisión en caso de timeout desde 'base'
-def retransmitir(sock, client_addr):
-    global base, sig_num_sec
-    print(f"\nTiempo expirado. Retransmitiendo desde base: {base}")
+def retransmitir(sesion, sock):
+    print(f"\n[{sesion['etiqueta']}] Tiempo expirado. Retransmitiendo desde base: {sesion['base']}")
+    reducir_ventana(sesion, True)
+    reenviar_desde_base(sesion, sock)
+    inicio_tiempo(sesion)
+
+# Función de Go-Back-N: reenvía desde 'base' lo que permite la ventana ya reducida; el resto
+# vuelve a salir desde el bucle principal a medida que la ventana se abra
+def reenviar_desde_base(sesion, sock):
+    base, sig_num_sec = sesion['base'], sesion['sig_num_sec']
+    fin = min(sig_num_sec, base + ventana_actual(sesion))
     for i in range(base, sig_num_sec):
+        sesion['envio_unico'].pop(i, None)
+    for i in range(base, fin):
         data_paquete = paquetes[i]
         packet = construir_paquete(i, data_paquete)
-        sock.sendto(packet, client_addr)
-    inicio_tiempo(sock, client_addr)
+        enviar(sock, packet, sesion['addr'])
+        sesion['retransmisiones'] += 1
+    sesion['sig_num_sec'] = fin
 
-def server_main():
-    global base, sig_num_sec, paquetes
+# Función para procesar un ACK en modo Go-Back-N
+def procesar_ack_gbn(sesion, sock, num_sec_ack):
+    base = sesion['base']
+    if base < num_sec_ack:
+        print(f"[{sesion['etiqueta']}] Recibido ACK para seq_num {num_sec_ack} (espera {num_sec_ack})")
+
+        paquetes_confirmados(sesion, range(base, num_sec_ack))
+        sesion['base'] = num_sec_ack
+        # Tras reducir la ventana pudo llegar el ACK de paquetes que ya habían salido
+        sesion['sig_num_sec'] = max(sesion['sig_num_sec'], num_sec_ack)
+        sesion['acks_duplicados'] = 0
+
+        if sesion['base'] < sesion['sig_num_sec']:
+            inicio_tiempo(sesion)
+        else:
+            detener_tiempo(sesion)
+    elif num_sec_ack == base and base < sesion['sig_num_sec']:
+        sesion['acks_duplicados'] += 1
+        if sesion['acks_duplicados'] == DUP_ACK_UMBRAL and base >= sesion['recuperacion_hasta']:
+            # Retransmisión rápida: no se espera a que venza el temporizador
+            print(f"[{sesion['etiqueta']}] {DUP_ACK_UMBRAL} ACK duplicados. Retransmitiendo desde base: {base}")
+            reducir_ventana(sesion, False)
+            reenviar_desde_base(sesion, sock)
+            inicio_tiempo(sesion)
+    else:
+        print(f"[{sesion['etiqueta']}] ACK no esperado {num_sec_ack} (Base: {base}). Ignorado.")
+
+# Función para procesar un ACK en modo SR: avanza base y marca los bloques SACK
+def procesar_sack(sesion, num_sec_ack, bloques):
+    confirmados, vencimientos, recuperados = sesion['confirmados'], sesion['vencimientos'], sesion['recuperados']
+    orden = sesion['confirmados_orden']
+    base, sig_num_sec = sesion['base'], sesion['sig_num_sec']
+    nuevos = []
+    for inicio, fin in bloques:
+        for i in range(max(inicio, base), min(fin, sig_num_sec)):
+            if i not in confirmados:
+                confirmados.add(i)
+                bisect.insort(orden, i)
+                nuevos.append(i)
+                sesion['sack_nuevo'] = True
+            vencimientos.pop(i, None)
+            recuperados.discard(i)
+    if num_sec_ack > base:
+        print(f"[{sesion['etiqueta']}] Recibido ACK para seq_num {num_sec_ack} ({len(bloques)} bloques SACK)")
+        for i in range(base, min(num_sec_ack, sig_num_sec)):
+            if i in confirmados:
+                confirmados.discard(i)
+            else:
+                nuevos.append(i)
+            vencimientos.pop(i, None)
+            recuperados.discard(i)
+        base = min(num_sec_ack, sig_num_sec)
+    # Un ACK acumulado perdido no detiene la ventana si el SACK ya cubrió esos paquetes
+    while base in confirmados:
+        confirmados.discard(base)
+        base += 1
+    # Los que quedaron por debajo de base salen de la lista ordenada (siempre son los primeros)
+    del orden[:bisect.bisect_left(orden, base)]
+    sesion['base'] = base
+    paquetes_confirmados(sesion, nuevos)
+
+# Función de retransmisión selectiva: solo los paquetes cuyo temporizador venció (los que
+# saca del heap atender_temporizadores) o que el SACK muestra perdidos (SACK_UMBRAL
+# confirmados por encima); estos se reenvían una sola vez antes de volver a depender de su temporizador.
+# Los perdidos solo se buscan cuando el SACK trajo confirmaciones nuevas: sin ellas ningún paquete
+# pendiente pudo llegar al umbral
+def retransmitir_vencidos(sesion, sock, vencidos=()):
+    vencimientos, recuperados = sesion['vencimientos'], sesion['recuperados']
+    vencidos = list(vencidos)
+    perdidos = []
+    orden = sesion['confirmados_orden']
+    if sesion['sack_nuevo'] and len(orden) >= SACK_UMBRAL:
+        # Un paquete tiene SACK_UMBRAL confirmados por encima si es menor que el SACK_UMBRAL-ésimo mayor
+        umbral = orden[-SACK_UMBRAL]
+        excluidos = recuperados.union(vencidos)
+        perdidos = [i for i in vencimientos if i < umbral and i not in excluidos]
+    sesion['sack_nuevo'] = False
+    # Un solo ajuste de cwnd y del RTO por vuelta, aunque venzan varios temporizadores juntos
+    if vencidos:
+        reducir_ventana(sesion, True)
+    elif perdidos:
+        reducir_ventana(sesion, False)
+    for i in perdidos:
+        print(f"[{sesion['etiqueta']}] SACK indica perdida. Retransmitiendo paquete {i}")
+        recuperados.add(i)
+    for i in vencidos:
+        print(f"[{sesion['etiqueta']}] Tiempo expirado. Retransmitiendo paquete {i}")
+        recuperados.add(i)
+    for i in vencidos + perdidos:
+        sesion['envio_unico'].pop(i, None)
+        enviar(sock, construir_paquete(i, paquetes[i]), sesion['addr'])
+        inicio_tiempo_paquete(sesion, i)
+        sesion['retransmisiones'] += 1
+
+# Función para enviar paquetes nuevos de una sesión mientras su ventana esté abierta
+def enviar_ventana(sesion, sock):
+    while sesion['sig_num_sec'] < sesion['base'] + ventana_actual(sesion) and sesion['sig_num_sec'] < len(paquetes):
+        sig_num_sec = sesion['sig_num_sec']
+        data_paquete = paquetes[sig_num_sec]
+        packet = construir_paquete(sig_num_sec, data_paquete)
+        enviar(sock, packet, sesion['addr'])
+        print(f"[{sesion['etiqueta']}] Enviando paquete {sig_num_sec}")
+
+        if sig_num_sec >= sesion['mayor_enviado']:
+            sesion['envio_unico'][sig_num_sec] = time.monotonic()
+            sesion['mayor_enviado'] = sig_num_sec + 1
+        else:
+            # Go-Back-N: ya salió antes de que se redujera la ventana
+            sesion['retransmisiones'] += 1
+
+        if sesion['modo_sr']:
+            # Cada paquete tiene su propio temporizador
+            inicio_tiempo_paquete(sesion, sig_num_sec)
+        elif sesion['base'] == sig_num_sec:
+            inicio_tiempo(sesion)
+
+        sesion['sig_num_sec'] = sig_num_sec + 1
+
+# Función para cerrar la transferencia: se reenvía EOF hasta que el cliente lo confirme
+# (un cliente que no confirma el EOF lo recibe igual; el servidor deja de insistir tras EOF_INTENTOS)
+def enviar_eof(sesion, sock):
+    if sesion['eof_intentos'] >= EOF_INTENTOS:
+        print(f"[{sesion['etiqueta']}] El cliente no confirmo el EOF.")
+        cerrar_sesion(sesion)
+        return
+    enviar(sock, construir_paquete(len(paquetes), b'EOF'), sesion['addr'])
+    sesion['eof_intentos'] += 1
+    sesion['eof_vence'] = time.monotonic() + TIMEOUT
+    programar(sesion, 'eof', sesion['eof_vence'])
+
+# Función para atender un datagrama recibido: un START o el ACK de una sesión
+def recibir(sock, datos, client_addr):
+    if datos.startswith(b"START"):
+        iniciar_sesion(datos, client_addr)
+        return
+    sesion = SESIONES.get(client_addr)
+    if sesion is None or len(datos) < ACK_SIZE:
+        return
+    num_sec_ack, bloques = leer_ack(datos)
+    if sesion['estado'] == 'eof':
+        if num_sec_ack > len(paquetes):
+            print(f"[{sesion['etiqueta']}] EOF confirmado.")
+            cerrar_sesion(sesion)
+    elif sesion['modo_sr']:
+        procesar_sack(sesion, num_sec_ack, bloques)
+    else:
+        procesar_ack_gbn(sesion, sock, num_sec_ack)
+
+# Función que saca del heap los temporizadores vencidos y los atiende. Se descartan los de
+# sesiones cerradas y los que ya no coinciden con la sesión (paquete confirmado, timer detenido o movido)
+def atender_temporizadores(sock):
+    ahora = time.monotonic()
+    vencidos_sr = {} # addr -> (sesion, paquetes vencidos), para reducir cwnd una sola vez por sesión
+    while TEMPORIZADORES and TEMPORIZADORES[0][0] <= ahora:
+        vence, _, sesion, clave = heapq.heappop(TEMPORIZADORES)
+        if SESIONES.get(sesion['addr']) is not sesion:
+            continue
+        if clave == 'gbn':
+            if sesion['timer_en_cola'] != vence:
+                continue
+            sesion['timer_en_cola'] = None
+            if sesion['timer'] is None or sesion['estado'] != 'datos':
+                continue
+            if sesion['timer'] > ahora:
+                # Se reinició después de programarlo: vuelve al heap con el vencimiento actual
+                sesion['timer_en_cola'] = sesion['timer']
+                programar(sesion, 'gbn', sesion['timer'])
+                continue
+            retransmitir(sesion, sock)
+        elif clave == 'eof':
+            if sesion['estado'] == 'eof' and sesion['eof_vence'] == vence:
+                enviar_eof(sesion, sock)
+        elif sesion['vencimientos'].get(clave) == vence:
+            vencidos_sr.setdefault(sesion['addr'], (sesion, []))[1].append(clave)
+    for sesion, vencidos in vencidos_sr.values():
+        retransmitir_vencidos(sesion, sock, vencidos)
+
+# Función que avanza una sesión: pérdidas que indica el SACK, paquetes nuevos y cierre
+def atender_sesion(sesion, sock):
+    if sesion['estado'] == 'eof':
+        return
 
-    # Configuración del socket UDP
+    if sesion['modo_sr']:
+        retransmitir_vencidos(sesion, sock)
+    enviar_ventana(sesion, sock)
+
+    if sesion['base'] >= len(paquetes):
+        # 4. Finalización
+        detener_tiempo(sesion)
+        duracion = time.monotonic() - sesion['inicio']
+        print(f"[{sesion['etiqueta']}] Transferencia de archivo completada en {duracion:.2f} s "
+              f"({paquetes.tamano / 1024 / duracion:.1f} KB/s, {sesion['retransmisiones']} retransmisiones).")
+        if sesion['srtt'] is not None:
+            print(f"[{sesion['etiqueta']}] cwnd final {sesion['cwnd']:.1f}, SRTT {sesion['srtt'] * 1000:.2f} ms, "
+                  f"RTO {sesion['rto'] * 1000:.0f} ms")
+        sesion['estado'] = 'eof'
+        enviar_eof(sesion, sock)
+
+# Función que calcula cuánto puede esperar el selector: hasta el próximo temporizador
+# (el timeout de la espera es el tic de los temporizadores)
+def espera_bucle():
+    if not TEMPORIZADORES:
+        return TIMEOUT
+    return min(TIMEOUT, max(0.0, TEMPORIZADORES[0][0] - time.monotonic()))
+
+# Función para devolver al sistema las páginas que ya confirmaron todas las sesiones en curso:
+# hasta la base más baja, que retrocede cuando empieza una transferencia nueva
+def liberar_confirmados():
+    bases = [sesion['base'] for sesion in SESIONES.values() if sesion['estado'] == 'datos']
+    if bases:
+        paquetes.liberar_hasta(min(bases))
+
+def server_main():
+    # Configuración del socket UDP: un solo socket y un solo bucle para todos los clientes
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.bind((SERVER_IP, SERVER_PORT))
-    
-    inicializar_paquetes()
+    sock.setblocking(False)
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
 
-    # Espera la solicitud del cliente
-    print(f"Servidor esperando la solicitud del cliente")
-    start_msg, client_addr = sock.recvfrom(BUFFER_SIZE)
-    print(f"Cliente conectado desde {client_addr}. Iniciando transferencia...")
+    inicializar_paquetes()
 
-    # Configuración de timeout para la recepción de ACKs
-    sock.settimeout(TIMEOUT)
+    # Espera las solicitudes de los clientes
+    print(f"Servidor esperando solicitudes de clientes")
 
     # Bucle principal de envío y control
-    while base < len(paquetes):
-        # 1. Enviar paquetes mientras la ventana esté abierta
-        while sig_num_sec < base + WINDOW_SIZE and sig_num_sec < len(paquetes):
-            data_paquete = paquetes[sig_num_sec]
-            packet = construir_paquete(sig_num_sec, data_paquete)
-            sock.sendto(packet, client_addr)
-            print(f"Enviando paquete {sig_num_sec}")
-
-            if base == sig_num_sec:
-                inicio_tiempo(sock, client_addr)
-
-            sig_num_sec += 1
-
-        # 2. Esperar ACKs o Timeout
-        try:
-            paquete_ack, _ = sock.recvfrom(BUFFER_SIZE)
-            num_sec_ack = struct.unpack("!I", paquete_ack[:4])[0]
-            
-            if base <= num_sec_ack:
-                print(f"Recibido ACK para seq_num {num_sec_ack} (espera {num_sec_ack})")
-                
-                base = num_sec_ack
-                
-                if base < sig_num_sec:
-                    inicio_tiempo(sock, client_addr)
-                else:
-                    detener_tiempo() 
-            else:
-                print(f"ACK no esperado {num_sec_ack} (Base: {base}). Ignorado.")
-
-        except socket.timeout:
-            pass 
-        except Exception as e:
-            print(f"Error: {e}")
-            break
-
-    # 3. Finalización 
-    if base == len(paquetes):
-        eof_packet = construir_paquete(len(paquetes), b'EOF')
-        sock.sendto(eof_packet, client_addr)
-        print("Transferencia de archivo completada.")
-
-    if timer:
-        timer.cancel()
+    try:
+        while True:
+            # 1. Esperar ACKs, solicitudes o el próximo timeout
+            if selector.select(espera_bucle()):
+                while True:
+                    try:
+                        datos, client_addr = sock.recvfrom(BUFFER_SIZE)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except ConnectionResetError:
+                        # ICMP de un cliente que ya cerró su socket
+                        continue
+                    recibir(sock, datos, client_addr)
+
+            # 2. Retransmitir lo que venció
+            atender_temporizadores(sock)
+
+            # 3. Enviar paquetes de cada sesión mientras su ventana esté abierta
+            for sesion in list(SESIONES.values()):
+                atender_sesion(sesion, sock)
+
+            liberar_confirmados()
+    except KeyboardInterrupt:
+        print("Servidor detenido manualmente.")
+
+    for sesion in list(SESIONES.values()):
+        cerrar_sesion(sesion)
+    selector.close()
     sock.close()
+    paquetes.cerrar()
 
 if __name__ == "__main__":
-    server_main()
\ No newline at end of file
+    server_main()
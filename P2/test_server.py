@@ -0,0 +1,89 @@
+# Pruebas del servidor de transferencia -> Páginas del archivo mapeado que se devuelven al sistema
+#
+# Ejecutar desde P2: python -m unittest test_server
+
+import mmap
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import server
+
+@unittest.skipUnless(hasattr(mmap, 'MADV_DONTNEED'), "madvise(MADV_DONTNEED) no está disponible")
+class PruebaPaquetesMapeados(unittest.TestCase):
+    # Archivo de 4 MB mapeado; madvise se observa a través de un Mock que envuelve al mmap real
+
+    def setUp(self):
+        archivo = tempfile.NamedTemporaryFile(delete=False)
+        archivo.write(os.urandom(4 * 1024 * 1024))
+        archivo.close()
+        self.addCleanup(os.remove, archivo.name)
+        self.paquetes = server.PaquetesMapeados(archivo.name)
+        self.addCleanup(self.paquetes.cerrar)
+        self.paquetes.mapeo = mock.Mock(wraps=self.paquetes.mapeo)
+
+    def liberados(self):
+        # (inicio, fin) de cada madvise desde la última llamada
+        llamadas = [(inicio, inicio + largo) for _, inicio, largo in
+                    (llamada.args for llamada in self.paquetes.mapeo.madvise.call_args_list)]
+        self.paquetes.mapeo.madvise.reset_mock()
+        return llamadas
+
+    def transferir(self, desde=0):
+        # Una transferencia confirma sus paquetes de a 10
+        for base in range(desde, len(self.paquetes) + 1, 10):
+            self.paquetes.liberar_hasta(base)
+
+class PruebasLiberarHasta(PruebaPaquetesMapeados):
+
+    def test_transferencias_seguidas(self):
+        for num in range(2):
+            with self.subTest(transferencia=num):
+                self.transferir()
+                liberados = self.liberados()
+                self.assertTrue(liberados)
+                self.assertEqual(liberados[0][0], 0)
+                self.assertGreaterEqual(liberados[-1][1], self.paquetes.tamano - server.LIBERAR_CADA - mmap.PAGESIZE)
+
+class PruebasSesionesConcurrentes(PruebaPaquetesMapeados):
+    # Con varias sesiones se libera hasta la base más baja de las que siguen enviando datos
+
+    def setUp(self):
+        super().setUp()
+        for modulo, nombre, valor in [(server, 'paquetes', self.paquetes), (server, 'SESIONES', {})]:
+            self.addCleanup(setattr, modulo, nombre, getattr(modulo, nombre))
+            setattr(modulo, nombre, valor)
+
+    def avanzar(self, sesiones, hasta):
+        # Avanza las bases de las sesiones de a 10 paquetes; cada madvise debe quedar por
+        # debajo de la base más baja en ese momento
+        while any(sesion['base'] < hasta for sesion in sesiones):
+            for sesion in sesiones:
+                sesion['base'] = min(sesion['base'] + 10, hasta, len(self.paquetes))
+            server.liberar_confirmados()
+            minimo = min(s['base'] for s in server.SESIONES.values() if s['estado'] == 'datos')
+            for inicio, fin in self.liberados():
+                self.assertLessEqual(fin, minimo * server.PAYLOAD_SIZE)
+                yield inicio, fin
+
+    def test_sesiones_desfasadas(self):
+        total = len(self.paquetes)
+        primera = server.SESIONES[("127.0.0.1", 1)] = server.nueva_sesion(("127.0.0.1", 1), "a")
+        self.assertTrue(list(self.avanzar([primera], total // 2)))
+
+        # La segunda empieza cuando la primera va por la mitad
+        segunda = server.SESIONES[("127.0.0.1", 2)] = server.nueva_sesion(("127.0.0.1", 2), "b")
+        server.liberar_confirmados()
+        self.assertEqual(self.paquetes.liberado, 0)
+        liberados = list(self.avanzar([primera, segunda], total))
+        self.assertTrue(liberados)
+
+        # La primera terminó; la segunda sigue liberando hasta el final del archivo
+        primera['estado'] = 'eof'
+        liberados += list(self.avanzar([segunda], total))
+        self.assertEqual(liberados[0][0], 0)
+        self.assertGreaterEqual(liberados[-1][1], self.paquetes.tamano - server.LIBERAR_CADA - mmap.PAGESIZE)
+
+if __name__ == "__main__":
+    unittest.main()